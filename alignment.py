@@ -2,13 +2,22 @@
 #Main file and algorithm for SPAD alignment
 
 from pylablib.devices import Thorlabs
+from processes import *
+from recipes import RecipeStore
+from tracking import DriftTracker
+import batch
+import checkpoint
+import darkcal
+import meters
+import processes
 import math
+import numpy as np
 
 #constant values that define scan process
 #_______________________________________________________________________________
 #Factor to compare device dark current to measured signal current
-sigFact = input("Enter noise exceedance factor for measurement comparison\
-(recommended value: 2)")
+sigFact = float(input("Enter noise exceedance factor for measurement comparison\
+(recommended value: 2)"))
 
 #Dimensions of the planar scan area [millimetres]
 dim = 24.984
@@ -17,34 +26,144 @@ dim = 24.984
 centPos = 428800
 
 #Coarse step size for scan and alignment processes [micrometres]
-stepC = input("Enter coarse step size (\u03BC" + "m) for incremental movements\
- (recommended values:)")
+#(recommended values from autotune.py for 1/e^2 spot radii of about 20 / 60 /
+#150 micrometres: 25 / 100 / 100)
+stepC = float(input("Enter coarse step size (\u03BC" + "m) for incremental movements\
+ (recommended values: 25 for small spots, 100 for spots of 60 \u03BC" + "m and up)"))
 
 #Limit that controls maximum number of steps in certain direction for
 #single-axis optimization
-stepLim = input("Enter step limit for single-axis optimization\
-(recommended values:)")
+stepLim = int(input("Enter step limit for single-axis optimization\
+ (recommended values: 200 for small spots, 50-100 for larger spots)"))
 
 #Limit that controls number of optimization cylces for multi-axis Realignment
-opt = input("Enter cycle count limit for multi-axis optimization\
- (recommended values:)")
+opt = int(input("Enter cycle count limit for multi-axis optimization\
+ (recommended values: 30 for small spots, 10 for larger spots)"))
 
 #Threshold factor to define appropriate decline in photocurrent during alignment
-threshFact = input("Enter relative intensity factor to set as device\
- photocurrent threshold (recommended value: 0.9)")
+threshFact = float(input("Enter relative intensity factor to set as device\
+ photocurrent threshold (recommended values: 0.9 for small spots, 0.8 for larger\
+ spots)"))
+
+#Number of dark current readings taken during calibration (noise statistics
+#for the sequential signal test)
+darkSamples = 10
+
+#Error rate of sequential signal test (None for a single reading per check)
+processes.checkErr = 0.01
+
+#Dark current noise standard deviations a signal must exceed the dark current
+#by (None for the noise exceedance factor alone)
+processes.noiseFact = None
+
+#VISA resource of the source meter (empty to read the DMM), and bias voltage
+#of the DUT [V]
+meterResource = ""
+meterBias = 0.0
+
+#Number of samples averaged per reading of single-axis optimization and signal
+#checks (taken in one bulk transfer with the source meter)
+processes.avgSamples = 1
+
+#Beam profile model fitted during coarse optimization ("gauss" or "lorentz";
+#None for edge search)
+coarseModel = None
+
+#Boolean that selects Brent search for fine optimization (instead of edge
+#search)
+fineBrent = False
+
+#Boolean that selects the beam waist fit for coarse optimization of z (a few
+#widely spaced readings along the optical axis, instead of the edge search)
+focusFit = False
+
+#Boolean that selects joint 3-axis coarse optimization (instead of round robin
+#single-axis optimization; travels further and is not faster in simulation)
+coarseJoint = False
+
+#DUT or fixture ID under which the aligned recipe is stored (empty to neither
+#warm-start nor store a recipe)
+dutID = input("Enter DUT or fixture ID (leave empty for a full alignment)")
+
+#File of the recipe store used for warm-starting known DUTs
+recipeFile = "recipes.json"
+
+#File of checkpoints written after each phase and axis pass, so an interrupted
+#run of the DUT can be resumed (empty for no checkpoints)
+checkpointFile = "checkpoint.json"
+
+#File of the dark calibration cache (empty to calibrate on every run), time
+#after which a cached calibration expires [s], and DUT temperature the cache is
+#keyed by [degrees C] (None if not controlled)
+darkFile = "dark.json"
+darkExpiry = 3600
+temperature = None
+
+#Shutter driver (darkcal.Shutter, or function called with True to open and
+#False to close the shutter; None to prompt the operator)
+processes.shutter = None
+
+#VISA resource of a Thorlabs SC10 shutter controller (empty for the shutter
+#driver above)
+shutterResource = ""
+
+#CSV file of nominal device positions (x, y, z) [micrometres] relative to the
+#first device, for batch alignment of a DUT array (empty to align a single DUT)
+arrayFile = ""
+
+#CSV file that per-device timing and results of batch alignment are written to
+summaryFile = "array_summary.csv"
+
+#File that a trace of all moves and readings is written to (empty for no
+#trace; loaded with tracelog.loadTrace())
+traceFile = ""
+
+#Boolean that selects profiling of moves and readings by phase (breakdown
+#printed at the end of the run), and CSV file the breakdown is exported to
+#(empty to only print)
+profileRun = False
+profileFile = ""
 
 #Minimum resolution for actuators (defined limit for (actuator name) ) [micrometres]
 minRes = 0.05
+
+#Boolean that selects continuous-motion (fly) planar scan instead of stepping
+flyScan = False
+
+#Boolean that selects hierarchical planar search (sparse grid sized by beam
+#footprint, refined around the most signal) instead of the coarse step spiral
+hierSearch = False
+
+#1/e^2 spot diameter of beam and active area diameter of DUT used to size the
+#hierarchical planar search [micrometres]
+spotSize = 120
+activeArea = 20
+
+#Number of coarse steps read on each side of the planar scan detection point
+#along x and y, to estimate the beam centre from the mapped readings (x and y
+#then skip coarse optimization; 0 to continue from the detection point)
+mapSteps = 2
+
+#Boolean that selects the motion/acquisition engine (concurrent moves and
+#pipelined readings; off to move and read in order as before)
+useEngine = False
+
+#Boolean that selects the measurement cache for coarse and fine optimization
+#(readings at revisited positions are not repeated; off by default, as
+#interpolated coarse centres leave few revisited positions)
+useCache = False
+
+#Time the aligned peak is tracked against drift after alignment (0 for no
+#tracking), and period of the dither cycles of tracking [s]
+trackTime = 0
+trackPeriod = 10.0
 #_______________________________________________________________________________
 
 #Serial numbers for x, y, z translation stages (to be set based on recieved
 #stages)
-serX =
-serY =
-serZ =
-
- #Initialize list to store actuator/stage instances
-s = []
+serX = ""
+serY = ""
+serZ = ""
 
 #Configure stages and store in list for access
 stageX = Thorlabs.KinesisMotor(serX)
@@ -56,161 +175,195 @@ s.append(stageY)
 stageZ = Thorlabs.KinesisMotor(serZ)
 s.append(stageZ)
 
-#Ensure that all stages are centred prior to alignment
-for stage in s:
-    stage._move_to(centPos)
+#Read the source meter (buffered) instead of the DMM
+if meterResource:
+    useMeter(meters.SourceMeter(meterResource, meterBias))
 
-#Boolean that indicates whether to continue prompting the user
-prompt = True
+#Dark current calibrated behind the SC10 shutter without operator steps
+if shutterResource:
+    processes.shutter = darkcal.SC10Shutter(shutterResource)
 
-#Prompt user to manually align stage until they are satisfied or decide to
-#end entire process
-while prompt:
-    input("Manually align with DUT - Press any key to initiate calibration")
+#Start motion/acquisition engine over configured stages
+if useEngine:
+    startEngine()
 
-    #Gets dark current for DUT
-    darkCur = calibrate()
+#Start trace log of moves and readings
+if traceFile:
+    startTrace(traceFile)
 
-    print("Measured dark current for DUT is " + str(darkCur))
+#Start profiler of moves and readings
+if profileRun:
+    startProfile()
 
-    #Boolean that indicates if user has selected option
-    select = False
+#Stored recipe of DUT (None if unknown)
+store = RecipeStore(recipeFile)
+recipe = store.get(dutID) if dutID else None
 
-    response = input("Redo manual alignment: type 'a', proceed to\
-     signal detection: type 'b', terminate protocol: type 'c'")
+#Dark calibrations of DUTs (repeat runs within the expiry skip the shutter)
+darkCache = darkcal.DarkCache(darkFile, darkExpiry) if darkFile else None
 
-    #Poll for user action
-    while not select:
+#Checkpoint of an interrupted run of the DUT, resumed if the operator agrees
+#and the DUT still shows signal at the checkpoint position
+state = None
 
-        if response == "a":
-            select = True
+if checkpointFile and not arrayFile:
 
-        elif response == "b":
-            select = True
-            prompt = False
+    state = startCheckpoint(checkpointFile, True)
 
-        elif response == "c":
-            end()
+    if state is not None and (state.get("dutID") != (dutID or None)
+                              or input("Resume interrupted alignment after step '"
+                                       + state["stage"] + "'? (y/n)") != "y"
+                              or not resumeCheckpoint(state, sigFact)):
+        state = None
 
-        else:
-            response = input()
+#Known DUTs start from the stored position with a local search (and stored
+#dark current); the full search below only runs if that fails
+warm = state is None and recipe is not None and warmStart(recipe, stepC, sigFact)
 
-#Initiate Planar Scan
-#_______________________________________________________________________________
+if warm:
+    darkCur = recipe["darkCur"]
 
-#Compute number of complete x & y translation sets possible
-cycleStop = 2*math.floor(dim/(2*stepC))
+#Resumed run continues with the dark current of the interrupted run
+elif state is not None:
+    darkCur = state["darkCur"]
 
+else:
 
-plnrScan(stepC, cycleStop, darkCur, sigFact):
+    #Ensure that all stages are centred prior to alignment (concurrently when
+    #the engine is started)
+    for ID in range(3):
+        moveTo(ID, centPos)
 
+        #Stores current position of stage
+        s[ID].posCur = centPos
 
-#Initiate Multi-Axis Scan (Coarse Scan)
-#_______________________________________________________________________________
+    #Boolean that indicates whether to continue prompting the user
+    prompt = True
 
-#value for stage selection
-ID = 0
+    #Prompt user to manually align stage until they are satisfied or decide to
+    #end entire process
+    while prompt:
+        input("Manually align with DUT - Press any key to initiate calibration")
 
-#Scan type to be performed
-coarseScan = True
+        #Gets dark current for DUT
+        darkCur = darkcal.calibrate(darkSamples, darkCache, dutID or None, temperature)
 
-#Assign names for each axis/stage
-s[0].name = "x"
-s[1].name = "y"
-s[2].name = "z"
+        print("Measured dark current for DUT is " + str(darkCur))
 
-print("Starting multi-axis scan for laser alignment")
+        #Boolean that indicates if user has selected option
+        select = False
 
-print("Initiating coarse scan process")
-
-#Set initial position for comparison to current position for each axis
-s[0].pos1 = s[0].posCur
-s[1].pos1 = s[1].posCur
-s[2].pos1 = centPos
-
-#Set initial optimization status for each axis to False (not optimized)
-s[0].status = s[1].status = s[2].status = False
+        response = input("Redo manual alignment: type 'a', proceed to\
+     signal detection: type 'b', terminate protocol: type 'c'")
 
-#Loop that continues until all axes are optimized according to coarse step
-while coarseScan:
+        #Poll for user action
+        while not select:
 
-    #Informs user of the current axis being optimized
-    print("Optimizing " + str(s[ID%3].name))
+            if response == "a":
+                select = True
 
-    #Checks if number of optimization cycles exceeds limit for convergence
-    if(ID > opt):
+            elif response == "b":
+                select = True
+                prompt = False
 
-        #Terminate coarse scan process
-        break
+            elif response == "c":
+                end()
 
-    #Attempt to optimize a given axis
-    if not optimizeC(ID, stepC, threshFact, stepLim):
+            else:
+                response = input()
 
-        #Terminate coarse scan process
-        break
+    saveCheckpoint("calibrate", dutID=dutID or None, darkCur=float(darkCur))
 
-    #Check if position along axis after optimization is within single
-    #coarse step of initial position
-    if abs(s[ID%3].pos2-s[ID%3].pos1) <= stepC:
+#Initiate Planar Scan
+#_______________________________________________________________________________
 
-        #Set previous position for comparion to new  position along axis
-        #determined by optimization
-        s[ID%3].pos1 = s[ID%3].pos2
+if not checkpoint.done(state, "planar"):
 
-        #Current axis optimized (individually)
-        print(str(s[ID%3].name + " passes"))
+    if not warm:
 
-        #Update status of axis to indicate a pass
-        s[ID%3].status = True
+        #Compute number of complete x & y translation sets possible
+        cycleStop = 2*math.floor(dim*1000/(2*stepC))
 
-        #Check if all axes are omptimized
-        if s[0].status && s[1].status && s[2].status:
 
-            #Change scan state
-            coarseScan = False
+        if hierSearch:
+            hierScan(spotSize, activeArea, stepC, dim, darkCur, sigFact,
+                     neighbourhood=mapSteps)
+        else:
+            plnrScan(stepC, cycleStop, darkCur, sigFact, flyScan,
+                     neighbourhood=mapSteps)
 
-            #Signify start of fine scan process
-            print("\nAll axes passed - Initiating Fine Scan Process")
+    saveCheckpoint("planar", dutID=dutID or None, darkCur=float(darkCur))
 
-    else:
+#Start measurement cache (quantized to the minimum resolution)
+if useCache:
+    startCache(minRes*34.304)
 
-        #Set previous position for comparion to new  position along axis
-        #determined by optimization
-        s[ID%3].pos1 = s[ID%3].pos2
+#Batch alignment of DUT array, with layout anchored at the first device (found
+#by the planar scan)
+#_______________________________________________________________________________
 
-        #Current axis was not optimized (individually)
-        print(str(s[ID%3].name + " fails - reset all"))
-        print()
+if arrayFile:
 
-        #Reset all axes to non-optimized state
-        s[0].status = s[1].status = s[2].status = False
+    layout = np.loadtxt(arrayFile, delimiter=",", ndmin=2)
+    nominal = [[s[ID].posCur + p[ID]*34.304 for ID in range(3)] for p in layout]
 
-    #Increment index to optimize next stage (round robin order)
-    ID += 1
+    results = batch.alignArray(nominal, stepC, threshFact, minRes, sigFact,
+                               darkCur, stepLim, opt, coarseModel, fineBrent,
+                               focusFit)
+    batch.writeSummary(results, summaryFile)
 
-#Check if termination occurence does not correspond to switching scan types
-if coarseScan:
+    print(str(sum(r["success"] for r in results)) + " of " + str(len(results))
+          + " devices aligned - summary written to " + summaryFile)
 
-    if s[ID%3].posCur <=0 or s[ID%3].posCur >= 857600:
+#Initiate Multi-Axis Scan (Coarse Scan)
+#_______________________________________________________________________________
 
-        #Display Realignment message to user
-        print("Stage limit reached - manual Realignment required")
-        end()
+#Coarse optimization already completed before the checkpoint of a resumed run
+elif checkpoint.done(state, "coarse"):
+    print("Coarse optimization completed before interruption")
 
-        #Display paremeter selection message to user
-        print("Not converging to position - Change parameter choice")
+#Terminate process if coarse optimization could not be completed
+elif coarseJoint:
+    if not coarseAlign3D(stepC, opt, darkCur):
         end()
 
-
+elif not coarseAlign(stepC, threshFact, stepLim, opt, coarseModel, coarseAxes(),
+                     focusFit):
+    end()
 
 #Proceed with Multi-Axis Scan (fine optimization)
 #_______________________________________________________________________________
 
 #Perform fine optimization on each axis
-for ID in range(3):
+if not arrayFile:
+    fineAlign(stepC, threshFact, minRes, fineBrent, checkpoint.fineAxes(state))
+
+#Wait for final moves to complete
+stopCache()
+
+#Track aligned peak against drift, re-aligning if it is lost
+#_______________________________________________________________________________
+
+if trackTime and not arrayFile:
+
+    tracker = DriftTracker(period=trackPeriod, darkCur=darkCur)
+
+    tracker.run(trackTime, lambda: realign(stepC, threshFact, stepLim, opt, minRes,
+                                           coarseModel, fineBrent, focusFit))
+    summary = tracker.report()
+
+    print("Tracked for " + format(summary["duration"], ".0f") + " s (duty cycle "
+          + format(100*summary["dutyCycle"], ".0f") + "%, " + str(summary["realigns"])
+          + " re-alignments), drift x/y/z "
+          + "/".join(format(d, ".1f") for d in summary["drift"]) + " \u03BC" + "m")
+
+stopEngine()
+stopTrace()
+stopProfile(profileFile or None)
 
-    #Optimize a single axis
-    optimizeF(ID, step, threshFact, minRes)
+#Store aligned recipe for warm-starting the DUT next time
+if dutID and not arrayFile:
+    store.put(dutID, makeRecipe(darkCur))
 
-    #Inform user that process was successful
-    print("Alignment process successfully completed")
+#Run completed (no checkpoint left to resume)
+stopCheckpoint(True)
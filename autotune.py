@@ -0,0 +1,203 @@
+#Parameter autotuner for the alignment flow: sweeps stepC, stepLim, opt,
+#threshFact and sigFact against simulated beams of several size classes (or a
+#replayed trace), running the variants in parallel on a process pool, and
+#reports the Pareto-optimal variants and a recommended parameter set for each
+#beam size class
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import math
+
+import benchmark
+import replay
+import tracelog
+
+#Parameter values swept by default
+defaultGrid = {"stepC": [25.0, 50.0, 100.0],
+               "stepLim": [50, 100, 200],
+               "opt": [10, 30],
+               "threshFact": [0.8, 0.9],
+               "sigFact": [1.5, 2.0, 3.0]}
+
+#Beam size classes by 1/e^2 spot radius at focus [micrometres]
+beamClasses = {"small": 20.0, "medium": 60.0, "large": 150.0}
+
+#_______________________________________________________________________________
+
+#Runs the trials of a single variant (in a worker process)
+
+#Parameters: beam size class, 1/e^2 spot radius [micrometres] (None to replay
+#a trace), parameter variant, fixed alignment parameters, number of trials,
+#seed, maximum planar and focus offset [micrometres], path of trace to replay
+
+#Returns dictionary of variant, beam class and summary statistics
+
+def runVariant(beam, width, variant, params, trials, seed, radius, depth, trace=None):
+
+    params = dict(params, **variant)
+
+    if trace is not None:
+
+        field = replay.TraceField(tracelog.loadTrace(trace))
+        results = [replay.replayFlow(field, params, noise=0.01, darkNoise=0.05,
+                                     seed=seed + index)
+                   for index in range(trials)]
+
+        for r in results:
+            r["warm"] = False
+
+    else:
+        results = benchmark.runBenchmark(trials, params, radius, depth, seed,
+                                         width=width)
+
+    summary = benchmark.summarize(results)
+
+    return dict(variant, beam=beam, successRate=summary["successRate"],
+                time=summary["time"][0], reads=summary["reads"][0],
+                errXY=summary["errXY"][0], errZ=summary["errZ"][0])
+
+#_______________________________________________________________________________
+
+#Runs all parameter variants for all beam classes on a process pool
+
+#Parameters: dictionary of parameter name to values, dictionary of beam class
+#to spot radius (ignored when replaying), fixed alignment parameters, number of
+#trials per variant, seed, maximum planar and focus offset [micrometres],
+#number of worker processes (None for one per CPU), path of trace to replay
+#(None for simulated beams)
+
+#Returns list of variant result dictionaries
+
+def tune(grid, classes, params, trials=10, seed=0, radius=500.0, depth=500.0,
+         workers=None, trace=None):
+
+    names = list(grid)
+    variants = [dict(zip(names, values))
+                for values in itertools.product(*(grid[name] for name in names))]
+
+    if trace is not None:
+        classes = {"trace": None}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+
+        futures = [pool.submit(runVariant, beam, width, variant, params, trials,
+                               seed, radius, depth, trace)
+                   for beam, width in classes.items() for variant in variants]
+
+        return [future.result() for future in futures]
+
+#_______________________________________________________________________________
+
+#Selects the variants not dominated in time-to-align, success rate and final
+#x/y and z error (no other variant is at least as good in all of them and
+#better in one); of variants with identical results only the first is kept
+
+#Parameters: list of variant result dictionaries (of a single beam class)
+
+#Returns list of Pareto-optimal variants, sorted by time-to-align
+
+def pareto(results):
+
+    def key(r):
+        return tuple(v if math.isfinite(v) else math.inf
+                     for v in (r["time"], -r["successRate"], r["errXY"], r["errZ"]))
+
+    keys = [key(r) for r in results]
+    front = {}
+
+    for r, k in zip(results, keys):
+        if k not in front and not any(all(a <= b for a, b in zip(o, k)) and o != k
+                                      for o in keys):
+            front[k] = r
+
+    return [front[k] for k in sorted(front)]
+
+#Recommends a variant: fastest of those reaching the required success rate and
+#final x/y and z error (most successful variant if none does)
+
+#Parameters: list of variant result dictionaries (of a single beam class),
+#required success rate, maximum mean final x/y and z error [micrometres]
+
+#Returns recommended variant result dictionary
+
+def recommend(results, minSuccess=0.95, maxErr=1.0, maxErrZ=50.0):
+
+    feasible = [r for r in results
+                if r["successRate"] >= minSuccess and r["errXY"] <= maxErr
+                and r["errZ"] <= maxErrZ]
+
+    if feasible:
+        return min(feasible, key=lambda r: r["time"])
+
+    return max(results, key=lambda r: (r["successRate"], -r["time"]))
+
+#_______________________________________________________________________________
+
+#Prints Pareto table and recommended variant of each beam class
+
+#Parameters: list of variant result dictionaries, names of swept parameters,
+#required success rate, maximum mean final x/y and z error [micrometres]
+#No return
+
+def report(results, names, minSuccess=0.95, maxErr=1.0, maxErrZ=50.0):
+
+    columns = names + ["successRate", "time", "reads", "errXY", "errZ"]
+
+    for beam in dict.fromkeys(r["beam"] for r in results):
+
+        rows = [r for r in results if r["beam"] == beam]
+
+        print("Beam class: " + beam + " - Pareto-optimal variants")
+        print("".join(format(name, ">12") for name in columns))
+
+        for r in pareto(rows):
+            print("".join(format(float(r[name]), ">12.4g") for name in columns))
+
+        best = recommend(rows, minSuccess, maxErr, maxErrZ)
+
+        print("Recommended: " + ", ".join(name + " = " + format(best[name], "g")
+                                          for name in names)
+              + " (success " + format(100*best["successRate"], ".0f") + "%, "
+              + format(best["time"], ".1f") + " s)")
+        print()
+
+#_______________________________________________________________________________
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Autotune alignment parameters "
+                                     "on simulated beams or a replayed trace")
+    parser.add_argument("--trials", type=int, default=10,
+                        help="trials per variant")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--radius", type=float, default=500.0,
+                        help="maximum planar beam offset [um]")
+    parser.add_argument("--depth", type=float, default=500.0,
+                        help="maximum focus offset [um]")
+    parser.add_argument("--workers", type=int,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--trace", help="replay this trace instead of simulated beams")
+    parser.add_argument("--minSuccess", type=float, default=0.95)
+    parser.add_argument("--maxErr", type=float, default=1.0,
+                        help="maximum mean final x/y error of a recommendation [um]")
+    parser.add_argument("--maxErrZ", type=float, default=50.0,
+                        help="maximum mean final z error of a recommendation [um]")
+    for name, values in defaultGrid.items():
+        parser.add_argument("--" + name, type=type(values[0]), nargs="+", default=values)
+    parser.add_argument("--csv", help="file to write all variant results to")
+    args = parser.parse_args()
+
+    grid = {name: getattr(args, name) for name in defaultGrid}
+
+    results = tune(grid, beamClasses, {"pipeline": None}, args.trials, args.seed,
+                   args.radius, args.depth, args.workers, args.trace)
+
+    report(results, list(grid), args.minSuccess, args.maxErr, args.maxErrZ)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
@@ -0,0 +1,215 @@
+#Batch alignment of an array of DUTs (SPADs on a die or carrier with known
+#layout), visited in an order that keeps stage travel short and with device
+#positions predicted from the offsets measured on already aligned devices
+
+import csv
+import numpy as np
+
+import processes
+
+#_______________________________________________________________________________
+
+#Orders visits of points to keep total travel short (nearest neighbour tour
+#from the starting position, improved by 2-opt reversals of the open path)
+
+#Parameters: points (one row per point) [encoder counts], starting position
+#[encoder counts]
+
+#Returns list of point indices in visiting order
+
+def orderVisits(points, start):
+
+    points = np.asarray(points, dtype=float)
+    count = len(points)
+
+    if count == 0:
+        return []
+
+    #Distances between all points, and from the starting position
+    dist = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2)
+    fromStart = np.linalg.norm(points - np.asarray(start, dtype=float), axis=1)
+
+    #Nearest neighbour tour
+    order = [int(np.argmin(fromStart))]
+    left = set(range(count)) - set(order)
+
+    while left:
+        last = order[-1]
+        order.append(min(left, key=lambda j: dist[last, j]))
+        left.remove(order[-1])
+
+    #Length of leg into the k-th visit of a tour
+    def leg(tour, k):
+        return fromStart[tour[0]] if k == 0 else dist[tour[k-1], tour[k]]
+
+    #2-opt: reversing visits i..j replaces the legs into i and out of j
+    improved = True
+
+    while improved:
+
+        improved = False
+
+        for i in range(count - 1):
+            for j in range(i + 1, count):
+
+                before = leg(order, i) + (dist[order[j], order[j+1]] if j + 1 < count else 0)
+
+                into = fromStart[order[j]] if i == 0 else dist[order[i-1], order[j]]
+                after = into + (dist[order[i], order[j+1]] if j + 1 < count else 0)
+
+                if after < before - 1e-9:
+                    order[i:j+1] = order[i:j+1][::-1]
+                    improved = True
+
+    return order
+
+#_______________________________________________________________________________
+
+#Predicts device positions from the offsets measured on aligned devices (mean
+#offset from fewer than three devices, otherwise an offset varying linearly
+#across the array, which covers rotation and tilt of the die)
+
+#Parameters: nominal positions of devices to predict (one row per device),
+#nominal and measured positions of aligned devices [encoder counts]
+
+#Returns array of predicted positions [encoder counts]
+
+def predictPositions(nominal, known, measured):
+
+    nominal = np.asarray(nominal, dtype=float)
+
+    if len(known) == 0:
+        return nominal
+
+    known = np.asarray(known, dtype=float)
+    offsets = np.asarray(measured, dtype=float) - known
+
+    if len(known) < 3:
+        return nominal + offsets.mean(axis=0)
+
+    #Offsets fitted as linear functions of nominal x and y about the mean of
+    #the aligned devices (a direction the aligned devices do not span, such as
+    #across a single row, gets no slope)
+    centre = known[:, :2].mean(axis=0)
+    a = np.column_stack((known[:, :2] - centre, np.ones(len(known))))
+    coef = np.linalg.lstsq(a, offsets, rcond=1e-6)[0]
+
+    return nominal + np.column_stack((nominal[:, :2] - centre,
+                                      np.ones(len(nominal)))) @ coef
+
+#_______________________________________________________________________________
+
+#Aligns an array of DUTs: devices are visited in the order of orderVisits(),
+#each starting from its predicted position. The first devices (and any device
+#whose reading at its predicted position is not close to the peak readings of
+#aligned devices) get a local spiral search and coarse optimization, the others
+#only fine optimization
+
+#Parameters: nominal positions of devices (one row per device, x, y, z)
+#[encoder counts], coarse step size, threshold factor, minimum actuator
+#resolution, noise exceedance factor, dark current for DUTs, step limit for
+#single-axis optimization, cycle count limit for multi-axis optimization, beam
+#profile model for coarse optimization (None for edge search), boolean
+#selecting Brent search for fine optimization, boolean selecting the focus fit
+#for coarse optimization of z, number of devices always
+#coarse optimized, fraction of the median peak reading of aligned devices
+#required at a predicted position for fine optimization only, number of
+#complete x & y translation sets of the local spiral search, function called
+#with the device index before a device is aligned (e.g. to switch the meter
+#to that device; None if not needed)
+
+#Returns list of per-device result dictionaries in visiting order
+
+def alignArray(nominal, stepC, threshFact, minRes, sigFact, darkCur, stepLim,
+               opt, model=None, brent=False, focus=False, learn=3, peakFact=0.5,
+               cycles=4, select=None):
+
+    nominal = np.asarray(nominal, dtype=float)
+    start = [processes.s[ID].posCur for ID in range(3)]
+    order = orderVisits(nominal, start)
+
+    #Nominal and measured positions, and peak readings, of aligned devices
+    known = []
+    measured = []
+    peaks = []
+
+    results = []
+
+    for visit, index in enumerate(order):
+
+        tStart = processes.clock()
+
+        if select is not None:
+            select(index)
+
+        target = predictPositions(nominal[index:index+1], known, measured)[0]
+
+        print("Device " + str(index) + " (" + str(visit + 1) + " of "
+              + str(len(order)) + ")")
+
+        #Stages move to predicted position (concurrently when the engine is
+        #started), which is the reference of fine optimization unless coarse
+        #optimization runs
+        for ID in range(3):
+            processes.moveTo(ID, target[ID])
+            processes.s[ID].posCur = processes.s[ID].pos1 = processes.s[ID].pos2 = target[ID]
+            processes.s[ID].name = "xyz"[ID]
+
+        #Well predicted devices only need fine optimization
+        fine = (visit >= learn and len(peaks) > 0
+                and processes.measure() >= peakFact*np.median(peaks))
+
+        if fine:
+            success = True
+
+        else:
+
+            #Planar scan moves stages directly, bypassing the measurement cache
+            held = processes.suspendCache()
+
+            try:
+                found = processes.plnrScan(stepC, cycles, darkCur, sigFact,
+                                           required=False)
+            finally:
+                processes.resumeCache(held)
+
+            success = found and processes.coarseAlign(stepC, threshFact, stepLim, opt,
+                                                      model, focus=focus)
+
+        if success:
+            processes.fineAlign(stepC, threshFact, minRes, brent)
+
+            known.append(nominal[index])
+            measured.append([processes.s[ID].posCur for ID in range(3)])
+            peaks.append(processes.measure())
+
+        results.append({"device": index, "visit": visit, "success": success,
+                        "mode": "fine" if fine else "coarse",
+                        "nominal": nominal[index].tolist(),
+                        "predicted": target.tolist(),
+                        "position": [float(processes.s[ID].posCur) for ID in range(3)],
+                        "time": processes.clock() - tStart})
+
+    return results
+
+#_______________________________________________________________________________
+
+#Writes per-device results of alignArray() to a CSV summary
+
+#Parameters: list of per-device result dictionaries, path of summary file
+#No return
+
+def writeSummary(results, path):
+
+    with open(path, "w", newline="") as f:
+
+        writer = csv.writer(f)
+        writer.writerow(["device", "visit", "success", "mode", "time",
+                         "nominalX", "nominalY", "nominalZ",
+                         "predictedX", "predictedY", "predictedZ",
+                         "x", "y", "z"])
+
+        for r in results:
+            writer.writerow([r["device"], r["visit"], r["success"], r["mode"],
+                             r["time"]] + r["nominal"] + r["predicted"]
+                            + r["position"])
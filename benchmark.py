@@ -0,0 +1,502 @@
+#Time-to-align benchmark for alignment processes, run against the simulated
+#backend over randomized beam offsets
+
+import argparse
+import contextlib
+import csv
+import io
+import math
+import os
+import numpy as np
+
+import batch
+import processes
+import profiling
+import simulation
+
+#Dimensions of the planar scan area [millimetres]
+dim = 24.984
+
+#Absolute center position of a stage [encoder counts]
+centPos = 428800
+
+#Minimum resolution for actuators [micrometres]
+minRes = 0.05
+
+#_______________________________________________________________________________
+
+#Runs the alignment flow of alignment.py (calibration, planar scan, coarse and
+#fine optimization) on a simulated rig
+
+#Parameters: simulated rig, coarse step size, step limit for single-axis
+#optimization, cycle count limit for multi-axis optimization, threshold factor,
+#noise exceedance factor, boolean indicating fly-scan mode for planar scan,
+#pipeline depth of motion/acquisition engine (None to run without engine),
+#error rate of sequential signal test (None for single readings), number of
+#dark current readings, beam profile model for coarse optimization (None for
+#edge search), boolean selecting Brent search for fine optimization, boolean
+#selecting joint 3-axis coarse optimization, maximum age of cached readings
+#[s] (None to run without measurement cache), stored recipe to warm-start from
+#(None for a full alignment), boolean selecting hierarchical planar search,
+#1/e^2 spot diameter and active area diameter for hierarchical planar search
+#[micrometres], path of trace file of moves and readings (None for no trace),
+#boolean selecting profiling of moves and readings by phase (statistics stored
+#as profile of the rig), number of samples averaged per optimization reading,
+#boolean selecting bulk readout of samples (one transfer per block instead of
+#one per sample), number of coarse steps mapped on each side of the planar scan
+#detection point for the handoff to the estimated beam centre (0 for no
+#handoff; coarse optimization then only covers z when the centre is estimated),
+#boolean selecting the focus fit of optimizeZ for coarse optimization of z
+
+#Returns True if alignment completed and False otherwise (recipe of the
+#alignment stored as recipe of the rig)
+
+def runFlow(rig, stepC, stepLim, opt, threshFact, sigFact, fly=False,
+            pipeline=None, checkErr=None, darkSamples=1, model=None,
+            brent=False, joint=False, cache=None, recipe=None, hier=False,
+            spot=120.0, area=20.0, trace=None, profile=False, samples=1,
+            bulk=True, mapSteps=0, focus=False):
+
+    rig.install(processes)
+    rig.cacheStats = rig.recipe = rig.profile = None
+    rig.warm = False
+    processes.checkErr = checkErr
+    processes.darkNoise = None
+    processes.avgSamples = samples
+
+    if not bulk:
+        processes.read_block = None
+
+    if pipeline is not None:
+        processes.startEngine(pipeline)
+
+    if trace is not None:
+        processes.startTrace(trace)
+
+    if profile:
+        processes.startProfile()
+
+    try:
+
+        #Known DUT starts from stored position (as in alignment.py)
+        if recipe is not None:
+            rig.warm = processes.warmStart(recipe, stepC, sigFact)
+            darkCur = recipe["darkCur"]
+
+        if not rig.warm:
+
+            #Ensure that all stages are centred prior to alignment
+            for ID in range(3):
+                processes.moveTo(ID, centPos)
+                processes.s[ID].posCur = centPos
+
+            #Dark current measured with simulated shutter closed
+            darkCur = processes.calibrate(darkSamples)
+
+            #Compute number of complete x & y translation sets possible
+            cycleStop = 2*math.floor(dim*1000/(2*stepC))
+
+            if hier:
+                processes.hierScan(spot, area, stepC, dim, darkCur, sigFact,
+                                   neighbourhood=mapSteps)
+            else:
+                processes.plnrScan(stepC, cycleStop, darkCur, sigFact, fly,
+                                   neighbourhood=mapSteps)
+
+        if cache is not None:
+            processes.startCache(minRes*simulation.cntsPerUm, cache)
+
+        if joint:
+            if not processes.coarseAlign3D(stepC, opt, darkCur):
+                return False
+
+        elif not processes.coarseAlign(stepC, threshFact, stepLim, opt, model,
+                                       processes.coarseAxes(), focus):
+            return False
+
+        processes.fineAlign(stepC, threshFact, minRes, brent)
+        rig.recipe = processes.makeRecipe(darkCur)
+
+    #Alignment processes terminate the program on failure
+    except SystemExit:
+        return False
+
+    finally:
+
+        #Counters of measurement cache kept on the rig for the trial results
+        rig.cacheStats = processes.stopCache()
+        processes.stopEngine()
+        processes.stopTrace()
+        rig.profile = processes.stopProfile()
+
+    return True
+
+#_______________________________________________________________________________
+
+#Runs a single benchmark trial with the beam offset from the stage centre
+
+#Parameters: beam offset (x, y, z) [micrometres], alignment parameters (dict of
+#runFlow keyword arguments), seed for noise generator, maximum offset of a
+#re-seated DUT [micrometres] (None for a single full alignment; otherwise the
+#DUT is aligned once, re-seated with a random offset and the warm-started
+#alignment is measured), keyword arguments for simulated beam
+
+#Returns dictionary of trial results
+
+def runTrial(offset, params, seed=None, reseat=None, **beamArgs):
+
+    centre = centPos + np.asarray(offset)*simulation.cntsPerUm
+    rig = simulation.Rig(simulation.Beam(centre, **beamArgs), seed=seed)
+
+    #Trace file named after the trial seed
+    if params.get("trace") is not None:
+        params = dict(params, trace=os.path.join(params["trace"],
+                                                 "trial" + str(seed) + ".trace"))
+
+    #Progress messages of alignment processes are not part of the benchmark
+    with contextlib.redirect_stdout(io.StringIO()):
+        success = runFlow(rig, **params)
+
+        if reseat is not None and success:
+
+            #Re-seated DUT is offset within a disc of the given radius
+            shift = randomOffsets(1, reseat, 0.0, np.random.default_rng(seed))[0]
+            centre = centre + shift*simulation.cntsPerUm
+            recipe = rig.recipe
+
+            rig = simulation.Rig(simulation.Beam(centre, **beamArgs), seed=seed)
+            success = runFlow(rig, recipe=recipe, **params)
+
+    err = rig.error()
+
+    return {"success": success,
+            "hits": rig.cacheStats["hits"] if rig.cacheStats else 0,
+            "warm": rig.warm,
+            "profile": rig.profile,
+            "moves": rig.moves(),
+            "reads": rig.reads,
+            "time": rig.clock.t,
+            "travel": rig.travel(),
+            "errXY": math.hypot(err[0], err[1]),
+            "errZ": abs(err[2])}
+
+#_______________________________________________________________________________
+
+#Draws random beam offsets (uniform over a disc in x/y and an interval in z)
+
+#Parameters: number of offsets, maximum planar offset [micrometres], maximum
+#focus offset [micrometres], random number generator
+
+#Returns array of offsets (x, y, z) [micrometres]
+
+def randomOffsets(count, radius, depth, rng):
+
+    r = radius*np.sqrt(rng.random(count))
+    phi = 2*math.pi*rng.random(count)
+    z = depth*(2*rng.random(count) - 1)
+
+    return np.column_stack((r*np.cos(phi), r*np.sin(phi), z))
+
+#_______________________________________________________________________________
+
+#Runs benchmark trials over randomized beam offsets
+
+#Parameters: number of trials, alignment parameters, maximum planar offset
+#[micrometres], maximum focus offset [micrometres], seed, maximum offset of a
+#re-seated DUT [micrometres] (None without warm start), keyword arguments for
+#simulated beam
+
+#Returns list of trial result dictionaries
+
+def runBenchmark(trials, params, radius=500.0, depth=500.0, seed=0, reseat=None,
+                 **beamArgs):
+
+    rng = np.random.default_rng(seed)
+    offsets = randomOffsets(trials, radius, depth, rng)
+
+    return [dict(runTrial(offset, params, seed + 1 + index, reseat, **beamArgs),
+                 offsetX=offset[0], offsetY=offset[1], offsetZ=offset[2])
+            for index, offset in enumerate(offsets)]
+
+#_______________________________________________________________________________
+
+#Runs batch alignment of a simulated DUT array (square grid at given pitch,
+#placed with a random offset, rotation and tilt, and a small random error of
+#each device position); the meter reads the device being aligned
+
+#Parameters: number of devices, pitch of grid [micrometres], alignment
+#parameters (dict of runFlow keyword arguments), seed, number of devices always
+#coarse optimized, keyword arguments for simulated beam
+
+#Returns list of per-device result dictionaries (with final error of each
+#device [micrometres])
+
+def runArray(count, pitch, params, seed=0, learn=3, **beamArgs):
+
+    rng = np.random.default_rng(seed)
+
+    #Nominal layout relative to first device [micrometres]
+    side = math.ceil(math.sqrt(count))
+    layout = np.array([[(k % side)*pitch, (k//side)*pitch, 0.0]
+                       for k in range(count)])
+
+    #Array placement: offset of first device, rotation, tilt, device error
+    offset = randomOffsets(1, 500.0, 200.0, rng)[0]
+    angle = math.radians(rng.uniform(-1, 1))
+    rot = np.array([[math.cos(angle), -math.sin(angle), 0],
+                    [math.sin(angle), math.cos(angle), 0], [0, 0, 1]])
+    tilt = rng.uniform(-0.01, 0.01, 2)
+    actual = layout @ rot.T + offset + rng.normal(0, 2.0, (count, 3))
+    actual[:, 2] += layout[:, :2] @ tilt
+
+    centres = centPos + actual*simulation.cntsPerUm
+    rig = simulation.Rig(simulation.Beam(centres[0], **beamArgs), seed=seed)
+
+    #Meter switched to the device being aligned
+    def select(index):
+        rig.beam.centre = centres[index]
+
+    rig.install(processes)
+    processes.checkErr = params.get("checkErr")
+    processes.darkNoise = None
+    processes.avgSamples = params.get("samples", 1)
+    stepC = params["stepC"]
+
+    if not params.get("bulk", True):
+        processes.read_block = None
+
+    if params.get("pipeline") is not None:
+        processes.startEngine(params["pipeline"])
+
+    results = []
+
+    with contextlib.redirect_stdout(io.StringIO()):
+
+        try:
+
+            for ID in range(3):
+                processes.moveTo(ID, centPos)
+                processes.s[ID].posCur = centPos
+
+            darkCur = processes.calibrate(params.get("darkSamples", 1))
+
+            #First device located by planar scan, which anchors the layout
+            cycleStop = 2*math.floor(dim*1000/(2*stepC))
+            processes.plnrScan(stepC, cycleStop, darkCur, params["sigFact"],
+                               params.get("fly", False))
+
+            anchor = np.array([processes.s[ID].posCur for ID in range(3)])
+            nominal = anchor + layout*simulation.cntsPerUm
+
+            if params.get("cache") is not None:
+                processes.startCache(minRes*simulation.cntsPerUm, params["cache"])
+
+            results = batch.alignArray(nominal, stepC, params["threshFact"], minRes,
+                                       params["sigFact"], darkCur, params["stepLim"],
+                                       params["opt"], params.get("model"),
+                                       params.get("brent", False),
+                                       params.get("focus", False), learn,
+                                       select=select)
+
+        except SystemExit:
+            pass
+
+        finally:
+            processes.stopCache()
+            processes.stopEngine()
+
+    for r in results:
+        err = (np.array(r["position"]) - centres[r["device"]])/simulation.cntsPerUm
+        r["errXY"] = math.hypot(err[0], err[1])
+        r["errZ"] = abs(err[2])
+
+    return results
+
+#Prints summary of a batch alignment
+def reportArray(results):
+
+    passed = [r for r in results if r["success"]]
+
+    print("Devices: " + str(len(results)) + "    aligned: " + str(len(passed))
+          + "    fine only: " + str(sum(r["mode"] == "fine" for r in passed)))
+    print("total time [s]: " + format(sum(r["time"] for r in results), ".2f")
+          + "    per device [s]: "
+          + format(np.mean([r["time"] for r in results]), ".2f"))
+
+    if passed:
+        print("mean final x/y error [um]: "
+              + format(np.mean([r["errXY"] for r in passed]), ".2f")
+              + "    z error [um]: "
+              + format(np.mean([r["errZ"] for r in passed]), ".2f"))
+
+#_______________________________________________________________________________
+
+#Summarizes trial results (success rate, and mean/median/90th percentile of
+#each metric over successful trials)
+
+#Parameters: list of trial result dictionaries
+
+#Returns dictionary of summary statistics
+
+def summarize(results):
+
+    passed = [r for r in results if r["success"]]
+    summary = {"trials": len(results),
+               "successRate": len(passed)/len(results) if results else 0.0,
+               "warmRate": (sum(r["warm"] for r in passed)/len(passed)
+                            if passed else 0.0)}
+
+    for key in ("moves", "reads", "hits", "time", "travel", "errXY", "errZ"):
+
+        vals = np.array([r[key] for r in passed], dtype=float)
+
+        if len(vals):
+            summary[key] = (vals.mean(), np.median(vals), np.percentile(vals, 90))
+        else:
+            summary[key] = (math.nan, math.nan, math.nan)
+
+    return summary
+
+#Prints summary statistics as a table
+def report(summary):
+
+    print("Trials: " + str(summary["trials"]) + "    success rate: "
+          + format(100*summary["successRate"], ".1f") + "%    warm starts: "
+          + format(100*summary["warmRate"], ".1f") + "%")
+    print(format("metric", "<22") + format("mean", ">12") + format("median", ">12")
+          + format("p90", ">12"))
+
+    labels = (("moves", "moves issued"), ("reads", "meter reads"),
+              ("hits", "cache hits"),
+              ("time", "simulated time [s]"), ("travel", "travel [um]"),
+              ("errXY", "final x/y error [um]"), ("errZ", "final z error [um]"))
+
+    for key, label in labels:
+        print(format(label, "<22")
+              + "".join(format(val, ">12.2f") for val in summary[key]))
+
+#_______________________________________________________________________________
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Time-to-align benchmark on "
+                                     "simulated stages and photocurrent")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stepC", type=float, default=50.0)
+    parser.add_argument("--stepLim", type=int, default=100)
+    parser.add_argument("--opt", type=int, default=30)
+    parser.add_argument("--threshFact", type=float, default=0.9)
+    parser.add_argument("--sigFact", type=float, default=2.0)
+    parser.add_argument("--radius", type=float, default=500.0,
+                        help="maximum planar beam offset [um]")
+    parser.add_argument("--depth", type=float, default=500.0,
+                        help="maximum focus offset [um]")
+    parser.add_argument("--width", type=float, default=60.0,
+                        help="1/e^2 spot radius at focus [um]")
+    parser.add_argument("--rayleigh", type=float, default=1500.0,
+                        help="Rayleigh range [um]")
+    parser.add_argument("--fly", action="store_true",
+                        help="use continuous-motion planar scan")
+    parser.add_argument("--pipeline", type=int,
+                        help="run on motion/acquisition engine with given "
+                        "pipeline depth")
+    parser.add_argument("--checkErr", type=float,
+                        help="error rate of sequential signal test")
+    parser.add_argument("--darkSamples", type=int, default=1)
+    parser.add_argument("--model", choices=("gauss", "lorentz"),
+                        help="fit beam profile model in coarse optimization")
+    parser.add_argument("--brent", action="store_true",
+                        help="use Brent search for fine optimization")
+    parser.add_argument("--joint", action="store_true",
+                        help="use joint 3-axis coarse optimization")
+    parser.add_argument("--cache", type=float,
+                        help="use measurement cache with given maximum age "
+                        "of readings [s]")
+    parser.add_argument("--hier", action="store_true",
+                        help="use hierarchical planar search")
+    parser.add_argument("--area", type=float, default=20.0,
+                        help="active area diameter of DUT [um]")
+    parser.add_argument("--reseat", type=float,
+                        help="measure warm-started realignment of a DUT "
+                        "re-seated within given offset [um]")
+    parser.add_argument("--array", type=int,
+                        help="batch-align a simulated array of given number "
+                        "of devices instead of single trials")
+    parser.add_argument("--pitch", type=float, default=250.0,
+                        help="pitch of simulated array [um]")
+    parser.add_argument("--learn", type=int, default=3,
+                        help="number of array devices always coarse optimized")
+    parser.add_argument("--trace",
+                        help="directory to write a trace of each trial to")
+    parser.add_argument("--profile", action="store_true",
+                        help="report time, moves and reads by phase over all "
+                        "trials")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="samples averaged per optimization reading")
+    parser.add_argument("--perSample", action="store_true",
+                        help="transfer every sample separately (no bulk readout)")
+    parser.add_argument("--map", type=int, default=0,
+                        help="coarse steps mapped around the planar scan detection "
+                        "for the handoff to the estimated beam centre")
+    parser.add_argument("--focus", action="store_true",
+                        help="fit the beam waist model for coarse optimization of z")
+    parser.add_argument("--csv", help="file to write per-trial results to")
+    args = parser.parse_args()
+
+    #Trace directory created if needed
+    if args.trace is not None:
+        try:
+            os.makedirs(args.trace, exist_ok=True)
+        except OSError as e:
+            parser.error("cannot create trace directory: " + str(e))
+
+    params = {"stepC": args.stepC, "stepLim": args.stepLim, "opt": args.opt,
+              "threshFact": args.threshFact, "sigFact": args.sigFact,
+              "fly": args.fly, "pipeline": args.pipeline,
+              "checkErr": args.checkErr, "darkSamples": args.darkSamples,
+              "model": args.model, "brent": args.brent, "joint": args.joint,
+              "cache": args.cache, "hier": args.hier, "spot": 2*args.width,
+              "area": args.area, "trace": args.trace, "profile": args.profile,
+              "samples": args.samples, "bulk": not args.perSample,
+              "mapSteps": args.map, "focus": args.focus}
+
+    if args.array:
+
+        results = runArray(args.array, args.pitch, params, args.seed,
+                           args.learn, width=args.width, rayleigh=args.rayleigh)
+        reportArray(results)
+
+        if args.csv:
+            batch.writeSummary(results, args.csv)
+
+        raise SystemExit
+
+    results = runBenchmark(args.trials, params, args.radius, args.depth,
+                           args.seed, args.reseat, width=args.width,
+                           rayleigh=args.rayleigh)
+
+    report(summarize(results))
+
+    #Breakdown by phase summed over trials
+    profiles = [r.pop("profile") for r in results]
+
+    if args.profile:
+
+        total = profiling.Profiler(None)
+
+        for rows in profiles:
+            for row in rows:
+                stats = total._phase(row["phase"])
+
+                for key in stats:
+                    stats[key] += row[key]
+
+        print()
+        total.report()
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
@@ -0,0 +1,113 @@
+#Cache of meter readings keyed by quantized stage position, used to skip moves
+#and readings at positions the alignment processes revisit
+
+#_______________________________________________________________________________
+
+#Readings expire after a maximum age. When a position is read again after its
+#entry expired, the relative change of the reading gives an estimate of drift:
+#a change beyond the drift tolerance evicts every older entry, and the maximum
+#age is shortened so that the expected drift over the age of an entry stays
+#within the tolerance
+
+#Parameters: quantization step of positions [encoder counts], maximum age of an
+#entry [s], tolerated relative change of a reading due to drift
+
+class MeasurementCache:
+
+    def __init__(self, quantum=1.0, maxAge=30.0, driftTol=0.02):
+
+        self.quantum = quantum
+        self.maxAge = self.maxAgeLimit = maxAge
+        self.driftTol = driftTol
+
+        #Entries (time of reading, reading) by quantized position, and expired
+        #entries kept for drift comparison
+        self.entries = {}
+        self.expired = {}
+
+        #Estimated relative drift of readings [1/s]
+        self.drift = 0.0
+
+        #Counters for cache hits, misses and evicted entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    #Quantized position used as key
+    def key(self, pos):
+
+        return tuple(round(p/self.quantum) for p in pos)
+
+    #Looks up reading at a position
+    #Parameters: stage positions [encoder counts], current time [s]
+    #Returns cached reading, or None if there is no valid entry
+    def get(self, pos, now):
+
+        key = self.key(pos)
+        entry = self.entries.get(key)
+
+        if entry is not None and now - entry[0] > self.maxAge:
+
+            #Expired entry kept until position is read again
+            self.expired[key] = self.entries.pop(key)
+            self.evictions += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return entry[1]
+
+    #Stores reading at a position, comparing it with an expired entry for the
+    #same position to track drift
+    #Parameters: stage positions [encoder counts], reading, current time [s]
+    #No return
+    def put(self, pos, val, now):
+
+        key = self.key(pos)
+        old = self.expired.pop(key, None)
+
+        if old is not None and now > old[0]:
+
+            change = abs(val - old[1])/max(abs(old[1]), 1e-300)
+            self.drift = max(self.drift, change/(now - old[0]))
+
+            #Readings older than the drifted one are no longer valid
+            if change > self.driftTol:
+                self.evictBefore(now)
+
+            #Entries only live as long as the drift stays within tolerance
+            if self.drift > 0:
+                self.maxAge = min(self.maxAgeLimit, self.driftTol/self.drift)
+
+        self.entries[key] = (now, val)
+
+    #Evicts all entries read before a given time
+    def evictBefore(self, t):
+
+        old = [key for key, entry in self.entries.items() if entry[0] < t]
+
+        for key in old:
+            del self.entries[key]
+
+        self.evictions += len(old)
+
+    #Evicts all entries
+    def clear(self):
+
+        self.evictions += len(self.entries)
+        self.entries.clear()
+        self.expired.clear()
+
+    #Summary of cache counters
+    def stats(self):
+
+        total = self.hits + self.misses
+
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits/total if total else 0.0,
+                "maxAge": self.maxAge, "drift": self.drift}
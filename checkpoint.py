@@ -0,0 +1,103 @@
+#Checkpoints of an alignment run: a small JSON file rewritten atomically after
+#each phase and axis pass (stage positions, dark current and the last completed
+#step), so an interrupted run can resume from its last good state instead of
+#starting over from the stage centre
+
+import json
+import os
+import time
+
+#Steps of the alignment flow in order (a checkpoint records the last completed
+#step: dark calibration, planar scan, a coarse pass, coarse optimization, fine
+#optimization of an axis, fine optimization)
+STAGES = ("calibrate", "planar", "coarse pass", "coarse", "fine axis", "fine")
+
+#_______________________________________________________________________________
+
+#Checkpoint file of an alignment run
+
+#Parameters: path of the checkpoint file
+
+class Checkpoint:
+
+    def __init__(self, path="checkpoint.json"):
+
+        self.path = path
+
+        #State written by the last update
+        self.state = {}
+
+    #Reads the checkpoint of an interrupted run (the state of a resumed run is
+    #set by the caller)
+    #No parameters
+    #Returns state dictionary, or None if there is no (readable) checkpoint
+    def load(self):
+
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+
+        except (OSError, ValueError):
+            return None
+
+        if state.get("stage") not in STAGES:
+            return None
+
+        return state
+
+    #Records a completed step, merged into the state of earlier steps (with
+    #time of the update)
+    #Parameters: completed step (one of STAGES), state fields of the step
+    #No return
+    def update(self, stage, **fields):
+
+        self.state.update(fields, stage=stage, time=time.time())
+        self.save()
+
+    #Removes the checkpoint (run completed)
+    def clear(self):
+
+        self.state = {}
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    #Writes checkpoint file (through a temporary file, so an interruption
+    #during the write leaves the previous checkpoint intact)
+    def save(self):
+
+        tmp = self.path + ".tmp"
+
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+
+        os.replace(tmp, self.path)
+
+#_______________________________________________________________________________
+
+#Checks whether a step was completed before a checkpoint
+
+#Parameters: state dictionary (None for a run without checkpoint), step (one of
+#STAGES)
+
+#Returns True if the step (or a later one) was completed
+
+def done(state, stage):
+
+    return state is not None and STAGES.index(state["stage"]) >= STAGES.index(stage)
+
+#Axes left to fine optimization after a checkpoint
+
+#Parameters: state dictionary (None for a run without checkpoint)
+
+#Returns tuple of axis indices
+
+def fineAxes(state):
+
+    if done(state, "fine"):
+        return ()
+
+    if state is not None and state["stage"] == "fine axis":
+        return tuple(range(state["axis"] + 1, 3))
+
+    return (0, 1, 2)
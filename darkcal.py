@@ -0,0 +1,256 @@
+#Dark current calibration: shutter drivers (the shutter is closed for a burst of
+#dark readings), statistics of the burst (mean, noise and drift) and an on-disk
+#cache of calibrations by DUT and temperature, so repeat runs within the expiry
+#time skip the shutter cycle
+
+import json
+import math
+import os
+import time
+
+import processes
+
+#Driver of the shutter controller is only required for a hardware shutter
+try:
+    import pyvisa
+except ImportError:
+    pyvisa = None
+
+#_______________________________________________________________________________
+
+#Shutter driver interface: a driver is called with True to open and False to
+#close the shutter (so it can be set as processes.shutter), and waits for the
+#shutter to settle after every change
+
+#Parameters: settling time of the shutter [s], sleep function
+
+class Shutter:
+
+    def __init__(self, settle=0.0, sleep=time.sleep):
+
+        self.settle = settle
+        self.sleep = sleep
+        self.opened = None
+
+    #Moves the shutter (implemented by drivers)
+    #Parameters: boolean indicating open shutter
+    #No return
+    def move(self, opened):
+
+        raise NotImplementedError
+
+    def __call__(self, opened):
+
+        if opened == self.opened:
+            return
+
+        self.move(opened)
+        self.opened = opened
+
+        if self.settle:
+            self.sleep(self.settle)
+
+#Shutter of a simulated rig (simulation.py), settling in simulated time
+
+#Parameters: simulated rig, settling time of the shutter [s]
+
+class SimulatedShutter(Shutter):
+
+    def __init__(self, rig, settle=0.02):
+
+        super().__init__(settle, rig.sleep)
+        self.rig = rig
+
+    def move(self, opened):
+
+        self.rig.setShutter(opened)
+
+#Thorlabs SC10 shutter controller over its serial port (VISA): the controller
+#is put in manual mode, and its enable state (open shutter) is toggled when it
+#differs from the requested state. Every command is echoed and its reply ends
+#with the "> " prompt
+
+#Parameters: VISA resource name of the serial port, settling time of the
+#shutter [s]
+
+class SC10Shutter(Shutter):
+
+    def __init__(self, resource, settle=0.05):
+
+        super().__init__(settle)
+
+        if pyvisa is None:
+            raise RuntimeError("pyvisa is required for the SC10 shutter")
+
+        self.inst = pyvisa.ResourceManager().open_resource(
+            resource, baud_rate=9600, write_termination="\r", read_termination=">")
+
+        self.query("mode=1")
+
+    #Sends a command and reads its reply
+    #Parameters: command string
+    #Returns reply (without the echoed command and prompt)
+    def query(self, cmd):
+
+        self.inst.write(cmd)
+        lines = [line.strip() for line in self.inst.read().split("\r")]
+        lines = [line for line in lines if line and line != cmd]
+
+        return lines[0] if lines else ""
+
+    def move(self, opened):
+
+        if (self.query("ens?") == "1") != opened:
+            self.query("ens")
+
+    #Releases the controller
+    def close(self):
+
+        self.inst.close()
+
+#_______________________________________________________________________________
+
+#Cache of dark current calibrations backed by a JSON file (rewritten atomically
+#on every update), keyed by DUT or fixture ID and temperature rounded to a
+#temperature step
+
+#Parameters: path of the cache file, time after which a calibration expires
+#[s], temperature step of the keys [degrees C]
+
+class DarkCache:
+
+    def __init__(self, path="dark.json", expiry=3600.0, tempStep=1.0):
+
+        self.path = path
+        self.expiry = expiry
+        self.tempStep = tempStep
+
+        #Calibrations by key
+        self.entries = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    #Key of a DUT at a temperature
+    #Parameters: DUT or fixture ID, temperature [degrees C] (None if unknown)
+    #Returns key string
+    def key(self, dutID, temperature=None):
+
+        if temperature is None:
+            return str(dutID)
+
+        return str(dutID) + "@" + format(round(temperature/self.tempStep)*self.tempStep,
+                                         "g")
+
+    #Looks up a calibration that has not expired
+    #Parameters: DUT or fixture ID, temperature [degrees C]
+    #Returns calibration dictionary (with its age [s]), or None if there is no
+    #current calibration
+    def get(self, dutID, temperature=None):
+
+        entry = self.entries.get(self.key(dutID, temperature))
+
+        if entry is None:
+            return None
+
+        age = time.time() - entry["stored"]
+
+        if age > self.expiry:
+            return None
+
+        return dict(entry, age=age)
+
+    #Stores a calibration (with time of storage)
+    #Parameters: DUT or fixture ID, temperature [degrees C], calibration
+    #dictionary
+    #No return
+    def put(self, dutID, temperature, stats):
+
+        self.entries[self.key(dutID, temperature)] = dict(stats, temperature=temperature,
+                                                          stored=time.time())
+        self.purge()
+
+    #Removes expired calibrations (so the file does not grow with every DUT
+    #and temperature) and writes the cache file
+    #No return
+    def purge(self):
+
+        now = time.time()
+        expired = [k for k, e in self.entries.items() if now - e["stored"] > self.expiry]
+
+        for k in expired:
+            del self.entries[k]
+
+        self.save()
+
+    #Writes cache file (through a temporary file, so an interrupted write
+    #leaves the previous cache intact)
+    def save(self):
+
+        tmp = self.path + ".tmp"
+
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=2)
+
+        os.replace(tmp, self.path)
+
+#_______________________________________________________________________________
+
+#Current cached calibration of a DUT
+
+#Parameters: dark calibration cache (None for no cache), DUT or fixture ID
+#(None if unknown), temperature [degrees C] (None if unknown)
+
+#Returns calibration dictionary, or None if there is no current calibration
+
+def lookup(cache, dutID, temperature=None):
+
+    if cache is None or dutID is None:
+        return None
+
+    return cache.get(dutID, temperature)
+
+#_______________________________________________________________________________
+
+#Dark current of a DUT: taken from a current cached calibration (restoring its
+#noise for the signal threshold and sequential test of processes.check(),
+#widened by the drift of the calibration over its age), otherwise calibrated
+#with a burst of readings behind the closed shutter and cached
+
+#Parameters: number of dark current readings, dark calibration cache (None
+#to always calibrate), DUT or fixture ID (None to always calibrate),
+#temperature [degrees C] (None if unknown)
+
+#Returns mean dark current (statistics of the calibration kept as
+#processes.darkStats)
+
+def calibrate(samples, cache=None, dutID=None, temperature=None):
+
+    stats = lookup(cache, dutID, temperature)
+
+    if stats is not None:
+
+        #Dark current may have drifted since the calibration
+        noise = stats["noise"]
+
+        if stats["drift"]:
+            noise = math.hypot(noise or 0.0, stats["drift"]*stats["age"])
+
+        processes.darkNoise = noise
+        processes.darkStats = dict(stats, noise=noise, cached=True)
+
+        print("Dark current from calibration of " + format(stats["age"], ".0f")
+              + " s ago: " + format(stats["mean"], ".4g") + " +/- "
+              + format(noise or 0.0, ".2g"))
+
+        return stats["mean"]
+
+    darkCur = processes.calibrate(samples)
+
+    if cache is not None and dutID is not None:
+        cache.put(dutID, temperature, processes.darkStats)
+
+    processes.darkStats = dict(processes.darkStats, cached=False)
+
+    return darkCur
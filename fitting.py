@@ -0,0 +1,262 @@
+#Beam profile models and least-squares fitting used by the alignment processes
+
+import numpy as np
+
+#_______________________________________________________________________________
+
+#Gaussian profile with offset: c + A*exp(-2*(x - x0)^2/w^2)
+
+#Parameters: positions, parameter array (offset c, amplitude A, centre x0,
+#1/e^2 radius w)
+
+#Returns model values and Jacobian with respect to the parameters
+
+def gauss(x, p):
+
+    c, a, x0, w = p
+    u = (x - x0)/w
+    e = np.exp(-2*u**2)
+    f = c + a*e
+
+    jac = np.column_stack((np.ones_like(x), e, a*e*4*u/w, a*e*4*u**2/w))
+
+    return f, jac
+
+#Lorentzian profile with offset: c + A/(1 + ((x - x0)/w)^2)
+
+#Parameters: positions, parameter array (offset c, amplitude A, centre x0,
+#half width at half maximum w)
+
+#Returns model values and Jacobian with respect to the parameters
+
+def lorentz(x, p):
+
+    c, a, x0, w = p
+    u = (x - x0)/w
+    d = 1/(1 + u**2)
+    f = c + a*d
+
+    jac = np.column_stack((np.ones_like(x), d, a*d**2*2*u/w, a*d**2*2*u**2/w))
+
+    return f, jac
+
+#Focus curve of a Gaussian beam on a small detector: the spot radius grows as
+#w0*sqrt(1 + ((z - z0)/zR)^2) with defocus, so the intensity at a detector
+#offset r from the beam axis is c + A*d*exp(-b*d) with d = 1/(1 + ((z - z0)/zR)^2)
+#and b = 2*r^2/w0^2 (a Lorentzian on the beam axis, flattened near focus off it)
+
+#Parameters: positions, parameter array (offset c, amplitude A, focus z0,
+#Rayleigh range zR, off-axis term b)
+
+#Returns model values and Jacobian with respect to the parameters
+
+def waist(x, p):
+
+    c, a, x0, w, b = p
+    u = (x - x0)/w
+    d = 1/(1 + u**2)
+    g = d*np.exp(-b*d)
+    f = c + a*g
+
+    #Derivative of d*exp(-b*d) with respect to u
+    dg = -2*u*d**2*np.exp(-b*d)*(1 - b*d)
+
+    jac = np.column_stack((np.ones_like(x), g, -a*dg/w, -a*dg*u/w, -a*g*d))
+
+    return f, jac
+
+#Available profile models by name
+models = {"gauss": gauss, "lorentz": lorentz, "waist": waist}
+
+#_______________________________________________________________________________
+
+#Fits a profile model to readings with Levenberg-Marquardt iterations (each
+#step solved with numpy least squares)
+
+#Parameters: model function, positions, readings, initial parameter array,
+#iteration limit
+
+#Returns fitted parameter array and coefficient of determination (R^2), or
+#None if the fit did not converge
+
+def levmar(model, x, y, p, iters=100):
+
+    f, jac = model(x, p)
+    sse = np.sum((y - f)**2)
+    lam = 1e-3
+
+    for count in range(iters):
+
+        #Damped Gauss-Newton step from augmented least-squares system
+        scale = np.sqrt(lam*np.sum(jac**2, axis=0)) + 1e-12
+        a = np.vstack((jac, np.diag(scale)))
+        b = np.concatenate((y - f, np.zeros(len(p))))
+        delta = np.linalg.lstsq(a, b, rcond=None)[0]
+
+        pNew = p + delta
+        fNew, jacNew = model(x, pNew)
+        sseNew = np.sum((y - fNew)**2)
+
+        if np.isfinite(sseNew) and sseNew < sse:
+
+            #Converged once the relative improvement is negligible
+            done = sse - sseNew <= 1e-10*sse
+
+            p, f, jac, sse = pNew, fNew, jacNew, sseNew
+            lam = max(lam/10, 1e-12)
+
+            if done:
+                break
+
+        else:
+
+            lam *= 10
+
+            if lam > 1e12:
+                break
+
+    if not np.all(np.isfinite(p)):
+        return None
+
+    sst = np.sum((y - y.mean())**2)
+
+    return p, (1 - sse/sst if sst > 0 else 0.0)
+
+#_______________________________________________________________________________
+
+#Fits a beam profile model (with offset) to readings along one axis
+
+#Parameters: positions, readings, model name ("gauss" or "lorentz")
+
+#Returns dictionary with fitted centre, width, amplitude, offset and R^2 (in
+#units of the positions and readings), or None if the fit failed
+
+def fitProfile(pos, vals, model="gauss"):
+
+    pos = np.asarray(pos, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+
+    if len(pos) < 4:
+        return None
+
+    #Positions and readings normalized for conditioning of the fit
+    x0 = pos.mean()
+    xs = max(np.ptp(pos), 1e-12)
+    ys = max(np.abs(vals).max(), 1e-300)
+    x = (pos - x0)/xs
+    y = vals/ys
+
+    #Initial guess: offset at smallest reading, centre at largest reading,
+    #width from spread of the readings above offset
+    c = y.min()
+    a = y.max() - c
+    weights = np.clip(y - c, 0, None)
+    centre = x[np.argmax(y)]
+    width = np.sqrt(np.sum(weights*(x - centre)**2)/max(np.sum(weights), 1e-300))
+    p = np.array([c, a, centre, max(width, 0.5/len(x))])
+
+    result = levmar(models[model], x, y, p)
+
+    if result is None:
+        return None
+
+    p, r2 = result
+
+    #Profile must be a peak (positive amplitude and width)
+    if p[1] <= 0 or p[3] == 0:
+        return None
+
+    return {"centre": float(x0 + p[2]*xs),
+            "width": float(abs(p[3])*xs),
+            "amplitude": float(p[1]*ys),
+            "offset": float(p[0]*ys),
+            "r2": float(r2)}
+
+#_______________________________________________________________________________
+
+#Fits the beam waist model to readings along the optical axis
+
+#Parameters: positions, readings
+
+#Returns dictionary with fitted focus, its standard error, Rayleigh range,
+#amplitude, offset (in units of the positions and readings), off-axis term and
+#R^2, or None if the fit failed
+
+def fitFocus(pos, vals):
+
+    pos = np.asarray(pos, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+
+    #Standard error needs more readings than parameters
+    if len(pos) < 6:
+        return None
+
+    #Positions and readings normalized for conditioning of the fit
+    x0 = pos.mean()
+    xs = max(np.ptp(pos), 1e-12)
+    ys = max(np.abs(vals).max(), 1e-300)
+    x = (pos - x0)/xs
+    y = vals/ys
+
+    #Initial guess: no offset, focus at largest reading, Rayleigh range of the
+    #sampled span, on the beam axis
+    p = np.array([0.0, y.max(), x[np.argmax(y)], 1.0, 0.0])
+
+    result = levmar(waist, x, y, p)
+
+    if result is None:
+        return None
+
+    p, r2 = result
+
+    #Focus curve must be a peak (positive amplitude, not flattened into a dip)
+    if p[1] <= 0 or p[3] == 0 or p[4] >= 1:
+        return None
+
+    #Standard error of focus from residual variance and the Jacobian
+    f, jac = waist(x, p)
+    var = np.sum((y - f)**2)/(len(x) - len(p))
+    cov = np.linalg.pinv(jac.T @ jac)*var
+
+    return {"focus": float(x0 + p[2]*xs),
+            "focusErr": float(np.sqrt(max(cov[2, 2], 0.0))*xs),
+            "rayleigh": float(abs(p[3])*xs),
+            "amplitude": float(p[1]*ys),
+            "offset": float(p[0]*ys),
+            "offAxis": float(p[4]),
+            "r2": float(r2)}
+
+#_______________________________________________________________________________
+
+#Fits a quadratic surface c + g.u + u.H.u/2 to readings by weighted linear
+#least squares
+
+#Parameters: sample points (one row per point, one column per axis), values at
+#the points, weights of the points, pairs of axes with cross terms (all pairs
+#if None)
+
+#Returns constant term, gradient vector and Hessian matrix at the origin
+
+def fitQuadratic(u, y, weights, pairs=None):
+
+    u = np.asarray(u, dtype=float)
+    y = np.asarray(y, dtype=float)
+    sw = np.sqrt(np.asarray(weights, dtype=float))
+    dim = u.shape[1]
+
+    #Columns: constant, linear terms, squared terms, cross terms
+    if pairs is None:
+        pairs = [(i, j) for i in range(dim) for j in range(i+1, dim)]
+    a = np.column_stack([np.ones(len(u))] + [u[:, i] for i in range(dim)]
+                        + [u[:, i]**2/2 for i in range(dim)]
+                        + [u[:, i]*u[:, j] for i, j in pairs])
+
+    coef = np.linalg.lstsq(a*sw[:, None], y*sw, rcond=None)[0]
+
+    grad = coef[1:dim+1]
+    hess = np.diag(coef[dim+1:2*dim+1])
+
+    for k, (i, j) in enumerate(pairs):
+        hess[i, j] = hess[j, i] = coef[2*dim+1+k]
+
+    return coef[0], grad, hess
@@ -0,0 +1,594 @@
+#Headless entry point for unattended alignment: parameters come from a JSON
+#config file (with named profiles) instead of prompts, no step waits for the
+#operator, and the outcome is written as a JSON result for a test scheduler
+
+import argparse
+import contextlib
+import importlib
+import json
+import math
+import os
+import sys
+import numpy as np
+
+import batch
+import checkpoint
+import darkcal
+import meters
+import processes
+import simulation
+from recipes import RecipeStore
+from tracking import DriftTracker
+
+#Stage driver is only required on the bench (simulated rig replaces the stages
+#otherwise)
+try:
+    from pylablib.devices import Thorlabs
+except ImportError:
+    Thorlabs = None
+
+#Parameters of the alignment flow (as in alignment.py) with their type and
+#default value (None where the parameter is optional)
+parameters = {
+
+    #Noise exceedance factor, coarse step size [micrometres], step limit for
+    #single-axis optimization, cycle count limit for multi-axis optimization,
+    #threshold factor (autotune.py recommendations for medium spots)
+    "sigFact": (float, 2.0),
+    "stepC": (float, 100.0),
+    "stepLim": (int, 100),
+    "opt": (int, 10),
+    "threshFact": (float, 0.8),
+
+    #Dimensions of the planar scan area [millimetres], absolute center
+    #position of a stage [encoder counts], minimum actuator resolution
+    #[micrometres]
+    "dim": (float, 24.984),
+    "centPos": (float, 428800.0),
+    "minRes": (float, 0.05),
+
+    #Number of dark current readings, error rate of the sequential signal test
+    #(None for a single reading per check), dark current noise standard
+    #deviations a signal must exceed the dark current by (None for sigFact
+    #alone), fixed dark current for DUT (None to calibrate with the shutter),
+    #shutter function as "module:function" (called with True to open and False
+    #to close the shutter)
+    "darkSamples": (int, 10),
+    "checkErr": (float, 0.01),
+    "noiseFact": (float, None),
+
+    #VISA resource of a source meter (meters.SourceMeter) read instead of the
+    #DMM (None for the DMM), bias voltage of the DUT [V], number of samples
+    #averaged per optimization reading (one bulk transfer with a buffered
+    #meter)
+    "meterResource": (str, None),
+    "meterBias": (float, 0.0),
+    "avgSamples": (int, 1),
+
+    "darkCur": (float, None),
+    "shutter": (str, None),
+
+    #VISA resource of a Thorlabs SC10 shutter controller (darkcal.SC10Shutter)
+    #used instead of a shutter function (None for no controller)
+    "shutterResource": (str, None),
+
+    #File of the dark calibration cache (None to calibrate on every run), time
+    #after which a cached calibration expires [s], DUT temperature the cache is
+    #keyed by [degrees C] (None if not controlled)
+    "darkFile": (str, None),
+    "darkExpiry": (float, 3600.0),
+    "temperature": (float, None),
+
+    #Beam profile model for coarse optimization ("gauss", "lorentz" or None
+    #for edge search), Brent search for fine optimization, joint 3-axis coarse
+    #optimization
+    "coarseModel": (str, None),
+    "fineBrent": (bool, False),
+    "focusFit": (bool, False),
+    "coarseJoint": (bool, False),
+
+    #Fly-scan and hierarchical planar search, with 1/e^2 spot diameter and
+    #active area diameter [micrometres]
+    "flyScan": (bool, False),
+    "hierSearch": (bool, False),
+    "spotSize": (float, 120.0),
+    "mapSteps": (int, 2),
+    "activeArea": (float, 20.0),
+
+    #Motion/acquisition engine and measurement cache
+    "useEngine": (bool, False),
+    "useCache": (bool, False),
+
+    #Time the aligned peak is tracked against drift (0 for no tracking) and
+    #period of the dither cycles [s]
+    "trackTime": (float, 0.0),
+    "trackPeriod": (float, 10.0),
+
+    #Serial numbers of x, y, z translation stages
+    "stages": (list, ["", "", ""]),
+
+    #DUT or fixture ID (None to neither warm-start nor store a recipe), and
+    #file of the recipe store
+    "dutID": (str, None),
+    "recipeFile": (str, "recipes.json"),
+
+    #CSV file of nominal device positions for batch alignment of a DUT array
+    #(None to align a single DUT), and CSV file of per-device results
+    "arrayFile": (str, None),
+    "summaryFile": (str, "array_summary.csv"),
+
+    #Checkpoint file written after each phase and axis pass (None for no
+    #checkpoints; single DUT runs only), and boolean selecting resume of an
+    #interrupted run of the DUT from its checkpoint
+    "checkpointFile": (str, None),
+    "resume": (bool, False),
+
+    #Trace file, profiling, and CSV file of the profile breakdown (None for no
+    #trace or export)
+    "traceFile": (str, None),
+    "profileRun": (bool, False),
+    "profileFile": (str, None)}
+
+#Parameters accepting None besides those with a default of None
+nullable = {"checkErr"}
+
+#Globals of processes a job sets from its config (restored by a session to its
+#state after opening before each job, so a job does not inherit the shutter or
+#meter of the previous one)
+jobState = ("shutter", "checkErr", "noiseFact", "avgSamples", "darkNoise", "darkStats",
+            "meter", "read_dmm", "trigger_dmm", "fetch_dmm", "read_block")
+
+#Built-in profiles by beam size class (autotune.py recommendations for 1/e^2
+#spot radii of about 20, 60 and 150 micrometres)
+builtinProfiles = {
+    "small": {"stepC": 25.0, "stepLim": 200, "opt": 30, "threshFact": 0.9},
+    "medium": {"stepC": 100.0, "stepLim": 100, "opt": 10, "threshFact": 0.8},
+    "large": {"stepC": 100.0, "stepLim": 50, "opt": 10, "threshFact": 0.8}}
+
+#Exit codes of the command line entry point
+EXIT_ALIGNED = 0
+EXIT_FAILED = 1
+EXIT_ERROR = 2
+
+#_______________________________________________________________________________
+
+#Converts a configured value to the type of its parameter
+
+#Parameters: parameter name, configured value
+
+#Returns typed value (ValueError if the parameter is unknown or the value
+#does not have its type)
+
+def typed(name, value):
+
+    if name not in parameters:
+        raise ValueError("unknown parameter '" + name + "'")
+
+    kind, default = parameters[name]
+
+    if value is None and (default is None or name in nullable):
+        return None
+
+    #Integers are accepted for real-valued parameters, but booleans are not
+    #accepted as numbers
+    if kind is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = float(value)
+
+    if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+        raise ValueError("parameter '" + name + "' must be of type " + kind.__name__
+                         + ", not " + repr(value))
+
+    if name == "stages" and (len(value) != 3 or not all(isinstance(v, str) for v in value)):
+        raise ValueError("parameter 'stages' must list three serial numbers (x, y, z)")
+
+    if name == "coarseModel" and value not in ("gauss", "lorentz"):
+        raise ValueError("parameter 'coarseModel' must be 'gauss', 'lorentz' or null")
+
+    return value
+
+#_______________________________________________________________________________
+
+#Loads a config: defaults, overridden by the top-level parameters of the config
+#file, then by the selected profile (from the "profiles" section of the file or
+#the built-in profiles), then by explicit overrides
+
+#Parameters: path of JSON config file (None for defaults only), profile name
+#(None for no profile), dictionary of parameter overrides
+
+#Returns dictionary of typed parameters (ValueError if the config is invalid)
+
+def loadConfig(path=None, profile=None, overrides=None):
+
+    data = {}
+
+    if path is not None:
+        with open(path) as f:
+            data = json.load(f)
+
+    if not isinstance(data, dict):
+        raise ValueError("config must be a JSON object")
+
+    profiles = dict(builtinProfiles, **data.pop("profiles", {}))
+
+    if profile is not None and profile not in profiles:
+        raise ValueError("unknown profile '" + profile + "' (available: "
+                         + ", ".join(profiles) + ")")
+
+    config = {name: default for name, (kind, default) in parameters.items()}
+
+    for layer in (data, profiles[profile] if profile is not None else {},
+                  overrides or {}):
+        for name, value in layer.items():
+            config[name] = typed(name, value)
+
+    if config["stepC"] <= 0 or config["minRes"] <= 0:
+        raise ValueError("step sizes must be positive")
+
+    if not 0 < config["threshFact"] < 1:
+        raise ValueError("parameter 'threshFact' must be between 0 and 1")
+
+    if config["sigFact"] <= 1:
+        raise ValueError("parameter 'sigFact' must exceed 1")
+
+    return config
+
+#Imports a shutter function given as "module:function"
+def importFunction(spec):
+
+    module, sep, name = spec.partition(":")
+
+    if not sep:
+        raise ValueError("shutter must be given as 'module:function'")
+
+    return getattr(importlib.import_module(module), name)
+
+#_______________________________________________________________________________
+
+#Source meter of a run: taken from the open meters by VISA resource (opened
+#there on first use, otherwise set to the bias of the run), or opened for the
+#run only
+
+#Parameters: dictionary of typed parameters, dictionary of open source meters
+#by VISA resource (None to open a new meter)
+
+#Returns source meter
+
+def openMeter(config, openMeters=None):
+
+    resource = config["meterResource"]
+
+    if openMeters is None:
+        return meters.SourceMeter(resource, config["meterBias"])
+
+    if resource not in openMeters:
+        openMeters[resource] = meters.SourceMeter(resource, config["meterBias"])
+    else:
+        openMeters[resource].setBias(config["meterBias"])
+
+    return openMeters[resource]
+
+#_______________________________________________________________________________
+
+#Runs the alignment flow of alignment.py without operator interaction: stages
+#are centred instead of manually aligned, and the dark current is calibrated
+#through the shutter function (or taken from the config, the dark calibration
+#cache or a stored recipe)
+
+#Parameters: dictionary of typed parameters (loadConfig()), list of stages
+#(None to connect the configured stages), dictionary of open source meters by
+#VISA resource kept between jobs (None to open the configured meter for this
+#run only)
+
+#Returns result dictionary (status "aligned", "failed" when an alignment
+#process could not complete, or "error" when the run could not be carried out)
+
+def runAlignment(config, stages=None, openMeters=None):
+
+    result = {"status": "error", "dutID": config["dutID"], "warm": False,
+              "phase": None, "error": None, "position": None,
+              "positionUm": None, "photocurrent": None, "darkCur": None,
+              "dark": None, "resumed": None,
+              "time": None, "devices": None, "cache": None, "tracking": None}
+
+    tStart = None
+
+    #Meter and shutter controller opened for this run only (closed at the end
+    #of the run)
+    ownMeter = ownShutter = None
+
+    try:
+
+        if stages is None:
+
+            if Thorlabs is None:
+                raise RuntimeError("pylablib is required to connect stages")
+
+            stages = [Thorlabs.KinesisMotor(serial) for serial in config["stages"]]
+
+        processes.s[:] = stages
+        processes.checkErr = config["checkErr"]
+        processes.noiseFact = config["noiseFact"]
+        processes.darkNoise = processes.darkStats = None
+        processes.avgSamples = config["avgSamples"]
+
+        if config["meterResource"] is not None:
+
+            if openMeters is None:
+                ownMeter = openMeter(config)
+                processes.useMeter(ownMeter)
+            else:
+                processes.useMeter(openMeter(config, openMeters))
+        processes.phase = "setup"
+
+        if config["shutter"] is not None:
+            processes.shutter = importFunction(config["shutter"])
+
+        elif config["shutterResource"] is not None:
+            ownShutter = darkcal.SC10Shutter(config["shutterResource"])
+            processes.shutter = ownShutter
+
+        tStart = processes.clock()
+
+        if config["useEngine"]:
+            processes.startEngine()
+
+        if config["traceFile"] is not None:
+            processes.startTrace(config["traceFile"])
+
+        if config["profileRun"]:
+            processes.startProfile()
+
+        #Interrupted run of the same DUT resumed from its checkpoint (if the
+        #DUT still shows signal at the checkpoint position)
+        state = None
+
+        if config["checkpointFile"] is not None and config["arrayFile"] is None:
+
+            state = processes.startCheckpoint(config["checkpointFile"], config["resume"])
+
+            if state is not None and (state.get("dutID") != config["dutID"]
+                                      or not processes.resumeCheckpoint(state,
+                                                                        config["sigFact"])):
+                state = None
+
+        result["resumed"] = state["stage"] if state is not None else None
+
+        #Known DUTs start from the stored position with a local search
+        store = RecipeStore(config["recipeFile"])
+        recipe = store.get(config["dutID"]) if config["dutID"] is not None else None
+        stepC = config["stepC"]
+
+        result["warm"] = (state is None and recipe is not None
+                          and processes.warmStart(recipe, stepC, config["sigFact"]))
+
+        if result["warm"]:
+            darkCur = recipe["darkCur"]
+
+        elif state is not None:
+            darkCur = state["darkCur"]
+
+        else:
+
+            #Stages centred in place of the manual alignment
+            for ID in range(3):
+                processes.moveTo(ID, config["centPos"])
+                processes.s[ID].posCur = config["centPos"]
+
+            darkCache = (darkcal.DarkCache(config["darkFile"], config["darkExpiry"])
+                         if config["darkFile"] is not None else None)
+
+            if config["darkCur"] is not None:
+                darkCur = config["darkCur"]
+
+            elif (processes.shutter is not None
+                  or darkcal.lookup(darkCache, config["dutID"], config["temperature"])):
+                darkCur = darkcal.calibrate(config["darkSamples"], darkCache,
+                                            config["dutID"], config["temperature"])
+                result["dark"] = processes.darkStats
+
+            else:
+                raise RuntimeError("dark current calibration requires a shutter "
+                                   "function, a cached calibration or a fixed darkCur")
+
+            processes.saveCheckpoint("calibrate", dutID=config["dutID"],
+                                     darkCur=float(darkCur))
+
+        if not checkpoint.done(state, "planar"):
+
+            if not result["warm"]:
+
+                cycleStop = 2*math.floor(config["dim"]*1000/(2*stepC))
+
+                if config["hierSearch"]:
+                    processes.hierScan(config["spotSize"], config["activeArea"], stepC,
+                                       config["dim"], darkCur, config["sigFact"],
+                                       neighbourhood=config["mapSteps"])
+                else:
+                    processes.plnrScan(stepC, cycleStop, darkCur, config["sigFact"],
+                                       config["flyScan"], neighbourhood=config["mapSteps"])
+
+            processes.saveCheckpoint("planar", dutID=config["dutID"],
+                                     darkCur=float(darkCur))
+
+        result["darkCur"] = float(darkCur)
+
+        if config["useCache"]:
+            processes.startCache(config["minRes"]*simulation.cntsPerUm)
+
+        if config["arrayFile"] is not None:
+
+            layout = np.loadtxt(config["arrayFile"], delimiter=",", ndmin=2)
+            nominal = [[processes.s[ID].posCur + p[ID]*simulation.cntsPerUm
+                        for ID in range(3)] for p in layout]
+
+            devices = batch.alignArray(nominal, stepC, config["threshFact"],
+                                       config["minRes"], config["sigFact"], darkCur,
+                                       config["stepLim"], config["opt"],
+                                       config["coarseModel"], config["fineBrent"],
+                                       config["focusFit"])
+            batch.writeSummary(devices, config["summaryFile"])
+
+            result["devices"] = devices
+            result["status"] = ("aligned" if all(d["success"] for d in devices)
+                                else "failed")
+
+        else:
+
+            #Coarse optimization already completed before a checkpoint
+            if checkpoint.done(state, "coarse"):
+                success = True
+            elif config["coarseJoint"]:
+                success = processes.coarseAlign3D(stepC, config["opt"], darkCur)
+            else:
+                success = processes.coarseAlign(stepC, config["threshFact"],
+                                                config["stepLim"], config["opt"],
+                                                config["coarseModel"],
+                                                processes.coarseAxes(),
+                                                config["focusFit"])
+
+            if success:
+                processes.fineAlign(stepC, config["threshFact"], config["minRes"],
+                                    config["fineBrent"], checkpoint.fineAxes(state))
+                result["photocurrent"] = float(processes.measure())
+
+                if config["dutID"] is not None:
+                    store.put(config["dutID"], processes.makeRecipe(darkCur))
+
+            #Aligned peak tracked against drift (without the cache, whose
+            #readings drift invalidates), re-aligning if it is lost
+            if success and config["trackTime"] > 0:
+
+                result["cache"] = processes.stopCache()
+                tracker = DriftTracker(period=config["trackPeriod"], darkCur=darkCur)
+
+                success = tracker.run(config["trackTime"], lambda: processes.realign(
+                    stepC, config["threshFact"], config["stepLim"], config["opt"],
+                    config["minRes"], config["coarseModel"], config["fineBrent"],
+                    config["focusFit"]))
+                result["tracking"] = tracker.report()
+
+            result["status"] = "aligned" if success else "failed"
+
+    #Alignment processes terminate the program when no signal is found
+    except SystemExit:
+        result["status"] = "failed"
+
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = type(e).__name__ + ": " + str(e)
+
+    finally:
+
+        result["phase"] = processes.phase
+        result["cache"] = processes.stopCache() or result["cache"]
+
+        #Checkpoint kept for a resume unless the run completed
+        processes.stopCheckpoint(result["status"] == "aligned")
+        processes.stopEngine()
+        processes.stopTrace()
+        processes.stopProfile(config["profileFile"])
+
+        if ownMeter is not None:
+            ownMeter.close()
+
+        if ownShutter is not None:
+            ownShutter.close()
+
+    if len(processes.s) == 3 and all(hasattr(stage, "posCur") for stage in processes.s):
+        result["position"] = [float(stage.posCur) for stage in processes.s]
+        result["positionUm"] = [p/simulation.cntsPerUm for p in result["position"]]
+
+    if tStart is not None:
+        result["time"] = processes.clock() - tStart
+
+    return result
+
+#_______________________________________________________________________________
+
+#Writes a result as JSON (through a temporary file, so a scheduler never reads
+#a partial result)
+
+#Parameters: result dictionary, path of result file (None for stdout)
+#No return
+
+def writeResult(result, path=None):
+
+    if path is None:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+
+    tmp = path + ".tmp"
+
+    with open(tmp, "w") as f:
+        json.dump(result, f, indent=2)
+
+    os.replace(tmp, path)
+
+#_______________________________________________________________________________
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run alignment without operator "
+                                     "interaction from a config file")
+    parser.add_argument("config", nargs="?", help="JSON config file")
+    parser.add_argument("--profile", help="named parameter profile (from the "
+                        "config file, or small, medium, large)")
+    parser.add_argument("--dut", help="DUT or fixture ID (overrides the config)")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=JSON",
+                        help="parameter overrides, e.g. stepC=50 useCache=true")
+    parser.add_argument("--result", help="file to write the JSON result to "
+                        "(default: stdout)")
+    parser.add_argument("--simulate", type=float, nargs=3, metavar=("X", "Y", "Z"),
+                        help="run on a simulated rig with the beam offset from the "
+                        "stage centre [um]")
+    parser.add_argument("--seed", type=int, help="seed of the simulated rig")
+    args = parser.parse_args()
+
+    #Progress messages of the alignment processes go to stderr, keeping stdout
+    #for the result
+    with contextlib.redirect_stdout(sys.stderr):
+
+        try:
+
+            overrides = {}
+
+            for item in args.set:
+                name, sep, value = item.partition("=")
+
+                if not sep:
+                    raise ValueError("override '" + item + "' must be NAME=JSON")
+
+                overrides[name] = json.loads(value)
+
+            if args.dut is not None:
+                overrides["dutID"] = args.dut
+
+            config = loadConfig(args.config, args.profile, overrides)
+
+        except (OSError, ValueError) as e:
+            config = None
+            result = {"status": "error", "error": type(e).__name__ + ": " + str(e)}
+
+        if config is not None:
+
+            stages = None
+
+            if args.simulate is not None:
+
+                centre = (config["centPos"]
+                          + np.asarray(args.simulate)*simulation.cntsPerUm)
+                rig = simulation.Rig(simulation.Beam(centre), seed=args.seed)
+                rig.install(processes)
+                stages = rig.stages
+
+                #Shutter of the simulated rig settles like a hardware shutter
+                processes.shutter = darkcal.SimulatedShutter(rig)
+
+            result = runAlignment(config, stages)
+            result["config"] = config
+
+    writeResult(result, args.result)
+
+    sys.exit({"aligned": EXIT_ALIGNED, "failed": EXIT_FAILED}.get(result["status"],
+                                                                  EXIT_ERROR))
@@ -0,0 +1,204 @@
+#Meter drivers behind a common interface: single readings for the alignment
+#processes, and buffered acquisition (a number of triggered or timed samples
+#armed at once and read back in one bulk transfer as a NumPy array)
+
+import numpy as np
+
+#Drivers are only required for the meter in use
+try:
+    from pydmm.pydmm import read_dmm
+except ImportError:
+    read_dmm = None
+
+try:
+    import pyvisa
+except ImportError:
+    pyvisa = None
+
+#_______________________________________________________________________________
+
+#Meter interface (drivers without a sample buffer take armed samples one at a
+#time when they are fetched)
+
+class Meter:
+
+    def __init__(self):
+
+        #Samples armed and not yet fetched, and interval between them [s]
+        self.armed = 0
+        self.interval = 0.0
+
+    #Takes a single reading
+    #Returns reading
+    def read(self):
+
+        raise NotImplementedError
+
+    #Arms a buffered acquisition
+    #Parameters: number of samples, interval between samples [s], boolean
+    #selecting an external hardware trigger for each sample (instead of timed
+    #samples)
+    #No return
+    def arm(self, count, interval=0.0, external=False):
+
+        if external:
+            raise ValueError(type(self).__name__ + " has no external trigger input")
+
+        self.armed = count
+        self.interval = interval
+
+    #Reads back armed samples
+    #Returns array of samples
+    def fetch(self):
+
+        vals = np.array([self.read() for count in range(self.armed)], dtype=float)
+        self.armed = 0
+
+        return vals
+
+    #Takes a number of timed samples and reads them back in one transfer
+    #Parameters: number of samples, interval between samples [s]
+    #Returns array of samples
+    def readBlock(self, count, interval=0.0):
+
+        self.arm(count, interval)
+
+        return self.fetch()
+
+    #Releases the meter
+    def close(self):
+
+        pass
+
+#_______________________________________________________________________________
+
+#Digital multimeter read through pydmm (single-sample transfers only)
+
+#Parameters: read function (pydmm read_dmm if None)
+
+class DMMMeter(Meter):
+
+    def __init__(self, read=None):
+
+        super().__init__()
+
+        if read is None and read_dmm is None:
+            raise RuntimeError("pydmm is required for the DMM")
+
+        self._read = read or read_dmm
+
+    def read(self):
+
+        return self._read()
+
+#_______________________________________________________________________________
+
+#Keithley 2400 series source meter over VISA: the DUT is biased with a source
+#voltage and its current is measured; buffered samples are triggered by the
+#trigger layer (timed, or from the trigger link input) and fetched in one
+#transfer
+
+#Parameters: VISA resource name, bias voltage [V], integration time [power
+#line cycles], current compliance [A]
+
+class SourceMeter(Meter):
+
+    def __init__(self, resource, bias=0.0, nplc=1.0, compliance=1e-3):
+
+        super().__init__()
+
+        if pyvisa is None:
+            raise RuntimeError("pyvisa is required for the source meter")
+
+        self.inst = pyvisa.ResourceManager().open_resource(resource)
+
+        #Trigger settings left by the last armed acquisition (external trigger
+        #line, trigger count, delay between samples [s]), restored only when a
+        #single reading needs other settings
+        self.external = False
+        self.count = 1
+        self.delay = 0.0
+
+        for cmd in ("*RST", ":SOUR:FUNC VOLT", ":SOUR:VOLT " + str(bias),
+                    ":SENS:FUNC 'CURR'", ":SENS:CURR:PROT " + str(compliance),
+                    ":SENS:CURR:NPLC " + str(nplc), ":FORM:ELEM CURR",
+                    ":TRIG:COUN 1", ":OUTP ON"):
+            self.inst.write(cmd)
+
+    #Sets the bias voltage of the DUT
+    #Parameters: bias voltage [V]
+    #No return
+    def setBias(self, bias):
+
+        self.inst.write(":SOUR:VOLT " + str(bias))
+
+    def read(self):
+
+        #Single readings are armed immediately, not by the trigger line, and
+        #take one sample without delay
+        if self.external:
+            self.inst.write(":ARM:SOUR IMM")
+            self.external = False
+
+        if self.count != 1:
+            self.inst.write(":TRIG:COUN 1")
+            self.count = 1
+
+        if self.delay:
+            self.inst.write(":TRIG:DEL 0")
+            self.delay = 0.0
+
+        return float(self.inst.query(":READ?"))
+
+    def arm(self, count, interval=0.0, external=False):
+
+        self.armed = count
+        self.external = external
+        self.count = count
+        self.delay = interval
+
+        self.inst.write(":ARM:SOUR " + ("TLIN" if external else "IMM"))
+        self.inst.write(":TRIG:COUN " + str(count))
+        self.inst.write(":TRIG:DEL " + str(interval))
+        self.inst.write(":INIT")
+
+    def fetch(self):
+
+        vals = np.asarray(self.inst.query_ascii_values(":FETC?"), dtype=float)
+        self.armed = 0
+
+        return vals
+
+    def close(self):
+
+        self.inst.write(":OUTP OFF")
+        self.inst.close()
+
+#_______________________________________________________________________________
+
+#Meter of a simulated rig (simulation.py), with a sample buffer read back in one
+#transfer
+
+#Parameters: simulated rig
+
+class SimulatedMeter(Meter):
+
+    def __init__(self, rig):
+
+        super().__init__()
+        self.rig = rig
+
+    def read(self):
+
+        return self.rig.read_dmm()
+
+    def arm(self, count, interval=0.0, external=False):
+
+        super().arm(count, interval, external)
+        self.rig.arm(count, interval)
+
+    def fetch(self):
+
+        self.armed = 0
+
+        return self.rig.fetch_block()
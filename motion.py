@@ -0,0 +1,203 @@
+#Motion and acquisition engine for the stages in processes.s (moves and meter
+#reads are queued and run in order on a background thread)
+
+import concurrent.futures
+import queue
+import threading
+
+#_______________________________________________________________________________
+
+#Engine that runs queued stage moves and meter reads on a dispatcher thread.
+#Consecutive moves on different axes run concurrently (an axis is only waited
+#on before a reading or its own next move), and when the meter supports a
+#split read (trigger integration, then fetch value) the transfer of a reading
+#overlaps with the following move
+
+#Parameters: list of stages, meter read function, meter trigger and fetch
+#functions (optional), number of readings a caller may keep outstanding ahead
+#of the one being evaluated (pipeline depth)
+
+class MotionEngine:
+
+    def __init__(self, stages, read, trigger=None, fetch=None, depth=0):
+
+        self.stages = stages
+        self.read = read
+        self.trigger = trigger
+        self.fetch = fetch
+        self.depth = depth
+
+        #Queue of pending operations (kind, arguments, future)
+        self.ops = queue.Queue()
+
+        #Indices of stages with moves issued but not yet waited on
+        self.moving = set()
+
+        #Counters for number of moves and readings issued
+        self.moves = 0
+        self.reads = 0
+
+        #Error of a failed move (callers do not wait on moves, so it is raised
+        #by the next reading or sync instead)
+        self.error = None
+
+        #Worker that fetches readings in order while the dispatcher continues
+        self.fetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.lastFetch = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+    #Queues an operation for the dispatcher
+    #Returns future holding the result of the operation
+    def _submit(self, kind, *args):
+
+        future = concurrent.futures.Future()
+        self.ops.put((kind, args, future))
+
+        return future
+
+    #Queues absolute move of a stage (does not wait for the move)
+    #Parameters: index of stage, target position [encoder counts]
+    #Returns future completed once the move is issued
+    def moveTo(self, ID, pos):
+
+        return self._submit("moveTo", ID, pos)
+
+    #Queues relative move of a stage (does not wait for the move)
+    #Parameters: index of stage, distance [encoder counts]
+    #Returns future completed once the move is issued
+    def moveBy(self, ID, dist):
+
+        return self._submit("moveBy", ID, dist)
+
+    #Queues absolute moves of several stages, which run concurrently
+    #Parameters: dictionary of stage index to target position [encoder counts]
+    #Returns list of futures completed once the moves are issued
+    def moveAll(self, targets):
+
+        return [self.moveTo(ID, pos) for ID, pos in targets.items()]
+
+    #Queues a meter reading, taken once all previously queued moves settled
+    #(transfer of the reading overlaps with following operations)
+    #Returns future holding the reading
+    def readAsync(self):
+
+        return self._submit("read", True)
+
+    #Reads meter once all previously queued moves settled (the caller needs the
+    #value before queueing anything else, so the reading is not split)
+    #Returns reading
+    def measure(self):
+
+        return self._submit("read", False).result()
+
+    #Waits until all queued operations are complete and all stages settled
+    def sync(self):
+
+        self._submit("sync").result()
+
+    #Stops dispatcher thread once all queued operations are complete and all
+    #stages settled
+    def close(self):
+
+        self.ops.put(None)
+        self.thread.join()
+        self.fetcher.shutdown()
+
+    #Waits for all moving stages to settle
+    def _settle(self):
+
+        for ID in self.moving:
+            self.stages[ID].wait_move()
+
+        self.moving.clear()
+
+    #Fetches a triggered reading into its future
+    def _fetch(self, future):
+
+        try:
+            future.set_result(self.fetch())
+        except BaseException as err:
+            future.set_exception(err)
+
+    #Raises the error of a failed move (once)
+    def _raiseError(self):
+
+        if self.error is not None:
+
+            err, self.error = self.error, None
+            self.moving.clear()
+
+            raise err
+
+    #Dispatcher loop
+    def _run(self):
+
+        while True:
+
+            op = self.ops.get()
+
+            if op is None:
+                self._settle()
+                return
+
+            kind, args, future = op
+
+            try:
+
+                if kind in ("moveTo", "moveBy"):
+
+                    ID, pos = args
+
+                    #Axis must finish its previous move first
+                    if ID in self.moving:
+                        self.stages[ID].wait_move()
+
+                    if kind == "moveTo":
+                        self.stages[ID]._move_to(pos)
+                    else:
+                        self.stages[ID]._move_by(pos)
+
+                    self.moving.add(ID)
+                    self.moves += 1
+                    future.set_result(pos)
+
+                elif kind == "read":
+
+                    self._raiseError()
+                    self._settle()
+                    self.reads += 1
+
+                    #Reading transfer overlaps with following operations
+                    if args[0] and self.trigger is not None and self.fetch is not None:
+                        self.trigger()
+                        self.lastFetch = self.fetcher.submit(self._fetch, future)
+
+                    else:
+                        future.set_result(self.read())
+
+                else:
+
+                    self._raiseError()
+                    self._settle()
+
+                    if self.lastFetch is not None:
+                        self.lastFetch.result()
+
+                    future.set_result(None)
+
+            except BaseException as err:
+
+                future.set_exception(err)
+
+                if kind in ("moveTo", "moveBy") and self.error is None:
+                    self.error = err
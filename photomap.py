@@ -0,0 +1,124 @@
+#Sparse 2-D photocurrent map of the planar scan: every reading of the scan is
+#kept with its x/y position, and the beam centre and spot size are estimated
+#from the map so alignment can continue from there
+
+import numpy as np
+
+import fitting
+
+#_______________________________________________________________________________
+
+#Readings at x/y positions, kept in arrays that grow as the scan proceeds
+
+#Parameters: initial capacity [readings]
+
+class PhotoMap:
+
+    def __init__(self, capacity=1024):
+
+        #Positions (x, y) [encoder counts] and readings of the first count rows
+        self.pos = np.empty((capacity, 2))
+        self.vals = np.empty(capacity)
+        self.count = 0
+
+    #Adds a reading
+    #Parameters: x and y position [encoder counts], reading
+    #No return
+    def add(self, x, y, val):
+
+        if self.count == len(self.vals):
+            self.pos = np.concatenate((self.pos, np.empty_like(self.pos)))
+            self.vals = np.concatenate((self.vals, np.empty_like(self.vals)))
+
+        self.pos[self.count] = (x, y)
+        self.vals[self.count] = val
+        self.count += 1
+
+    #Positions and readings added so far
+    #Returns array of positions (one row per reading), array of readings
+    def points(self):
+
+        return self.pos[:self.count], self.vals[:self.count]
+
+    #Strongest reading
+    #Returns position (x, y) [encoder counts] and reading (None if map is empty)
+    def peak(self):
+
+        if self.count == 0:
+            return None, None
+
+        best = int(np.argmax(self.vals[:self.count]))
+
+        return self.pos[best].copy(), float(self.vals[best])
+
+    #Weighted centroid of readings above a fraction of the strongest signal
+    #(weights are the signal above dark current)
+    #Parameters: dark current for DUT, fraction of strongest signal
+    #Returns centroid (x, y) [encoder counts] and RMS spread about it (x, y)
+    #[encoder counts], or None if there is no signal
+    def centroid(self, darkCur, frac=0.5):
+
+        pos, vals = self.points()
+        sig = vals - darkCur
+
+        if len(sig) == 0 or sig.max() <= 0:
+            return None
+
+        w = np.where(sig >= frac*sig.max(), sig, 0.0)
+        centre = w @ pos/w.sum()
+        spread = np.sqrt(w @ (pos - centre)**2/w.sum())
+
+        return centre, spread
+
+    #Estimates beam centre and 1/e^2 spot radius: a quadratic surface is fitted
+    #to the logarithm of the signal above dark current (exact for a Gaussian
+    #spot) over readings above a fraction of the strongest signal; the weighted
+    #centroid is used where the fit is not a peak or its centre lies outside
+    #the mapped readings
+
+    #Parameters: dark current for DUT, fraction of strongest signal of readings
+    #used
+
+    #Returns dictionary with centre (x, y) [encoder counts], 1/e^2 radius (x, y)
+    #[encoder counts, None if not estimated], number of readings used and method
+    #("fit" or "centroid"), or None if there is no signal
+
+    def estimate(self, darkCur, frac=0.05):
+
+        pos, vals = self.points()
+        sig = vals - darkCur
+
+        if len(sig) == 0 or sig.max() <= 0:
+            return None
+
+        used = sig >= frac*sig.max()
+
+        if np.count_nonzero(used) >= 6:
+
+            #Positions relative to the strongest reading, in units of the
+            #spread of the used readings (conditioning of the fit)
+            origin = pos[np.argmax(sig)]
+            scale = np.maximum(np.ptp(pos[used], axis=0), 1.0)
+            u = (pos[used] - origin)/scale
+
+            c, grad, hess = fitting.fitQuadratic(u, np.log(sig[used]),
+                                                 sig[used]/sig.max(), [(0, 1)])
+
+            #Peak needs downward curvature along both axes
+            if np.all(np.linalg.eigvalsh(hess) < 0):
+
+                centre = origin + np.linalg.solve(hess, -grad)*scale
+                lo = pos[used].min(axis=0)
+                hi = pos[used].max(axis=0)
+
+                if np.all(centre >= lo) and np.all(centre <= hi):
+
+                    radius = np.sqrt(-4/np.diag(hess))*scale
+
+                    return {"centre": centre, "radius": radius,
+                            "points": int(np.count_nonzero(used)), "method": "fit"}
+
+        centre, spread = self.centroid(darkCur)
+
+        return {"centre": centre, "radius": None,
+                "points": int(np.count_nonzero(used)), "method": "centroid"}
@@ -1,150 +1,1319 @@
 #Useful alignment processes and subprocesses called from alignment.py
 
-from pydmm.pydmm import read_dmm
 import math
+import statistics
 import sys
+import time
+import numpy as np
+import fitting
+from cache import MeasurementCache
+from checkpoint import STAGES, Checkpoint
+from motion import MotionEngine
+from photomap import PhotoMap
+from profiling import Profiler
+from tracelog import MOVEBY, MOVETO, READ, TraceLog
+
+#Meter driver is only required on the bench (simulated backend in simulation.py
+#replaces read_dmm otherwise)
+try:
+    from pydmm.pydmm import read_dmm
+except ImportError:
+    read_dmm = None
+
+#List to store actuator/stage instances (x, y, z order), populated by
+#alignment.py or a simulated backend
+s = []
+
+#Time source for timestamping readings [s] (replaced by simulated clock in
+#simulation.py)
+clock = time.monotonic
+
+#Waits for a given time [s] (replaced by an advance of the simulated clock in
+#simulation.py)
+sleep = time.sleep
+
+#Split meter read (trigger integration, then fetch value), set when supported by
+#the meter driver
+trigger_dmm = None
+fetch_dmm = None
+
+#Bulk meter read (number of samples armed at once and returned in one transfer
+#as a NumPy array), set by useMeter() for a buffered meter (meters.py)
+read_block = None
+meter = None
+
+#Number of samples averaged per reading of the single-axis optimizations and
+#the signal check (taken in one bulk transfer with a buffered meter)
+avgSamples = 1
+
+#Motion/acquisition engine (motion.py) that stage moves and meter reads are
+#routed through when started
+engine = None
+
+#Measurement cache (cache.py) consulted by measure() when started, and
+#commanded and actual target positions of stages (which differ while moves
+#are deferred) [encoder counts]
+cache = None
+commanded = []
+placed = []
+
+#Trace log (tracelog.py) of moves and readings when started, and name of the
+#process phase recorded with each event
+log = None
+phase = "setup"
+
+#Profiler (profiling.py) of moves and readings by phase when started
+profiler = None
+
+#Photocurrent map (photomap.py) of readings of the last planar scan, and beam
+#centre and spot radius estimated from it (None if not estimated)
+planarMap = None
+planarEstimate = None
+
+#Standard deviation of dark current readings (measured by readDark())
+darkNoise = None
+
+#Checkpoint (checkpoint.py) written after each phase and axis pass when
+#started
+checkpoint = None
+
+#Statistics of the last dark current calibration (mean, noise, drift [per s],
+#number of readings, duration [s]; set by readDark())
+darkStats = None
+
+#Error rate of the sequential signal test in check() (None for a single
+#reading per check), and maximum number of readings per check
+checkErr = None
+checkMax = 10
+
+#Shutter control: function opening (True) or closing (False) the laser shutter
+#(None to ask the operator)
+shutter = None
+
+#Number of dark current noise standard deviations a reading must exceed the
+#dark current by to count as signal, once the noise is measured (None for the
+#noise exceedance factor alone)
+noiseFact = None
+
+#_______________________________________________________________________________
+
+#Terminates alignment protocol
+#No parameters
+#No return
+def end():
+
+    print("Alignment protocol terminated")
+    sys.exit()
+
+#_______________________________________________________________________________
+
+#Starts motion/acquisition engine over the stages in s
+#Parameters: number of readings the planar scan keeps outstanding (pipeline
+#depth)
+#No return
+def startEngine(depth=0):
+
+    global engine
+
+    engine = MotionEngine(s, read_dmm, trigger_dmm, fetch_dmm, depth)
+
+#Stops motion/acquisition engine once queued operations are complete
+#No parameters
+#No return
+def stopEngine():
+
+    global engine
+
+    if engine is not None:
+        engine.close()
+        engine = None
+
+#_______________________________________________________________________________
+
+#Moves a stage by a relative distance and waits for it to settle (queued on the
+#engine when started, which waits before the next reading instead; deferred
+#until a reading is needed when the measurement cache is started)
+#Parameters: index of stage, distance [encoder counts]
+#No return
+def moveBy(ID, dist):
+
+    traceEvent(MOVEBY, ID, dist, math.nan)
+
+    if cache is not None:
+        commanded[ID] += dist
+
+    elif engine is not None:
+        engine.moveBy(ID, dist)
+
+    else:
+        s[ID]._move_by(dist)
+        s[ID].wait_move()
+
+#Moves a stage to an absolute position and waits for it to settle (queued on
+#the engine when started, which waits before the next reading instead;
+#deferred until a reading is needed when the measurement cache is started)
+#Parameters: index of stage, target position [encoder counts]
+#No return
+def moveTo(ID, pos):
+
+    traceEvent(MOVETO, ID, pos, math.nan)
+
+    if cache is not None:
+        commanded[ID] = pos
+
+    elif engine is not None:
+        engine.moveTo(ID, pos)
+
+    else:
+        s[ID]._move_to(pos)
+        s[ID].wait_move()
+
+#Moves all stages to absolute positions, concurrently (queued on the engine when
+#started, deferred when the measurement cache is started); stages already at
+#their target position are not moved
+#Parameters: target positions (x, y, z) [encoder counts]
+#No return
+def moveAll(pos):
+
+    if cache is not None:
+
+        for ID in range(len(pos)):
+            moveTo(ID, pos[ID])
+
+        return
+
+    targets = {ID: pos[ID] for ID in range(len(pos)) if pos[ID] != s[ID].posCur}
+
+    for ID in targets:
+        traceEvent(MOVETO, ID, targets[ID], math.nan)
+
+    _moveAll(targets)
+
+#Moves stages to absolute positions, concurrently
+#Parameters: dictionary of stage index to target position [encoder counts]
+#No return
+def _moveAll(targets):
+
+    if engine is not None:
+        engine.moveAll(targets)
+
+    else:
+
+        #Moves are issued together and then waited on
+        for ID in targets:
+            s[ID]._move_to(targets[ID])
+
+        for ID in targets:
+            s[ID].wait_move()
+
+#Reads meter (through engine when started, after queued moves have settled);
+#with the measurement cache started, a valid cached reading at the commanded
+#position is returned without moving, and deferred moves are made otherwise
+#Parameters: boolean forcing a new reading (repeated readings at a position),
+#number of samples averaged into the reading
+#Returns reading
+def measure(fresh=False, samples=1):
+
+    if cache is not None:
+
+        val = None if fresh else cache.get(commanded, clock())
+
+        if val is not None:
+            return val
+
+        flushMoves()
+
+    if samples > 1:
+        val = float(np.mean(_readBlock(samples)))
+    elif engine is not None:
+        val = engine.measure()
+    else:
+        val = read_dmm()
+
+    traceEvent(READ, -1, math.nan, val)
+    mapReading(val)
+
+    if cache is not None:
+        cache.put(commanded, val, clock())
+
+    return val
+
+#Takes a number of fresh samples at the commanded position (in one bulk
+#transfer with a buffered meter)
+#Parameters: number of samples
+#Returns array of samples
+def measureBlock(count):
+
+    if cache is not None:
+        flushMoves()
+
+    vals = _readBlock(count)
+
+    for val in vals:
+        traceEvent(READ, -1, math.nan, val)
+        mapReading(val)
+
+    return vals
+
+#Reads samples from the meter once queued moves have settled
+def _readBlock(count):
+
+    if read_block is None:
+        return np.array([engine.measure() if engine is not None else read_dmm()
+                         for index in range(count)])
+
+    if engine is not None:
+        engine.sync()
+
+    return np.asarray(read_block(count), dtype=float)
+
+#Reads the meter through a meter driver (meters.py), using its buffer for bulk
+#reads
+#Parameters: meter
+#No return
+def useMeter(m):
+
+    global meter, read_dmm, trigger_dmm, fetch_dmm, read_block
+
+    meter = m
+    read_dmm = m.read
+    read_block = m.readBlock
+    trigger_dmm = fetch_dmm = None
+
+#_______________________________________________________________________________
+
+#Starts measurement cache of readings by quantized stage position (moves are
+#deferred until a reading is not in the cache; the planar scan moves stages
+#directly, so the cache is started after it)
+#Parameters: quantization step of positions [encoder counts], maximum age of
+#a reading [s], tolerated relative change of a reading due to drift
+#No return
+def startCache(quantum=1.0, maxAge=30.0, driftTol=0.02):
+
+    global cache, commanded, placed
+
+    cache = MeasurementCache(quantum, maxAge, driftTol)
+    commanded = [s[ID].posCur for ID in range(len(s))]
+    placed = list(commanded)
+
+#Makes deferred moves to commanded positions
+#No parameters
+#No return
+def flushMoves():
+
+    targets = {ID: commanded[ID] for ID in range(len(commanded))
+               if commanded[ID] != placed[ID]}
+
+    _moveAll(targets)
+
+    for ID in targets:
+        placed[ID] = targets[ID]
+
+#Suspends measurement cache for a process that moves stages directly (the
+#planar scan), moving stages to their commanded positions
+#No parameters
+#Returns suspended cache (None if cache was not started)
+def suspendCache():
+
+    global cache
+
+    held = cache
+
+    if held is not None:
+        flushMoves()
+        cache = None
+
+    return held
+
+#Resumes a suspended measurement cache from the current stage positions
+#Parameters: suspended cache (None if cache was not started)
+#No return
+def resumeCache(held):
+
+    global cache, commanded, placed
+
+    if held is not None:
+        cache = held
+        commanded = [s[ID].posCur for ID in range(len(s))]
+        placed = list(commanded)
+
+#Stops measurement cache, moving stages to their commanded positions
+#No parameters
+#Returns dictionary of cache counters (None if cache was not started)
+def stopCache():
+
+    global cache
+
+    if cache is None:
+        return None
+
+    flushMoves()
+    stats = cache.stats()
+    cache = None
+
+    print("Measurement cache: " + str(stats["hits"]) + " hits, " + str(stats["misses"])
+          + " misses, " + str(stats["evictions"]) + " evictions")
+
+    return stats
+
+#_______________________________________________________________________________
+
+#Starts trace log of all moves and readings
+#Parameters: path of trace file, initial capacity of file [records], number of
+#records written per chunk
+#No return
+def startTrace(path, capacity=1 << 20, chunk=4096):
+
+    global log, phase
+
+    log = TraceLog(path, capacity, chunk)
+    phase = "setup"
+
+#Stops trace log, writing remaining records
+#No parameters
+#No return
+def stopTrace():
+
+    global log
+
+    if log is not None:
+        log.close()
+        log = None
+
+#Starts writing checkpoints of the alignment run
+#Parameters: path of checkpoint file, boolean selecting resume (the checkpoint
+#of an interrupted run is read first)
+#Returns state of the interrupted run when resuming (None if there is none)
+def startCheckpoint(path, resume=False):
+
+    global checkpoint
+
+    checkpoint = Checkpoint(path)
+
+    return checkpoint.load() if resume else None
+
+#Records a completed step of the alignment run with the current, previous and
+#optimized stage positions (no-op when checkpoints are not started)
+#Parameters: completed step (checkpoint.STAGES), further state fields
+#No return
+def saveCheckpoint(stage, **fields):
+
+    if checkpoint is None:
+        return
+
+    checkpoint.update(stage, pos=[float(s[ID].posCur) for ID in range(3)],
+                      pos1=[float(getattr(s[ID], "pos1", s[ID].posCur)) for ID in range(3)],
+                      pos2=[float(getattr(s[ID], "pos2", s[ID].posCur)) for ID in range(3)],
+                      darkNoise=darkNoise, **fields)
+
+#Stops writing checkpoints
+#Parameters: boolean indicating completed run (its checkpoint is removed;
+#otherwise it is kept for a resume)
+#No return
+def stopCheckpoint(completed):
+
+    global checkpoint
+
+    if checkpoint is not None and completed:
+        checkpoint.clear()
+
+    checkpoint = None
+
+#Restores the state of an interrupted run: stages return to the checkpoint
+#positions and, once the planar scan had found signal, a signal check confirms
+#the DUT still shows signal there
+#Parameters: state of the interrupted run, noise exceedance factor
+#Returns True if the run can resume from the checkpoint and False if it has to
+#start over
+def resumeCheckpoint(state, sigFact):
+
+    global darkNoise
+
+    print("Resuming interrupted run after step '" + state["stage"] + "'")
+
+    setPhase("resume")
+
+    for ID in range(3):
+
+        moveTo(ID, state["pos"][ID])
+        s[ID].posCur = state["pos"][ID]
+        s[ID].pos1 = state["pos1"][ID]
+        s[ID].pos2 = state["pos2"][ID]
+        s[ID].name = "xyz"[ID]
+
+    darkNoise = state.get("darkNoise")
+
+    #No signal expected before the planar scan
+    if (STAGES.index(state["stage"]) >= STAGES.index("planar")
+            and not check(state["darkCur"], sigFact)):
+
+        print("No signal at checkpoint position - starting over")
+        return False
+
+    #Later checkpoints of the run keep the state of earlier steps
+    if checkpoint is not None:
+        checkpoint.state = dict(state)
+
+    return True
+
+#Sets name of process phase recorded with trace events
+#Parameters: phase name
+#No return
+def setPhase(name):
+
+    global phase
+
+    phase = name
+
+    if profiler is not None:
+        profiler.enter(name)
+
+#Starts profiler of stage moves and meter reads by phase (the engine, when
+#started, reads through the profiled meter functions)
+#No parameters
+#No return
+def startProfile():
+
+    global profiler
+
+    profiler = Profiler(clock)
+    profiler.instrument(s, sys.modules[__name__])
+    profiler.enter(phase)
+
+    if engine is not None:
+        engine.read = read_dmm
+        engine.trigger = trigger_dmm
+        engine.fetch = fetch_dmm
+
+#Stops profiler, restoring stage and meter functions, and prints breakdown by
+#phase
+#Parameters: path of CSV file to export breakdown to (None to only print)
+#Returns list of statistics by phase (None if profiler was not started)
+def stopProfile(path=None):
+
+    global profiler
+
+    if profiler is None:
+        return None
+
+    profiler.finish()
+    profiler.remove()
+
+    if engine is not None:
+        engine.read = read_dmm
+        engine.trigger = trigger_dmm
+        engine.fetch = fetch_dmm
+
+    profiler.report()
+
+    if path is not None:
+        profiler.export(path)
+
+    rows = profiler.summary()
+    profiler = None
+
+    return rows
+
+#Adds a reading of the planar scan to its photocurrent map
+#Parameters: reading, x and y position [encoder counts] (posCur of x and y
+#stages if None)
+#No return
+def mapReading(val, x=None, y=None):
+
+    if planarMap is None or phase != "planar":
+        return
+
+    if x is None:
+        x, y = s[0].posCur, s[1].posCur
+
+    planarMap.add(x, y, val)
+
+#Records a trace event when the trace log is started
+#Parameters: kind of event (tracelog.py), index of moved stage (-1 for
+#readings), commanded position or distance [encoder counts], reading, current
+#positions of stages (posCur of each stage if None)
+#No return
+def traceEvent(kind, axis, commanded, val, pos=None):
+
+    if log is None:
+        return
+
+    if pos is None:
+        pos = [getattr(stage, "posCur", math.nan) for stage in s]
+
+    log.record(clock(), kind, axis, commanded, pos, val, phase)
 
 #_______________________________________________________________________________
 
 #Obtains dark current for DUT (calibrates for specific DUT)
+#Parameters: number of dark current readings
+
+#Returns dark current
+def calibrate(samples=1):
+
+    #Dark current measured with shutter closed (no light on DUT)
+    setShutter(False)
+
+    #Will be changed to source meter (placeholder for now)
+    readVal = readDark(samples)
+
+    #Shutter needs to be reopened for position that results in maximum
+    #DUT photocurrent to be located
+    setShutter(True)
+
+    #DUT dark current
+    return readVal
+
+#Opens or closes the laser shutter (through the shutter function when set,
+#otherwise by the operator)
+#Parameters: boolean indicating open shutter
+#No return
+def setShutter(opened):
+
+    if shutter is not None:
+        shutter(opened)
+
+    elif opened:
+        input("Open shutter/unblock laser - press enter once complete")
+
+    else:
+        input("Close shutter/block laser - press enter once complete")
+
+#_______________________________________________________________________________
+
+#Reads dark current (shutter must be closed) and stores its noise for the
+#sequential signal test in check(), with the statistics of the readings in
+#darkStats (drift is the slope of a line fitted to the readings over the time
+#they took)
+
+#Parameters: number of readings
+
+#Returns mean dark current
+def readDark(samples=1):
+
+    global darkNoise, darkStats
+
+    setPhase("dark")
+
+    #Readings taken in one bulk transfer with a buffered meter
+    tStart = clock()
+    vals = measureBlock(samples)
+    duration = clock() - tStart
+
+    #Noise can only be estimated from more than one reading, and drift from
+    #more than two
+    if samples > 1:
+        darkNoise = statistics.stdev(vals.tolist())
+
+    drift = 0.0
+
+    if samples > 2 and duration > 0:
+        drift = float(np.polyfit(np.linspace(0, duration, samples), vals, 1)[0])
+
+    darkStats = {"mean": float(vals.mean()),
+                 "noise": float(darkNoise) if samples > 1 else None,
+                 "drift": drift, "samples": samples, "duration": duration}
+
+    return darkStats["mean"]
+
+#_______________________________________________________________________________
+
+#Signal threshold: the dark current times the noise exceedance factor, raised
+#to noiseFact standard deviations of the dark current noise above the dark
+#current when the noise is measured (a ratio alone passes noise on a small or
+#offset-cancelled dark current)
+
+#Parameters: DUT dark current, noise exceedance factor
+
+#Returns threshold reading
+def signalThreshold(current, caliFact):
+
+    thresh = current*caliFact
+
+    if noiseFact is not None and darkNoise:
+        thresh = max(thresh, current + noiseFact*darkNoise)
+
+    return thresh
+
+#Compares current signal to DUT dark current, and checks for exceedance by
+#pre-defined factor (which is a good metric to determine signal sufficiency)
+
+#Parameters: Current signal level, DUT dark count
+
+#Returns boolean that indicates if signal is of sufficient strength
+def check(current, caliFact):
+
+    #Single reading when no sequential test is configured (or dark current
+    #noise is unknown)
+    if checkErr is None or not darkNoise:
+
+        read = measure(samples=avgSamples)
+
+        if(read>=signalThreshold(current, caliFact)):
+            return True
+        else:
+            return False
+
+    #Sequential probability ratio test between mean signal one noise standard
+    #deviation below and above the threshold: each reading adds
+    #2*(read - thresh)/darkNoise to the log-likelihood ratio, and readings are
+    #taken until it leaves the bounds set by the error rate
+    thresh = signalThreshold(current, caliFact)
+    bound = math.log((1 - checkErr)/checkErr)
+    llr = total = 0
+    count = 0
+
+    while count < checkMax:
+
+        #First reading may come from the cache, further readings are fresh
+        #and taken avgSamples at a time (one bulk transfer with a buffered
+        #meter)
+        if count == 0 and avgSamples == 1:
+            reads = [measure()]
+        else:
+            reads = measureBlock(min(avgSamples, checkMax - count))
+
+        for read in reads:
+
+            count += 1
+            total += read
+            llr += 2*(read - thresh)/darkNoise
+
+            if llr >= bound:
+                return True
+
+            if llr <= -bound:
+                return False
+
+    #Decide on mean reading if no decision within reading limit
+    return total/checkMax >= thresh
+
+#_______________________________________________________________________________
+
+#Perform planar scan (spiral pattern along x and y) until sufficient signal is
+#found
+
+#Parameters: coarse step size, number of complete x & y translation sets, dark
+#current for DUT, noise exceedance factor for signal comparison, boolean
+#indicating whether each spiral leg is a single continuous move (fly scan),
+#boolean indicating whether to terminate the program if no signal is found,
+#number of coarse steps mapped on each side of the detection point for the
+#handoff to the estimated beam centre (mapHandoff(); 0 for no handoff)
+
+#Returns True if sufficient signal found and False otherwise
+
+def plnrScan(stepC, cycleStop, darkCur, sigFact, fly=False, required=True,
+             neighbourhood=0):
+
+    global planarMap, planarEstimate
+
+    setPhase("planar")
+
+    #Readings of the scan are mapped
+    planarMap = PhotoMap()
+    planarEstimate = None
+
+    #value for stage selection (index of stage in list)
+    ID = 0
+
+    #Compute number of incremental moves possible
+    moves = cycleStop*(cycleStop+2)
+
+    #Initial percentage of total scan area traversed
+    percent = 0
+
+    #Percentage increment with each step
+    percentInc = 1/moves
+
+    print("Initiating planar scan for adequate signal")
+
+    print("Scanning area traversed:" + str(percent) + "%")
+
+    #Checks if spiral legs are taken as continuous moves
+    if fly:
+
+        #Continuous moves are not queued on the engine
+        if engine is not None:
+            engine.sync()
+
+        #Times a single fresh reading (traced and mapped like any other) to
+        #set scan velocity (one coarse step per reading) [encoder counts/s]
+        tRead = clock()
+        measure(True)
+        flyVel = stepC*34.304/(clock() - tRead)
+
+    #Scan area in spiral pattern (for all complete cycles)
+    for cycle in range(1, cycleStop+1):
+
+        #Scan along x and y axes for each cycle
+        for count in range(1, 3):
+
+            if fly:
+                percent = flyTrnslt(ID, stepC, cycle, cycle%2, percent, percentInc, darkCur, sigFact, flyVel)
+            else:
+                percent = spiralTrnslt(ID, stepC, cycle, cycle%2, percent, percentInc, darkCur, sigFact)
+
+            #Checks if sufficient signal is found to begin multi-axis alignment
+            if percent is True:
+                return mapHandoff(stepC, neighbourhood, darkCur)
+
+            #Toggle stage/axis of movement
+            ID += 1
+
+    if fly:
+        percent = flyTrnslt(ID, stepC, cycleStop, not cycleStop%2, percent, percentInc, darkCur, sigFact, flyVel)
+    else:
+        percent = spiralTrnslt(ID, stepC, cycleStop, not cycleStop%2, percent, percentInc, darkCur, sigFact)
+
+    #Checks if sufficient signal  to begin multi-axis alignment was not found
+    #(during last half cycle)
+    if percent is not True:
+
+        #Checks if sufficient signal  to begin multi-axis alignment was not found
+        #(at endpoint of scan)
+        if not check(darkCur, sigFact):
+
+            #alert for user
+            print("Could not locate signal: Realignment required")
+
+            if required:
+                sys.exit()
+
+            return False
+
+    return mapHandoff(stepC, neighbourhood, darkCur)
+
+#_______________________________________________________________________________
+
+#Hands off from the planar scan map to alignment: the map is extended by
+#readings along x and y through the detection point (a Gaussian spot has the
+#same centre and width along any line parallel to an axis), and the stages move
+#to the beam centre estimated from the map (kept in planarEstimate, with the
+#spot radius as fitWidth of the x and y stages) if a reading there confirms it.
+#While the estimate lies outside the mapped readings (detection far out on the
+#beam tail), the lines are repeated through the strongest reading
+
+#Parameters: coarse step size, number of coarse steps read on each side of the
+#detection point along x and y (0 to stay at the detection point), dark
+#current for DUT, maximum number of repeats of the lines
+
+#Returns True (signal was found)
+
+def mapHandoff(stepC, neighbourhood, darkCur, rounds=3):
+
+    global planarEstimate
+
+    if neighbourhood <= 0:
+        return True
+
+    step = stepC*34.304
+
+    for count in range(rounds):
+
+        x0 = s[0].posCur
+        y0 = s[1].posCur
+
+        #Lines along x, then y, each read from one end to the other (within
+        #stage limits)
+        for ID in range(2):
+            for k in range(-neighbourhood, neighbourhood + 1):
+
+                if k and 0 < (x0, y0)[ID] + k*step < 857600:
+                    moveTo(ID, (x0, y0)[ID] + k*step)
+                    s[ID].posCur = (x0, y0)[ID] + k*step
+                    measure(True)
+
+            moveTo(ID, (x0, y0)[ID])
+            s[ID].posCur = (x0, y0)[ID]
+
+        est = planarMap.estimate(darkCur)
+
+        if est is not None and est["method"] == "fit":
+            break
+
+        #Lines repeated through the strongest reading
+        best, peak = planarMap.peak()
+        moveTo(0, best[0])
+        moveTo(1, best[1])
+        s[0].posCur, s[1].posCur = best
+
+    best, peak = planarMap.peak()
+
+    #Estimated centre must read at least close to the strongest mapped reading
+    #(otherwise alignment continues from that reading); a centre extrapolated
+    #beyond the stage limits is clamped to them
+    if est is not None:
+
+        est["centre"] = np.clip(est["centre"], 0, 857600)
+
+        moveTo(0, est["centre"][0])
+        moveTo(1, est["centre"][1])
+        s[0].posCur, s[1].posCur = est["centre"]
+
+        if measure(True) - darkCur < 0.9*(peak - darkCur):
+            est = None
+
+    if est is None:
+
+        moveTo(0, best[0])
+        moveTo(1, best[1])
+        s[0].posCur, s[1].posCur = best
+
+        print("Beam centre not estimated from map - continuing from strongest reading")
+
+        return True
+
+    planarEstimate = est
+
+    for ID in range(2):
+        s[ID].fitWidth = (est["radius"][ID]/34.304 if est["radius"] is not None
+                          else None)
+
+    print("Beam centre estimated from " + str(planarMap.count) + " mapped readings ("
+          + est["method"] + "): x " + format(est["centre"][0]/34.304, ".1f")
+          + " \u03BCm, y " + format(est["centre"][1]/34.304, ".1f") + " \u03BCm"
+          + ("" if est["radius"] is None else ", spot radius "
+             + "/".join(format(r/34.304, ".1f") for r in est["radius"]) + " \u03BCm"))
+
+    return True
+
+#Axes left to coarse optimization: only z when the planar scan handed off an
+#estimated beam centre, all axes otherwise
 #No parameters
+#Returns tuple of axis indices
+def coarseAxes():
+
+    return (2,) if planarEstimate is not None else (0, 1, 2)
+
+#_______________________________________________________________________________
+
+#Perform sets of x and y translations for planar scan
+
+#Parameters: Index of stage to be translated, coarse step size, boolean
+#indicating direction of movement along axis, current percent of scan area
+#covered, incremental percentage/step, dark current for DUT, noise exceedance
+#factor for signal comparison
+
+#Returns True if sufficient signal found, or the percentage of the scan area
+#covered otherwise
+
+def spiralTrnslt(ID, step, limit, pstvDir, percent, percentInc, current, sigFact):
+
+    #Checks if direction movement along current axis is positive
+    if not pstvDir:
+
+        #Sets mode to increment or decrement
+        step *= -1
+
+    #Checks if readings are pipelined on the engine
+    if engine is not None:
+        return pipeTrnslt(ID, step, limit, percent, percentInc, current, sigFact)
+
+    #Takes number of coarse steps based on cycle count
+    for stepNum in range(1, limit+1):
+
+        #Checks if sufficient signal is found to begin multi-axis alignment
+        if check(current, sigFact):
+            return True
+
+        #Take coarse step
+        moveBy(ID%2, step*34.304)
+
+        #Increment/decrement position for current stage based on coarse step
+        #and direction
+        s[ID%2].posCur += step*34.304
+
+        #Increment percent of area scanned
+        percent += percentInc
+
+        print("Scanning area traversed:" + str(percent) + "%")
+
+    #Percentage of scanning area covered
+    return percent
+
+#_______________________________________________________________________________
+
+#Perform x or y translation of planar scan on the engine, queueing each coarse
+#step right after the reading at the current position (evaluated while the
+#stage moves on)
+
+#Parameters: Index of stage to be translated, signed coarse step size, number of
+#coarse steps in leg, current percent of scan area covered, incremental
+#percentage/step, dark current for DUT, noise exceedance factor for signal
+#comparison
+
+#Returns True if sufficient signal found (stage moved back to position of that
+#reading), or the percentage of the scan area covered otherwise
+
+def pipeTrnslt(ID, step, limit, percent, percentInc, current, sigFact):
+
+    #List of position-reading pairs not yet evaluated
+    pending = []
+
+    for stepNum in range(1, limit+1):
+
+        #Queue reading at current position followed by coarse step
+        pending.append([s[ID%2].posCur, engine.readAsync()])
+        engine.moveBy(ID%2, step*34.304)
+        traceEvent(MOVEBY, ID%2, step*34.304, math.nan)
+
+        #Increment/decrement position for current stage based on coarse step
+        #and direction
+        s[ID%2].posCur += step*34.304
+
+        #Increment percent of area scanned
+        percent += percentInc
+
+        #Evaluates readings beyond pipeline depth (all readings at end of leg)
+        while len(pending) > engine.depth or (stepNum == limit and pending):
+
+            pos, reading = pending.pop(0)
+
+            #Reading recorded at its position along the leg
+            posRead = [stage.posCur for stage in s]
+            posRead[ID%2] = pos
+            traceEvent(READ, -1, math.nan, reading.result(), posRead)
+            mapReading(reading.result(), posRead[0], posRead[1])
+
+            #Checks if sufficient signal is found to begin multi-axis alignment
+            if reading.result() >= signalThreshold(current, sigFact):
+
+                #Move back to position of reading
+                engine.moveTo(ID%2, pos)
+                traceEvent(MOVETO, ID%2, pos, math.nan)
+                engine.sync()
+
+                #Updates current position
+                s[ID%2].posCur = pos
+
+                return True
+
+        print("Scanning area traversed:" + str(percent) + "%")
+
+    #Percentage of scanning area covered
+    return percent
+
+#_______________________________________________________________________________
+
+#Perform x or y translation of planar scan as a single continuous move, reading
+#photocurrent while the stage is moving
+
+#Parameters: Index of stage to be translated, coarse step size, number of coarse
+#steps in leg, boolean indicating direction of movement along axis, current
+#percent of scan area covered, incremental percentage/step, dark current for
+#DUT, noise exceedance factor for signal comparison, scan velocity [encoder
+#counts/s]
+
+#Returns True if sufficient signal found (stage moved to position of strongest
+#reading), or the percentage of the scan area covered otherwise
+
+def flyTrnslt(ID, step, limit, pstvDir, percent, percentInc, current, sigFact, vel):
+
+    #Checks if direction movement along current axis is positive
+    if not pstvDir:
+
+        #Sets mode to increment or decrement
+        step *= -1
+
+    #Distance of leg [encoder counts]
+    dist = limit*step*34.304
+
+    #Stores velocity parameters of stage (restored after leg)
+    params = s[ID%2].get_velocity_parameters()
+
+    #Scan velocity cannot exceed maximum velocity of stage
+    vel = min(vel, params.max_velocity)
+    s[ID%2].setup_velocity(max_velocity=vel)
+
+    #Time by which constant velocity motion lags behind the move command
+    #(acceleration ramp)
+    tLag = vel/(2*params.acceleration)
+
+    #Lists to store timestamps and readings of samples taken during leg
+    times = []
+    vals = []
+
+    #Boolean that states whether sufficient signal is found
+    found = False
+
+    #Boolean that states whether stage was moving before the last reading
+    moving = True
+
+    #Start leg (does not wait for move to complete)
+    tStart = clock()
+    s[ID%2]._move_by(dist)
+    traceEvent(MOVEBY, ID%2, dist, math.nan)
+
+    #Read photocurrent until the leg is complete (final reading taken at rest)
+    while moving and not found:
+
+        moving = s[ID%2].is_moving()
+
+        #Reading is timestamped at middle of read
+        tRead = clock()
+        val = read_dmm()
+        times.append((tRead + clock())/2)
+        vals.append(val)
+
+        #Checks if sufficient signal is found to begin multi-axis alignment
+        if val >= signalThreshold(current, sigFact):
+            found = True
+
+    if found:
+        s[ID%2].stop()
+
+    s[ID%2].wait_move()
+
+    #Restores velocity parameters of stage
+    s[ID%2].setup_velocity(params.min_velocity, params.acceleration, params.max_velocity)
+
+    #Readings recorded and mapped once the leg is complete, at their
+    #interpolated positions (constant velocity along leg)
+    posRead = [stage.posCur for stage in s]
+
+    for tRead, val in zip(times, vals):
+
+        travel = min(max(vel*(tRead - tStart - tLag), 0), abs(dist))
+        posRead[ID%2] = s[ID%2].posCur + math.copysign(travel, dist)
+
+        if log is not None:
+            log.record(tRead, READ, -1, math.nan, posRead, val, phase)
+
+        mapReading(val, posRead[0], posRead[1])
+
+    if found:
+
+        #Interpolates position of strongest reading (constant velocity along leg)
+        best = vals.index(max(vals))
+        travel = min(max(vel*(times[best] - tStart - tLag), 0), abs(dist))
+        pos = s[ID%2].posCur + math.copysign(travel, dist)
+
+        #Short move back to position of strongest reading
+        moveTo(ID%2, pos)
+
+        #Updates current position
+        s[ID%2].posCur = pos
+
+        return True
+
+    #Increment/decrement position for current stage based on leg distance
+    s[ID%2].posCur += dist
+
+    #Increment percent of area scanned
+    percent += percentInc*limit
+
+    print("Scanning area traversed:" + str(percent) + "%")
+
+    #Percentage of scanning area covered
+    return percent
 
-#Returns dark current
-def calibrate():
+#_______________________________________________________________________________
 
-    #Dark current measured with shutter closed (no light on DUT)
-    input("Close shutter/block laser - press enter once complete")
+#Perform hierarchical planar search: a sparse grid with spacing set by the
+#beam footprint (spot and active area diameters, so the beam overlaps the
+#active area from every point of a grid cell) is read in rings outward from the
+#current position; after each ring the points with the most signal above dark
+#are refined with grids of half the spacing around them, down to the coarse
+#step size. The search stops at the first reading that passes check()
 
-    #Will be changed to source meter (placeholder for now)
-    readVal = read_dmm()
+#Parameters: 1/e^2 spot diameter [micrometres], active area diameter of DUT
+#[micrometres], coarse step size (finest spacing of refinement), dimensions of
+#scan area [millimetres], dark current for DUT, noise exceedance factor for
+#signal comparison, number of points refined after each ring, boolean
+#indicating whether to terminate the program if no signal is found, number of
+#coarse steps mapped on each side of the detection point for the handoff to
+#the estimated beam centre (0 for no handoff)
 
-    #Shutter needs to be reopened for position that results in maximum
-    #DUT photocurrent to be located
-    input("Open shutter/unblock laser - press enter once complete")
+#Returns True if sufficient signal found (stages at that position) and False
+#otherwise
 
-    #DUT dark current
-    return readVal
+def hierScan(spot, area, stepC, dim, darkCur, sigFact, keep=3, required=True,
+             neighbourhood=0):
 
-#_______________________________________________________________________________
+    global planarMap, planarEstimate
 
-#Compares current signal to DUT dark current, and checks for exceedance by
-#pre-defined factor (which is a good metric to determine signal sufficiency)
+    setPhase("planar")
 
-#Parameters: Current signal level, DUT dark count
+    #Readings of the scan are mapped
+    planarMap = PhotoMap()
+    planarEstimate = None
 
-#Returns boolean that indicates if signal is of sufficient strength
-def check(current, caliFact):
-    read = read_dmm()
+    #Grid spacing [encoder counts] and number of rings covering the scan area
+    spacing = (spot + area)/math.sqrt(2)*34.304
+    rings = math.ceil(dim*1000*34.304/(2*spacing))
+
+    #Spiral scan size with the same coarse step (for comparison)
+    cycleStop = 2*math.floor(dim*1000/(2*stepC))
+
+    #Worst case number of points (full sparse grid and refinement of the kept
+    #points after each ring down to the coarse step)
+    levels = max(0, math.ceil(math.log2(spacing/(stepC*34.304))))
+    expected = (2*rings + 1)**2 + rings*keep*8*levels
+
+    print("Initiating hierarchical planar scan for adequate signal")
+    print("Expected points: at most " + str(expected) + " (spiral scan: "
+          + str(cycleStop*(cycleStop+2)) + ")")
+
+    #Reading above which a point shows signal worth refining (half of the
+    #detection margin above dark current)
+    weak = darkCur*(1 + (sigFact - 1)/2)
+
+    x0 = s[0].posCur
+    y0 = s[1].posCur
+
+    #Readings by position, sparse grid points read, and points already refined
+    readings = {}
+    grid = []
+    refined = set()
+
+    #Reads signal at a grid point (within stage limits)
+    #Returns True if sufficient signal found there
+    def visit(x, y):
+
+        key = (round(x), round(y))
+
+        if key in readings or not (0 < x < 857600 and 0 < y < 857600):
+            return False
+
+        moveAll([x, y, s[2].posCur])
+        s[0].posCur = x
+        s[1].posCur = y
+
+        readings[key] = measure()
+
+        #Signal found if reading passes (confirmed by sequential test when
+        #configured)
+        return (readings[key] >= signalThreshold(darkCur, sigFact)
+                and check(darkCur, sigFact))
+
+    #Refines around a point with grids of half the spacing, following the
+    #point with most signal, until the coarse step is reached
+    #Returns True if sufficient signal found
+    def refine(x, y, step):
+
+        while step/2 >= stepC*34.304*0.999:
+
+            step /= 2
+            pts = [(x + i*step, y + j*step) for i in (-1, 0, 1) for j in (-1, 0, 1)
+                   if i or j]
+
+            for px, py in pts:
+                if visit(px, py):
+                    return True
+
+            #Continue around the point with most signal
+            x, y = max(pts + [(x, y)],
+                       key=lambda p: readings.get((round(p[0]), round(p[1])), -math.inf))
 
-    if(read/current>=caliFact):
-        return True
-    else:
         return False
 
-    #_______________________________________________________________________________
-
-    def plnrScan(stepC, cycleStop, darkCur, sigFact):
-        
-        #value for stage selection (index of stage in list)
-        ID = 0
-        
-        #Compute number of incremental moves possible
-        moves = cycleStop*(cycleStop+2)
-        
-        #Initial percentage of total scan area traversed
-        percent = 0
-     
-        #Percentage increment with each step
-        percentInc = 1/moves
-        
-        print("Initiating planar scan for adequate signal")
+    found = visit(x0, y0)
+    grid.append((round(x0), round(y0)))
+
+    for ring in range(1, rings + 1):
+
+        if found:
+            break
+
+        #Points of ring (square of Chebyshev distance ring around start),
+        #traversed in order of angle
+        pts = [(i, j) for i in range(-ring, ring + 1) for j in range(-ring, ring + 1)
+               if max(abs(i), abs(j)) == ring]
+        pts.sort(key=lambda p: math.atan2(p[1], p[0]))
+
+        for i, j in pts:
+
+            x = x0 + i*spacing
+            y = y0 + j*spacing
+            grid.append((round(x), round(y)))
+
+            if visit(x, y):
+                found = True
+                break
+
+        if found:
+            break
+
+        #Refines around the sparse points with most signal above dark
+        best = sorted((key for key in grid if key in readings and key not in refined
+                       and readings[key] > weak),
+                      key=lambda key: readings[key], reverse=True)[:keep]
+
+        for key in best:
+
+            refined.add(key)
+
+            if refine(key[0], key[1], spacing):
+                found = True
+                break
+
+        print("Scanning rings traversed: " + str(ring) + " of " + str(rings))
+
+    print("Hierarchical scan read " + str(len(readings)) + " points")
+
+    if not found:
+
+        #alert for user
+        print("Could not locate signal: Realignment required")
+
+        if required:
+            sys.exit()
+
+        return False
+
+    return mapHandoff(stepC, neighbourhood, darkCur)
 
-        print("Scanning area traversed:" + str(percent) + "%")
-    
-        #Scan area in spiral pattern (for all complete cycles)
-        for cycle in range(1, cycleStop+1):
-            
-             #Scan along x and y axes for each cycle
-             for count in range(1, 3):
-                
-                percent = spiralTrnslt(ID, stepC, cycle, cycle%2, percent, percentInc, darkCur, sigFact) 
-                
-                #Checks if sufficient signal is found to begin multi-axis alignment
-                if percent is True:
-                    return
-                
-                #Toggle stage/axis of movement
-                ID += 1
-                
-            percent = spiralTrnslt(ID, stepC, cycleStop, not cycleStop%2, percent, percentInc, darkCur, sigFact)
-            
-            #Checks if sufficient signal  to begin multi-axis alignment was not found
-            #(during last half cycle)
-            if percent is not True:
-                
-                #Checks if sufficient signal  to begin multi-axis alignment was not found
-                #(at endpoint of scan)
-                if not check(darkCur, sigFact):
-
-                    #alert for user
-                    print("Could not locate signal: Realignment required")
-                    sys.exit()
-
-                    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
 #_______________________________________________________________________________
 
-#Perform sets of x and y translations for planar scan
+#Warm-starts alignment from a stored recipe (recipes.py): moves to the stored
+#aligned position and searches a small spiral around it (extent of two stored
+#beam widths, or a given number of cycles if no width is stored)
 
-#Parameters: Index of stage to be translated, coarse step size, boolean
-#indicating direction of movement along axis, current percent of scan area
-#covered, incremental percentage/step, dark current for DUT, noise exceedance
-#factor for signal comparison
+#Parameters: recipe dictionary, coarse step size, noise exceedance factor for
+#signal comparison, number of complete x & y translation sets without stored
+#beam width
 
-#Returns True if sufficient signal found, or the percentage of the scan area
-#covered otherwise
+#Returns True if sufficient signal found and False otherwise (full planar scan
+#required)
 
-def spiralTrnslt(ID, step, limit, pstvDir, percent, percentInc, current, sigFact):
+def warmStart(recipe, stepC, sigFact, cycles=4):
 
-    #Checks if direction movement along current axis is positive
-    if not pstvDir:
+    global darkNoise, planarEstimate
 
-        #Sets mode to increment or decrement
-        step *= -1
+    #Dark current noise of DUT reused for the sequential signal test
+    darkNoise = recipe.get("darkNoise")
 
-    #Takes number of coarse steps based on cycle count
-    for stepNum in range(1, limit+1):
+    #No planar map behind a warm start (all axes are coarse optimized)
+    planarEstimate = None
 
-        #Checks if sufficient signal is found to begin multi-axis alignment
-        if check(current, sigFact):
-            return True
+    print("Warm start from stored position " + str(recipe["pos"]))
 
-        #Take coarse step
-        s[ID%2]._move_by(step*34.304)
+    #Stages move to stored position (concurrently when the engine is started)
+    for ID in range(3):
+        moveTo(ID, recipe["pos"][ID])
+        s[ID].posCur = recipe["pos"][ID]
 
-        #Increment/decrement position for current stage based on coarse step
-        #and direction
-        s[ID%2].posCur += step*34.304
+    widths = [w for w in recipe.get("width", []) if w]
 
-        #Increment percent of area scanned
-        percent += percentInc
+    if widths:
+        cycles = 2*math.ceil(2*max(widths)/stepC)
 
-        print("Scanning area traversed:" + str(percent) + "%")
+    return plnrScan(stepC, cycles, recipe["darkCur"], sigFact, required=False)
 
-    #Percentage of scanning area covered
-    return percent
+#Builds recipe of the current alignment for the recipe store
+
+#Parameters: dark current for DUT
+
+#Returns recipe dictionary (aligned position (x, y, z) [encoder counts], dark
+#current and its noise, fitted beam widths (x, y, z) [micrometres, None where
+#not fitted])
+
+def makeRecipe(darkCur):
+
+    return {"pos": [float(s[ID].posCur) for ID in range(3)],
+            "darkCur": float(darkCur),
+            "darkNoise": float(darkNoise) if darkNoise else None,
+            "width": [getattr(s[ID], "fitWidth", None) for ID in range(3)]}
 
 #_______________________________________________________________________________
 
@@ -155,6 +1324,9 @@ def spiralTrnslt(ID, step, limit, pstvDir, percent, percentInc, current, sigFact
 #count limit
 
 #Returns true if coarse alignment process was uninterupted and false otherwise
+#(centre between the threshold crossings interpolated from the readings; its
+#standard error [micrometres] and number of readings stored as centreErr and
+#fitReads of stage)
 
 def optimizeC(ID, stepC, threshFact, limit):
 
@@ -169,10 +1341,14 @@ def optimizeC(ID, stepC, threshFact, limit):
     updateMax = forward = edgeCorrect = True
 
     #Initialize lists to store lists of position-signal reading pairs
-    l1 = l2 = []
+    l1 = []
+    l2 = []
 
-    #List that stores a single position-signal reading pair
-    ltemp = [0,0]
+    #History of every position and reading of the scan (first n entries),
+    #used to interpolate the threshold crossings
+    hPos = np.empty(2*limit + 2)
+    hVal = np.empty(2*limit + 2)
+    n = 0
 
     #Boolean that states whether both boundaries are found
     edgeFind = False
@@ -184,19 +1360,22 @@ def optimizeC(ID, stepC, threshFact, limit):
     steps = 0
 
     #Scan along axis until both edge boundaries have been located
-    while not edgeFind or steps < limit:
+    while not edgeFind and steps < limit:
 
         #Checks if previous maximum can be updated
         if updateMax:
 
             #Reads and stores value of signal intensity
-            val = read_dmm()
+            val = measure(samples=avgSamples)
+
+            hPos[n] = s[ID%3].posCur
+            hVal[n] = val
+            n += 1
 
         if val > max or not updateMax:
 
-            #Stores current position and signal reading in temporary list
-            ltemp[0] = s[ID%3].posCur
-            ltemp[1] = val
+            #Stores current position and signal reading in new list
+            ltemp = [s[ID%3].posCur, val]
 
             #Checks if the current scan direction is forwards
             if forward:
@@ -215,137 +1394,405 @@ def optimizeC(ID, stepC, threshFact, limit):
                     #Terminate function
                     return False
 
-                #Makes relative move of coarse step size in positive direction
-                s[ID%3]._move_by(stepC*34.304)
+                #Makes relative move of coarse step size in positive direction
+                moveBy(ID%3, stepC*34.304)
+
+
+            #Current scan direction is backwards
+            else:
+
+                #Checks if previous maximum can be updated
+                if updateMax:
+
+                    #First edge found was incorrect (determined)
+                    edgeCorrect = False
+
+                #Stores list of current position and signal reading into
+                #master list containing positions in the negative direction
+                #(relative to starting position of optimization)
+                l2.append(ltemp)
+
+                #updates current position
+                s[ID%3].posCur -= stepC*34.304
+
+                #Checks if move would cause stage to exceed its negative limit
+                if s[ID%3].posCur <= 0:
+
+                    #Terminate function
+                    return False
+
+                #Makes relative move of coarse step size in negative direction
+                moveBy(ID%3, -stepC*34.304)
+
+            #Checks if previous maximum can be updated
+            if updateMax:
+
+                #Updates maximum value
+                max = val
+
+            #Previous maximum cannot be updated
+            else:
+
+                updateMax = True
+
+        #Checks if new signal reading is below or equal to a percentage of the
+        #maximum reading found so far
+        elif val <= max*threshFact:
+
+            #Checks if the current scan direction is forwards
+            if forward:
+
+                #Sets positive boundary to current position
+                posEdge1 = s[ID%3].posCur
+
+                #updates current position
+                s[ID%3].posCur = s[ID%3].pos1-stepC*34.304
+
+                #Checks if move would cause stage to exceed its negative limit
+                if s[ID%3].posCur <= 0:
+
+                    #Terminate function
+                    return False
+
+                #Moves to a single coarse step in the negative direction from
+                #the optimization starting position
+                moveTo(ID%3, s[ID%3].posCur)
+
+                #Sets the scanning direction to backwards
+                forward = False
+
+                #Resets step count for current direction
+                steps = 0
+
+            else:
+
+                #Sets negative boundary to current position
+                posEdge2 = s[ID%3].posCur
+
+                #Both boundaries found
+                edgeFind = True
+
+        else:
+
+            #Cannot update maximum value
+            updateMax = False
+
+        #Increment step count
+        steps+=1
+
+    #Checks if loop termination resulted from exceeding iteration limit
+    if not edgeFind:
+
+        #Terminate function
+        return False
+
+    #New maximum was found after locating first boundary (first boundary
+    #must be re-determined)
+    if not edgeCorrect:
+
+        #Searches through first list of location-reading pairs to find true
+        #positve boundary
+        for index in range(len(l1)):
+
+            if l1[index][1] <= max*threshFact:
+
+                posEdge1 = l1[index][0]
+
+                #True edge was found
+                edgeFindTrue = True
+
+                break
+
+        if not edgeFindTrue:
+
+            #Searches through second list of location-reading pairs to find true
+            #positve boundary
+            for index in range(0, len(l2)):
+
+                if l2[index][1] <= max*threshFact:
+
+                    posEdge1 = l2[index][0]
+
+                    break
+
+    #Sets coarse optimized position along axis to average of boundary positions
+    #(must be centered)
+    s[ID%3].pos2 = (posEdge1 + posEdge2)/2
+    s[ID%3].centreErr = None
+    s[ID%3].fitReads = n
+
+    #Boundaries refined to the threshold crossings between neighbouring
+    #readings (sub-step centre)
+    edges = interpEdges(hPos[:n], hVal[:n], threshFact)
+
+    if edges is not None:
+
+        s[ID%3].pos2 = (edges[0] + edges[1])/2
+
+        #Standard error of centre from errors of both crossings
+        s[ID%3].centreErr = math.hypot(edges[2], edges[3])/2/34.304
+
+        print(str(s[ID%3].name) + " centre interpolated to +/- "
+              + format(s[ID%3].centreErr, ".2f") + " \u03BCm from " + str(n)
+              + " readings")
+
+    #Moves to coarse optimized position
+    moveTo(ID%3, s[ID%3].pos2)
+
+    #Updates current position
+    s[ID%3].posCur = s[ID%3].pos2
+    return True
+
+#_______________________________________________________________________________
+
+#Threshold crossings of the readings of a single-axis scan nearest the maximum
+#reading on either side, linearly interpolated between neighbouring readings.
+#Errors of the crossings combine the error bound of linear interpolation (from
+#the second difference at the inner reading) with the reading noise (from
+#third differences, which are free of the profile curvature), over the slope
+#between the readings
+
+#Parameters: positions and readings of scan (any order, on a regular grid),
+#threshold factor (fraction of maximum reading)
+
+#Returns negative and positive crossing positions and their standard errors
+#[encoder counts], or None if the maximum is not enclosed by readings at or
+#below the threshold on both sides
+
+def interpEdges(pos, vals, threshFact):
+
+    order = np.argsort(pos)
+    pos = pos[order]
+    vals = vals[order]
+
+    peak = int(np.argmax(vals))
+    level = vals[peak]*threshFact
+
+    #Readings at or below threshold on either side of the maximum
+    low = np.flatnonzero(vals[:peak] <= level)
+    high = np.flatnonzero(vals[peak+1:] <= level) + peak + 1
+
+    if len(low) == 0 or len(high) == 0:
+        return None
+
+    #Neighbouring pairs straddling the threshold, nearest the maximum
+    pairs = np.array([[low[-1], low[-1] + 1], [high[0] - 1, high[0]]])
+    p0, p1 = pos[pairs[:, 0]], pos[pairs[:, 1]]
+    v0, v1 = vals[pairs[:, 0]], vals[pairs[:, 1]]
+
+    edges = p0 + (level - v0)*(p1 - p0)/(v1 - v0)
+
+    #Interpolation error bound (h^2*|f''|/8) at the inner reading of each pair
+    inner = np.array([pairs[0, 1], pairs[1, 0]])
+    curve = np.abs(vals[inner - 1] - 2*vals[inner] + vals[inner + 1])/8
+
+    #Reading noise from third differences (variance 20 times reading variance)
+    noise = (np.sqrt(np.mean(np.diff(vals, 3)**2)/20) if len(vals) > 3
+             else 0.0)
+    errs = np.hypot(curve, noise)*np.abs(p1 - p0)/np.abs(v1 - v0)
+
+    return edges[0], edges[1], errs[0], errs[1]
+
+#_______________________________________________________________________________
+
+#Perform single-axis coarse optimization/alignment with DUT by fitting a beam
+#profile model to a few readings around the current position (falls back to
+#optimizeC if the fit fails)
+
+#Parameters: Index of stage to be translated, coarse step size, threshold
+#factor to define appropriate decline in photocurrent during alignment, step
+#count limit, profile model ("gauss" or "lorentz"), number of initial samples
+#on each side of the current position, minimum fit quality (R^2)
+
+#Returns true if coarse alignment process was uninterupted and false otherwise
+#(fit quality, number of readings and fitted width [micrometres] stored as
+#fitQual, fitReads and fitWidth of stage)
+
+def optimizeFit(ID, stepC, threshFact, limit, model="gauss", half=2, minQual=0.9):
+
+    #Sample spacing [encoder counts]
+    step = stepC*34.304
+
+    #Position at start of optimization
+    start = s[ID%3].posCur
+
+    #Lists to store sampled positions (ascending) and signal readings
+    pos = []
+    vals = []
+
+    #Reads signal at a position and stores the position-reading pair
+    #Returns false if position exceeds stage limits
+    def sample(p, first):
+
+        if p <= 0 or p >= 857600:
+            return False
+
+        moveTo(ID%3, p)
+        s[ID%3].posCur = p
+
+        if first:
+            pos.insert(0, p)
+            vals.insert(0, measure())
+        else:
+            pos.append(p)
+            vals.append(measure())
+
+        return True
+
+    #Samples around starting position, traversed in positive direction
+    for k in range(-half, half+1):
+
+        if not sample(start + k*step, False):
+            return False
+
+    steps = 0
+
+    #Extends samples in positive direction until the reading falls to the
+    #threshold of the maximum
+    while vals[-1] > max(vals)*threshFact and steps < limit:
+
+        if not sample(pos[-1] + step, False):
+            return False
 
+        steps += 1
 
-            #Current scan direction is backwards
-            else:
+    #Extends samples in negative direction until the reading falls to the
+    #threshold of the maximum
+    while vals[0] > max(vals)*threshFact and steps < limit:
 
-                #Checks if previous maximum can be updated
-                if updateMax:
+        if not sample(pos[0] - step, True):
+            return False
 
-                    #First edge found was incorrect (determined)
-                    edgeCorrect = False
+        steps += 1
 
-                #Stores list of current position and signal reading into
-                #master list containing positions in the negative direction
-                #(relative to starting position of optimization)
-                l2.append(ltemp)
+    #Fit is only attempted once the peak is enclosed on both sides
+    fit = None
 
-                #updates current position
-                s[ID%3].posCur -= stepC*34.304
+    if vals[0] <= max(vals)*threshFact and vals[-1] <= max(vals)*threshFact:
+        fit = fitting.fitProfile(pos, vals, model)
 
-                #Checks if move would cause stage to exceed its negative limit
-                if s[ID%3].posCur <= 0:
+    s[ID%3].fitReads = len(vals)
+    s[ID%3].fitQual = fit["r2"] if fit is not None else None
+    s[ID%3].fitWidth = fit["width"]/34.304 if fit is not None else None
 
-                    #Terminate function
-                    return False
+    #Checks if fitted centre can be used (within sampled range, good fit)
+    if fit is not None and fit["r2"] >= minQual and pos[0] < fit["centre"] < pos[-1]:
 
-                #Makes relative move of coarse step size in negative direction
-                s[ID%3]._move_by(-stepC*34.304)
+        #Sets coarse optimized position along axis to fitted centre
+        s[ID%3].pos2 = fit["centre"]
 
-            #Checks if previous maximum can be updated
-            if updateMax:
+        #Moves to coarse optimized position
+        moveTo(ID%3, s[ID%3].pos2)
 
-                #Updates maximum value
-                max = val
+        #Updates current position
+        s[ID%3].posCur = s[ID%3].pos2
 
-            #Previous maximum cannot be updated
-            else:
+        print("Fitted " + str(s[ID%3].name) + " profile: R^2 = "
+              + format(fit["r2"], ".4f") + ", " + str(len(vals)) + " readings")
 
-                updateMax = True
+        return True
 
-        #Checks if new signal reading is below or equal to a percentage of the
-        #maximum reading found so far
-        elif val <= max*threshFact:
+    print("Profile fit failed - falling back to edge search")
 
-            #Checks if the current scan direction is forwards
-            if forward:
+    #Return to starting position for edge search
+    moveTo(ID%3, start)
+    s[ID%3].posCur = start
 
-                #Sets positive boundary to current position
-                posEdge1 = s[ID%3].posCur
+    return optimizeC(ID, stepC, threshFact, limit)
 
-                #updates current position
-                s[ID%3].posCur = s[ID%3].pos1-stepC*34.304
+#_______________________________________________________________________________
 
-                #Checks if move would cause stage to exceed its negative limit
-                if s[ID%3].posCur <= 0:
+#Perform coarse optimization of focus (z) by fitting the beam waist model to a
+#few readings spread along the optical axis, and moving directly to the fitted
+#focus (falls back to optimizeC if the fit fails). Photocurrent against defocus
+#is broad, so the samples are spaced wider than the coarse step, instead of
+#walking coarse steps out to the threshold edges
 
-                    #Terminate function
-                    return False
+#Parameters: coarse step size, threshold factor to define appropriate decline
+#in photocurrent during alignment, step count limit, sample spacing [coarse
+#steps], number of initial samples on each side of the current position,
+#minimum fit quality (R^2)
 
-                #Moves to a single coarse step in the negative direction from
-                #the optimization starting position
-                s[ID%3]._move_to(s[ID%3].posCur)
+#Returns true if coarse alignment process was uninterupted and false otherwise
+#(fit quality, number of readings, fitted Rayleigh range [micrometres] and
+#standard error of the fitted focus [micrometres] stored as fitQual, fitReads,
+#fitWidth and fitErr of z stage)
 
-                #Sets the scanning direction to backwards
-                forward = False
+def optimizeZ(stepC, threshFact, limit, zFact=6, half=3, minQual=0.9):
 
-                #Resets step count for current direction
-                steps = 0
+    #Sample spacing [encoder counts]
+    step = zFact*stepC*34.304
 
-            else:
+    #Position at start of optimization
+    start = s[2].posCur
 
-                #Sets negative boundary to current position
-                posEdge2 = s[ID%3].posCur
+    #Sampled positions, traversed in positive direction (array of readings
+    #filled as samples are taken)
+    pos = start + np.arange(-half, half+1)*step
 
-                #Both boundaries found
-                edgeFind = True
+    if pos[0] <= 0 or pos[-1] >= 857600:
+        return False
 
-        else:
+    vals = np.empty(len(pos))
 
-            #Cannot update maximum value
-            updateMax = False
+    for k, p in enumerate(pos):
+        moveTo(2, p)
+        s[2].posCur = p
+        vals[k] = measure()
 
-        #Increment step count
-        step+=1
+    steps = 0
 
-    #Checks if loop termination resulted from exceeding iteration limit
-    if not edgeFind:
+    #Samples extended on the side of the largest reading until the peak is
+    #enclosed by readings at the threshold of the maximum on both sides
+    while steps < limit and max(vals[0], vals[-1]) > vals.max()*threshFact:
 
-        #Terminate function
-        return False
+        up = vals[-1] >= vals[0]
+        p = pos[-1] + step if up else pos[0] - step
 
-    #New maximum was found after locating first boundary (first boundary
-    #must be re-determined)
-    if not edgeCorrect:
+        if p <= 0 or p >= 857600:
+            break
 
-        #Searches through first list of location-reading pairs to find true
-        #positve boundary
-        for index in range(len(l1)):
+        moveTo(2, p)
+        s[2].posCur = p
 
-            if l1[index][1] <= max*threshFact:
+        pos = np.append(pos, p) if up else np.insert(pos, 0, p)
+        vals = np.append(vals, measure()) if up else np.insert(vals, 0, measure())
 
-                posEdge1 = l1[index][0]
+        steps += 1
 
-                #True edge was found
-                edgeFindTrue = False
+    fit = fitting.fitFocus(pos, vals)
 
-                break
+    s[2].fitReads = len(vals)
+    s[2].fitQual = fit["r2"] if fit is not None else None
+    s[2].fitWidth = fit["rayleigh"]/34.304 if fit is not None else None
+    s[2].fitErr = fit["focusErr"]/34.304 if fit is not None else None
 
-        if not edgeFindTrue:
+    #Checks if fitted focus can be used (within sampled range, good fit)
+    if fit is not None and fit["r2"] >= minQual and pos[0] < fit["focus"] < pos[-1]:
 
-            #Searches through second list of location-reading pairs to find true
-            #positve boundary
-            for index in range(0, len(l2)):
+        #Sets coarse optimized position along axis to fitted focus
+        s[2].pos2 = fit["focus"]
 
-                if l2[index][1] <= max*threshFact:
+        #Moves to coarse optimized position
+        moveTo(2, s[2].pos2)
 
-                    posEdge1 = l2[index][0]
+        #Updates current position
+        s[2].posCur = s[2].pos2
 
-                    break
+        print("Fitted focus: R^2 = " + format(fit["r2"], ".4f") + ", focus +/- "
+              + format(fit["focusErr"]/34.304, ".1f") + " \u03BCm, Rayleigh range "
+              + format(fit["rayleigh"]/34.304, ".0f") + " \u03BCm, "
+              + str(len(vals)) + " readings")
 
-    #Sets coarse optimized position along axis to average of boundary positions
-    #(must be centered)
-    s[ID%3].pos2 = (s[ID%3].posEdge1 + s[ID%3].posEdge2)/2
+        return True
 
-    #Moves to coarse optimized position
-    s[ID%3]._move_to(s[ID%3].pos2)
+    print("Focus fit failed - falling back to edge search")
 
-    #Updates current position
-    s[ID%3].posCur = s[ID%3].pos2
-    return True
+    #Return to starting position for edge search
+    moveTo(2, start)
+    s[2].posCur = start
+
+    return optimizeC(2, stepC, threshFact, limit)
 
 #_______________________________________________________________________________
 
@@ -371,10 +1818,10 @@ def optimizeF(ID, stepC, threshFact, minRes):
     print("Optimizing " + str(s[ID].name))
 
     #Stores signal intensity reading at beginning position of fine scan
-    max = read_dmm()
+    max = measure(samples=avgSamples)
 
     #Moves to single coarse step from beginning position in positive direction
-    s[ID]._move_by(stepC*34.304)
+    moveBy(ID, stepC*34.304)
 
     #Update position
     s[ID].posCur += stepC*34.304
@@ -397,14 +1844,14 @@ def optimizeF(ID, stepC, threshFact, minRes):
                 stepTemp = minRes
 
             #Reads and stores signal from sourcemeter
-            val = read_dmm()
+            val = measure(samples=avgSamples)
 
             #Checks if signal level is less than or equal to a percentage of
             #the signal level at the starting position of the fine optimization
-            if val <= max*threshdrop:
+            if val <= max*threshFact:
 
                 #Take step according to new step size
-                s[ID]._move_by(num*stepTemp*34.304)
+                moveBy(ID, num*stepTemp*34.304)
 
                 #Increment or decrement current postition based on current
                 #step size and stage direction
@@ -414,7 +1861,7 @@ def optimizeF(ID, stepC, threshFact, minRes):
             else:
 
                 #Take step according to new step size
-                s[ID]._move_by(-1*num*stepTemp*34.304)
+                moveBy(ID, -1*num*stepTemp*34.304)
 
                 #Increment or decrement current postition based on current
                 #step size and stage direction
@@ -439,22 +1886,488 @@ def optimizeF(ID, stepC, threshFact, minRes):
 
             #Moves to single coarse step from beginning position in negative
             #direction
-            s[ID]._move_to(s[ID].pos1-stepC*34.304)
+            moveTo(ID, s[ID].pos1-stepC*34.304)
+
+            #Update position
+            s[ID].posCur = s[ID].pos1-stepC*34.304
 
             #Reset temporary step size to coarse step size
-            stepTemp = step
+            stepTemp = stepC
 
             #Change incrementation/decrementation mode
             num = 1
 
     #Sets fine optimized position along axis to average of boundary positions
     #(must be centered)
-    s[ID].pos2 = (s[ID].posEdge1 + s[ID].posEdge2)/2
+    s[ID].pos2 = (posEdge1 + posEdge2)/2
+
+    #Moves to fine optimized position
+    moveTo(ID, s[ID].pos2)
+
+    #Updates the current position
+    s[ID].posCur = s[ID].pos2
+
+#_______________________________________________________________________________
+
+#Perform single-axis fine optimization/alignment with DUT by maximizing the
+#photocurrent with Brent's method (golden-section search with parabolic
+#interpolation) within a coarse step of the current position, and moving to
+#the peak of a fit to all readings of the search
+
+#Parameters: Index of stage to be translated, coarse step size, minimum
+#actuator resolution (positional tolerance of search)
+#No return (number of readings taken stored as fineEvals of stage)
+
+def optimizeBrent(ID, stepC, minRes):
+
+    print("Optimizing " + str(s[ID].name))
+
+    #Golden-section ratio
+    golden = (3 - math.sqrt(5))/2
+
+    #Positional tolerance [encoder counts]
+    tol = minRes*34.304
+
+    #Readings already taken, by position rounded to encoder counts (revisited
+    #positions are not read again)
+    readings = {}
+
+    #Bracket of search and its starting point (coarse optimized position)
+    start = x = w = v = s[ID].posCur
+    a = lo = start - stepC*34.304
+    b = hi = start + stepC*34.304
+
+    #Negated photocurrent at a position (searched for a minimum)
+    def evaluate(pos):
+
+        key = round(pos)
+
+        if key not in readings:
+
+            moveTo(ID, pos)
+            s[ID].posCur = pos
+            readings[key] = -measure(samples=avgSamples)
+
+        return readings[key]
+
+    fx = fw = fv = evaluate(x)
+
+    #Distance moved on the last two iterations
+    d = e = 0
+
+    while abs(x - (a + b)/2) > 2*tol - (b - a)/2:
+
+        xm = (a + b)/2
+
+        #Golden-section step into larger part of bracket unless a parabola
+        #through x, w and v gives an acceptable step
+        goldenStep = True
+
+        if abs(e) > tol:
+
+            r = (x - w)*(fx - fv)
+            q = (x - v)*(fx - fw)
+            p = (x - v)*q - (x - w)*r
+            q = 2*(q - r)
+
+            if q > 0:
+                p = -p
+
+            q = abs(q)
+            eTemp = e
+            e = d
+
+            if abs(p) < abs(q*eTemp/2) and q*(a - x) < p < q*(b - x):
+
+                d = p/q
+                goldenStep = False
+
+                #Parabolic step must not land too close to bracket ends
+                if (x + d) - a < 2*tol or b - (x + d) < 2*tol:
+                    d = math.copysign(tol, xm - x)
+
+        if goldenStep:
+            e = (a - x) if x >= xm else (b - x)
+            d = golden*e
+
+        #Steps are never smaller than the tolerance
+        u = x + d if abs(d) >= tol else x + math.copysign(tol, d)
+        fu = evaluate(u)
+
+        #Narrows bracket around best position found
+        if fu <= fx:
+
+            if u >= x:
+                a = x
+            else:
+                b = x
+
+            v, w, x = w, x, u
+            fv, fw, fx = fw, fx, fu
+
+        else:
+
+            if u < x:
+                a = u
+            else:
+                b = u
+
+            if fu <= fw or w == x:
+                v, w = w, u
+                fv, fw = fw, fu
+
+            elif fu <= fv or v == x or v == w:
+                v = u
+                fv = fu
+
+    #Best position found is refined to the vertex of a quadratic fitted to the
+    #logarithm of all readings of the search and at the bracket ends (exact
+    #across a Gaussian beam profile), which averages out the reading noise that
+    #limits the best single reading on the flat top of the peak. Where the
+    #readings show no curvature above their noise (e.g. along the optical axis,
+    #which hardly changes within a coarse step), neither the vertex nor the
+    #best reading locates the peak, and the starting position is kept
+    evaluate(lo)
+    evaluate(hi)
+
+    u = (np.array(list(readings.keys()), dtype=float) - start)/(stepC*34.304)
+    vals = -np.array(list(readings.values()))
+    x = start
+
+    if len(vals) > 4 and np.all(vals > 0):
+
+        coef, cov = np.polyfit(u, np.log(vals), 2, cov=True)
+
+        #Vertex used when the fit curves downwards by more than twice its
+        #standard error, kept within the bracket of the search
+        if coef[0] + 2*math.sqrt(cov[0, 0]) < 0:
+            x = min(max(start - coef[1]/(2*coef[0])*stepC*34.304, lo), hi)
+
+    s[ID].fineEvals = len(readings)
+
+    print("Fine search on " + str(s[ID].name) + ": " + str(len(readings)) + " readings")
+
+    #Sets fine optimized position along axis to best position found
+    s[ID].pos2 = x
 
     #Moves to fine optimized position
-    s[ID]._move_to(s[ID].pos2)
+    moveTo(ID, s[ID].pos2)
 
     #Updates the current position
     s[ID].posCur = s[ID].pos2
 
 #_______________________________________________________________________________
+
+#Perform multi-axis coarse optimization/alignment with DUT (single-axis
+#optimization of x, y and z in round robin order)
+
+#Parameters: coarse step size, threshold factor to define appropriate decline in
+#photocurrent during alignment, step count limit for single-axis optimization,
+#cycle count limit for multi-axis optimization, beam profile model fitted by
+#optimizeFit ("gauss" or "lorentz"; None to use edge search of optimizeC),
+#indices of axes to optimize (e.g. only z when x and y were handed off from the
+#planar scan map), boolean selecting the focus fit of optimizeZ for z
+
+#Returns true if all axes passed coarse optimization and false otherwise
+
+def coarseAlign(stepC, threshFact, stepLim, opt, model=None, axes=(0, 1, 2),
+                focus=False):
+
+    #value for stage selection (count of single-axis optimizations, taken in
+    #round robin order over the given axes)
+    ID = 0
+
+    #Scan type to be performed
+    coarseScan = True
+
+    #Assign names for each axis/stage
+    s[0].name = "x"
+    s[1].name = "y"
+    s[2].name = "z"
+
+    print("Starting multi-axis scan for laser alignment")
+
+    print("Initiating coarse scan process")
+
+    #Set initial position for comparison to current position for each axis
+    #(also the reference of fine optimization for axes not optimized here)
+    for axis in range(3):
+        s[axis].pos1 = s[axis].pos2 = s[axis].posCur
+
+        #Set initial optimization status of axes to be optimized to False (not
+        #optimized)
+        s[axis].status = axis not in axes
+
+    #Loop that continues until all axes are optimized according to coarse step
+    while coarseScan:
+
+        #Axis optimized in this pass
+        axis = axes[ID%len(axes)]
+
+        #Informs user of the current axis being optimized
+        print("Optimizing " + str(s[axis].name))
+
+        #Phase of coarse pass by axis and cycle
+        setPhase("coarse " + s[axis].name + " " + str(ID//len(axes) + 1))
+
+        #Checks if number of optimization cycles exceeds limit for convergence
+        if(ID > opt):
+
+            #Terminate coarse scan process
+            break
+
+        #Attempt to optimize a given axis
+        if focus and axis == 2:
+            optimized = optimizeZ(stepC, threshFact, stepLim)
+        elif model is not None:
+            optimized = optimizeFit(axis, stepC, threshFact, stepLim, model)
+        else:
+            optimized = optimizeC(axis, stepC, threshFact, stepLim)
+
+        if not optimized:
+
+            #Terminate coarse scan process
+            break
+
+        #Check if position along axis after optimization is within single
+        #coarse step of initial position
+        if abs(s[axis].pos2-s[axis].pos1) <= stepC*34.304:
+
+            #Set previous position for comparion to new  position along axis
+            #determined by optimization
+            s[axis].pos1 = s[axis].pos2
+
+            #Current axis optimized (individually)
+            print(str(s[axis].name + " passes"))
+
+            #Update status of axis to indicate a pass
+            s[axis].status = True
+
+            #Check if all axes are omptimized
+            if s[0].status and s[1].status and s[2].status:
+
+                #Change scan state
+                coarseScan = False
+
+                #Signify start of fine scan process
+                print("\nAll axes passed - Initiating Fine Scan Process")
+
+        else:
+
+            #Set previous position for comparion to new  position along axis
+            #determined by optimization
+            s[axis].pos1 = s[axis].pos2
+
+            #Current axis was not optimized (individually)
+            print(str(s[axis].name + " fails - reset all"))
+            print()
+
+            #Reset all optimized axes to non-optimized state
+            for other in axes:
+                s[other].status = False
+
+        #Positions after the pass kept for a resume
+        saveCheckpoint("coarse" if not coarseScan else "coarse pass", cycle=ID)
+
+        #Increment index to optimize next stage (round robin order)
+        ID += 1
+
+    #Check if termination occurence does not correspond to switching scan types
+    if coarseScan:
+
+        if s[axis].posCur <=0 or s[axis].posCur >= 857600:
+
+            #Display Realignment message to user
+            print("Stage limit reached - manual Realignment required")
+
+        else:
+
+            #Display paremeter selection message to user
+            print("Not converging to position - Change parameter choice")
+
+        return False
+
+    return True
+
+#_______________________________________________________________________________
+
+#Perform joint coarse optimization/alignment of x, y and z with DUT: each cycle
+#reads a small 3-D design of points around the current centre (all stages
+#moved together), fits a quadratic surface to the logarithm of the photocurrent
+#above dark current (exact across a Gaussian beam profile) and moves to its
+#maximum. Sampling the wide z spacing every cycle makes this mode travel about
+#half as far again as coarseAlign() and it is not faster (simulation, 20 trials:
+#117 s and 17.0 mm travel against 115 s and 11.1 mm)
+
+#Parameters: coarse step size, cycle count limit, dark current for DUT, ratio of
+#z to x/y sample spacing (photocurrent varies more slowly along the optical
+#axis)
+
+#Returns true if all axes converged to within a single coarse step and false
+#otherwise
+
+def coarseAlign3D(stepC, opt, darkCur, zFact=10):
+
+    #Assign names for each axis/stage
+    s[0].name = "x"
+    s[1].name = "y"
+    s[2].name = "z"
+
+    print("Starting multi-axis scan for laser alignment")
+
+    print("Initiating joint coarse scan process")
+
+    #Sample spacing along each axis [encoder counts]
+    h = np.array([stepC, stepC, stepC*zFact])*34.304
+
+    #Design points relative to centre [sample spacings]: centre, axial points
+    #and corners of the x/y square (z is taken as uncoupled from x and y at the
+    #beam centre, so only the x/y cross term is fitted), in visiting order (the
+    #far z points first and last, the x/y points around the square in between)
+    design = np.array([[0, 0, -1], [0, 0, 0],
+                       [1, 0, 0], [1, 1, 0], [0, 1, 0], [-1, 1, 0], [-1, 0, 0],
+                       [-1, -1, 0], [0, -1, 0], [1, -1, 0], [0, 0, 1]])
+
+    centre = np.array([s[ID].posCur for ID in range(3)], dtype=float)
+
+    #Counter for number of readings taken
+    reads = 0
+
+    #Boolean that states whether all axes converged
+    converged = False
+
+    for cycle in range(1, opt+1):
+
+        setPhase("coarse " + str(cycle))
+
+        pts = centre + design*h
+
+        #Checks if any sample point would exceed stage limits
+        if np.any(pts <= 0) or np.any(pts >= 857600):
+
+            #Display Realignment message to user
+            print("Stage limit reached - manual Realignment required")
+            return False
+
+        vals = []
+
+        for pos in pts:
+
+            moveAll(pos)
+
+            for ID in range(3):
+                s[ID].posCur = pos[ID]
+
+            vals.append(measure())
+
+        vals = np.array(vals)
+        reads += len(vals)
+
+        #Quadratic surface of log-photocurrent above dark current, weighted
+        #towards strong readings (weak readings are dominated by noise)
+        sig = np.clip(vals - darkCur, vals.max()*1e-4, None)
+        c, grad, hess = fitting.fitQuadratic(design, np.log(sig), sig/sig.max(), [(0, 1)])
+
+        #Newton step to the maximum, with curvature made negative along flat or
+        #upward curving directions
+        eigVals, eigVecs = np.linalg.eigh(hess)
+        eigVals = np.minimum(eigVals, -0.05)
+        step = eigVecs @ ((eigVecs.T @ grad)/-eigVals)
+
+        #Step limited to one sample spacing along each axis, so the next centre
+        #stays within the region the surface was fitted to
+        step = np.clip(step, -1, 1)
+        centre = centre + step*h
+
+        print("Cycle " + str(cycle) + ": moved " + ", ".join(
+            s[ID].name + " " + format(step[ID]*h[ID]/34.304, ".1f") + " \u03BCm"
+            for ID in range(3)))
+
+        #Checks if all axes moved within a single coarse step
+        if np.all(np.abs(step*h) <= stepC*34.304):
+            converged = True
+            break
+
+    if not converged:
+
+        #Display paremeter selection message to user
+        print("Not converging to position - Change parameter choice")
+        return False
+
+    #Checks if optimized position would exceed stage limits
+    if np.any(centre <= 0) or np.any(centre >= 857600):
+
+        print("Stage limit reached - manual Realignment required")
+        return False
+
+    #Moves to coarse optimized position
+    moveAll(centre)
+
+    #Updates positions for each axis
+    for ID in range(3):
+        s[ID].pos1 = s[ID].pos2 = s[ID].posCur = centre[ID]
+
+    print("\nAll axes converged after " + str(cycle) + " cycles (" + str(reads)
+          + " readings) - Initiating Fine Scan Process")
+
+    saveCheckpoint("coarse", cycle=cycle)
+
+    return True
+
+#_______________________________________________________________________________
+
+#Perform multi-axis fine optimization/alignment with DUT
+
+#Parameters: coarse step size, threshold factor to define appropriate decline in
+#photocurrent during alignment, minimum actuator resolution, boolean that
+#selects Brent search (optimizeBrent) instead of edge search (optimizeF),
+#indices of axes to optimize (e.g. the axes left when resuming a run)
+#No return
+
+def fineAlign(stepC, threshFact, minRes, brent=False, axes=(0, 1, 2)):
+
+    #Perform fine optimization on each axis
+    for ID in axes:
+
+        setPhase("fine " + "xyz"[ID])
+
+        #Optimize a single axis
+        if brent:
+            optimizeBrent(ID, stepC, minRes)
+        else:
+            optimizeF(ID, stepC, threshFact, minRes)
+
+        #Positions after the axis kept for a resume
+        saveCheckpoint("fine axis", axis=ID)
+
+    saveCheckpoint("fine")
+
+    #Inform user that process was successful
+    print("Alignment process successfully completed")
+
+#_______________________________________________________________________________
+
+#Re-aligns from the current position (coarse, then fine optimization), e.g.
+#when drift tracking (tracking.py) has lost the peak
+
+#Parameters: coarse step size, threshold factor, step count limit for
+#single-axis optimization, cycle count limit for multi-axis optimization,
+#minimum actuator resolution, beam profile model for coarse optimization (None
+#for edge search), boolean that selects Brent search for fine optimization,
+#boolean that selects the focus fit for coarse optimization of z
+
+#Returns true if re-alignment completed and false otherwise
+
+def realign(stepC, threshFact, stepLim, opt, minRes, model=None, brent=False,
+            focus=False):
+
+    print("Re-aligning from current position")
+
+    if not coarseAlign(stepC, threshFact, stepLim, opt, model, focus=focus):
+        return False
+
+    fineAlign(stepC, threshFact, minRes, brent)
+
+    return True
+
+#_______________________________________________________________________________
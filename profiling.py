@@ -0,0 +1,249 @@
+#Per-phase timing of stage moves and meter reads: stage and meter methods are
+#wrapped with timers and counters, and results are attributed to the process
+#phase that is active when they run
+
+import csv
+import threading
+
+#_______________________________________________________________________________
+
+#Profiler collecting, for each phase, elapsed time, number of moves, distance
+#travelled, time spent commanding and waiting for moves, number of readings
+#and time spent reading
+
+#Parameters: clock function returning current time [s]
+
+class Profiler:
+
+    def __init__(self, clock):
+
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        #Statistics by phase name (in order of first occurrence)
+        self.stats = {}
+
+        #Active phase and time it was entered
+        self.phase = None
+        self.tPhase = None
+
+        #Wrapped objects with their original attributes
+        self.wrapped = []
+
+        #Last commanded target of each stage (None if unknown) [encoder counts]
+        self.targets = {}
+
+    #Statistics of a phase (created on first use)
+    def _phase(self, name):
+
+        if name not in self.stats:
+            self.stats[name] = {"elapsed": 0.0, "moves": 0, "distance": 0.0,
+                                "moveTime": 0.0, "reads": 0, "readTime": 0.0}
+
+        return self.stats[name]
+
+    #Enters a phase (elapsed time of the previous phase is closed)
+    #Parameters: phase name
+    #No return
+    def enter(self, name):
+
+        now = self.clock()
+
+        with self.lock:
+
+            if self.phase is not None:
+                self._phase(self.phase)["elapsed"] += now - self.tPhase
+
+            self.phase = name
+            self.tPhase = now
+            self._phase(name)
+
+    #Adds to statistics of the active phase
+    def _add(self, **values):
+
+        with self.lock:
+
+            stats = self._phase(self.phase)
+
+            for key in values:
+                stats[key] += values[key]
+
+    #Replaces an attribute of an object with a wrapper (restored by remove())
+    def _wrap(self, obj, name, wrapper):
+
+        self.wrapped.append((obj, name, obj.__dict__.get(name)))
+        setattr(obj, name, wrapper)
+
+    #Wraps moves of stages and meter reads of a module with timers and counters
+    #Parameters: list of stages, module exposing read_dmm, trigger_dmm,
+    #fetch_dmm and read_block (processes)
+    #No return
+    def instrument(self, stages, module):
+
+        for index, stage in enumerate(stages):
+            self._wrapStage(index, stage)
+
+        for name in ("read_dmm", "trigger_dmm", "fetch_dmm", "read_block"):
+
+            func = getattr(module, name)
+
+            if func is not None:
+                self._wrap(module, name, self._timeRead(func, name))
+
+    #Wraps moves of a single stage
+    def _wrapStage(self, index, stage):
+
+        moveTo = stage._move_to
+        moveBy = stage._move_by
+        waitMove = stage.wait_move
+        stop = stage.stop
+
+        #Moves issued from within a wrapped call (e.g. while stopping) are not
+        #counted again
+        inner = [False]
+
+        def timedMoveTo(position, *args, **kwargs):
+
+            if inner[0]:
+                return moveTo(position, *args, **kwargs)
+
+            last = self.targets.get(index)
+
+            if last is None:
+                last = stage.get_position()
+
+            t = self.clock()
+            result = moveTo(position, *args, **kwargs)
+
+            self.targets[index] = position
+            self._add(moves=1, distance=abs(position - last), moveTime=self.clock() - t)
+
+            return result
+
+        def timedMoveBy(distance=1, *args, **kwargs):
+
+            last = self.targets.get(index)
+
+            t = self.clock()
+            inner[0] = True
+
+            try:
+                result = moveBy(distance, *args, **kwargs)
+            finally:
+                inner[0] = False
+
+            self.targets[index] = None if last is None else last + distance
+            self._add(moves=1, distance=abs(distance), moveTime=self.clock() - t)
+
+            return result
+
+        def timedWaitMove(*args, **kwargs):
+
+            t = self.clock()
+            result = waitMove(*args, **kwargs)
+            self._add(moveTime=self.clock() - t)
+
+            return result
+
+        def timedStop(*args, **kwargs):
+
+            inner[0] = True
+
+            try:
+                return stop(*args, **kwargs)
+
+            finally:
+
+                #Stopped position is only known from the stage
+                inner[0] = False
+                self.targets[index] = None
+
+        self._wrap(stage, "_move_to", timedMoveTo)
+        self._wrap(stage, "_move_by", timedMoveBy)
+        self._wrap(stage, "wait_move", timedWaitMove)
+        self._wrap(stage, "stop", timedStop)
+
+    #Wraps a meter function with a timer (and a reading counter; fetches are
+    #counted with their trigger, and bulk reads by their number of samples)
+    def _timeRead(self, func, name):
+
+        def timed(*args, **kwargs):
+
+            t = self.clock()
+            result = func(*args, **kwargs)
+            reads = (len(result) if name == "read_block"
+                     else int(name != "fetch_dmm"))
+            self._add(reads=reads, readTime=self.clock() - t)
+
+            return result
+
+        return timed
+
+    #Restores wrapped attributes
+    def remove(self):
+
+        for obj, name, original in reversed(self.wrapped):
+
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+
+        self.wrapped = []
+
+    #Closes elapsed time of the active phase
+    def finish(self):
+
+        if self.phase is not None:
+            self.enter(self.phase)
+
+    #Statistics by phase, with time shares of the whole run
+    #Returns list of dictionaries (one per phase, in order of first occurrence)
+    def summary(self):
+
+        total = sum(stats["elapsed"] for stats in self.stats.values())
+
+        return [dict(stats, phase=name,
+                     share=stats["elapsed"]/total if total else 0.0,
+                     moveShare=stats["moveTime"]/stats["elapsed"] if stats["elapsed"] else 0.0,
+                     readShare=stats["readTime"]/stats["elapsed"] if stats["elapsed"] else 0.0)
+                for name, stats in self.stats.items()]
+
+    #Prints statistics by phase as a table (distance in micrometres; move and
+    #read shares may exceed the elapsed time when the engine overlaps them)
+    #Parameters: encoder counts per micrometre
+    #No return
+    def report(self, cntsPerUm=34.304):
+
+        rows = self.summary()
+
+        print(format("phase", "<22") + format("time [s]", ">10") + format("share", ">8")
+              + format("moves", ">7") + format("travel [um]", ">13")
+              + format("move", ">7") + format("reads", ">7") + format("read", ">7"))
+
+        for r in rows:
+            print(format(r["phase"][:22], "<22") + format(r["elapsed"], ">10.2f")
+                  + format(100*r["share"], ">7.1f") + "%" + format(r["moves"], ">7")
+                  + format(r["distance"]/cntsPerUm, ">13.1f")
+                  + format(100*r["moveShare"], ">6.0f") + "%" + format(r["reads"], ">7")
+                  + format(100*r["readShare"], ">6.0f") + "%")
+
+        print(format("total", "<22")
+              + format(sum(r["elapsed"] for r in rows), ">10.2f") + format("", ">8")
+              + format(sum(r["moves"] for r in rows), ">7")
+              + format(sum(r["distance"] for r in rows)/cntsPerUm, ">13.1f")
+              + format("", ">7") + format(sum(r["reads"] for r in rows), ">7"))
+
+    #Writes statistics by phase to a CSV file
+    #Parameters: path of file
+    #No return
+    def export(self, path):
+
+        rows = self.summary()
+
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["phase", "elapsed", "share", "moves",
+                                                   "distance", "moveTime", "moveShare",
+                                                   "reads", "readTime", "readShare"])
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,59 @@
+#On-disk store of alignment recipes (aligned stage positions, dark current and
+#beam width) keyed by DUT or fixture ID, used to warm-start repeat alignments
+
+import json
+import os
+import time
+
+#_______________________________________________________________________________
+
+#Recipe store backed by a JSON file (rewritten atomically on every update)
+
+#Parameters: path of the store file
+
+class RecipeStore:
+
+    def __init__(self, path="recipes.json"):
+
+        self.path = path
+
+        #Recipes by DUT or fixture ID
+        self.recipes = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.recipes = json.load(f)
+
+    #Looks up recipe of a DUT or fixture
+    #Parameters: DUT or fixture ID
+    #Returns recipe dictionary, or None if the ID is not stored
+    def get(self, key):
+
+        return self.recipes.get(str(key))
+
+    #Stores recipe of a DUT or fixture (with time of storage)
+    #Parameters: DUT or fixture ID, recipe dictionary
+    #No return
+    def put(self, key, recipe):
+
+        self.recipes[str(key)] = dict(recipe, stored=time.time())
+        self.save()
+
+    #Removes recipe of a DUT or fixture
+    #Parameters: DUT or fixture ID
+    #No return
+    def remove(self, key):
+
+        if self.recipes.pop(str(key), None) is not None:
+            self.save()
+
+    #Writes store file (through a temporary file, so an interrupted write
+    #leaves the previous store intact)
+    def save(self):
+
+        tmp = self.path + ".tmp"
+
+        with open(tmp, "w") as f:
+            json.dump(self.recipes, f, indent=2)
+
+        os.replace(tmp, self.path)
@@ -0,0 +1,204 @@
+#Offline replay of recorded alignment traces (tracelog.py): readings of a trace
+#are turned into an interpolated photocurrent field, and the alignment
+#processes are run against it on the simulated backend at CPU speed (e.g. to
+#compare parameter variants or check algorithm changes for regressions)
+
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import numpy as np
+
+import benchmark
+import simulation
+import tracelog
+
+#_______________________________________________________________________________
+
+#Photocurrent field interpolated from the readings of a trace, usable as the
+#beam of a simulated rig (same interface as simulation.Beam). Readings are
+#averaged over cells of a 3-D grid, and the field at a position is the kernel
+#weighted mean of the cell values (Gaussian kernel with separate x/y and z
+#length scales), blended towards the dark current away from recorded readings
+
+#Parameters: trace dictionary (as returned by tracelog.loadTrace()), grid cell
+#size in x/y and z [micrometres], kernel length scale in x/y and z
+#[micrometres]
+
+class TraceField:
+
+    def __init__(self, trace, cell=(5.0, 25.0), scale=(15.0, 150.0)):
+
+        reads = trace["kind"] == tracelog.READ
+        pos = trace["pos"][reads]
+        vals = trace["reading"][reads]
+
+        #Readings without a known position are not part of the field
+        valid = np.all(np.isfinite(pos), axis=1) & np.isfinite(vals)
+        pos = pos[valid]
+        vals = vals[valid]
+
+        #Dark current from dark phase readings (low percentile of all readings
+        #if the trace has none)
+        phases = trace["phases"]
+        phase = trace["phase"][reads][valid]
+
+        if "dark" in phases and np.any(phase == phases.index("dark")):
+            self.dark = float(np.mean(vals[phase == phases.index("dark")]))
+            keep = phase != phases.index("dark")
+            pos = pos[keep]
+            vals = vals[keep]
+        else:
+            self.dark = float(np.percentile(vals, 5))
+
+        #Mean reading of each occupied grid cell [encoder counts]
+        size = np.array([cell[0], cell[0], cell[1]])*simulation.cntsPerUm
+        keys, inverse = np.unique(np.round(pos/size).astype(np.int64), axis=0,
+                                  return_inverse=True)
+        inverse = inverse.ravel()
+        counts = np.bincount(inverse)
+
+        self.points = np.column_stack([np.bincount(inverse, pos[:, k])/counts
+                                       for k in range(3)])
+        self.values = np.bincount(inverse, vals)/counts
+        self.scale = np.array([scale[0], scale[0], scale[1]])*simulation.cntsPerUm
+
+        #Weight of the dark current in the blend (weight of a reading at two
+        #length scales)
+        self.blend = np.exp(-2.0)
+
+        #Number of field evaluations, and those far from recorded readings
+        self.queries = 0
+        self.extrapolated = 0
+
+        #Position of strongest recorded cell (treated as beam centre)
+        self.peak = self.points[np.argmax(self.values)]
+
+    #Interpolated reading (with dark current) at a position [encoder counts]
+    def value(self, pos):
+
+        d2 = np.sum(((self.points - pos)/self.scale)**2, axis=1)
+        w = np.exp(-d2/2)
+        total = w.sum()
+
+        self.queries += 1
+
+        if total < self.blend:
+            self.extrapolated += 1
+
+        return float((w @ self.values + self.blend*self.dark)/(total + self.blend))
+
+    #Photocurrent without dark current at stage positions (as Beam.signal)
+    def signal(self, x, y, z, t=0.0):
+
+        return self.value(np.array([x, y, z], dtype=float)) - self.dark
+
+    #Dark current (constant over the replay)
+    def darkAt(self, t):
+
+        return self.dark
+
+    #Beam centre (strongest recorded cell)
+    def centreAt(self, t):
+
+        return self.peak
+
+#_______________________________________________________________________________
+
+#Replays the alignment flow of alignment.py against a trace field
+
+#Parameters: trace field, alignment parameters (dict of benchmark.runFlow
+#keyword arguments), starting positions of stages (x, y, z) [encoder counts],
+#relative photocurrent noise and dark current noise added to the field, seed
+#for noise generator
+
+#Returns dictionary of replay results (as benchmark.runTrial, with number of
+#field evaluations far from recorded readings)
+
+def replayFlow(field, params, start=None, noise=0.0, darkNoise=0.0, seed=None):
+
+    if start is None:
+        start = (benchmark.centPos,)*3
+
+    rig = simulation.Rig(field, start, noise=noise, darkNoise=darkNoise, seed=seed)
+    field.queries = field.extrapolated = 0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        success = benchmark.runFlow(rig, **params)
+
+    err = rig.error()
+
+    return {"success": success,
+            "moves": rig.moves(),
+            "reads": rig.reads,
+            "time": rig.clock.t,
+            "travel": rig.travel(),
+            "errXY": float(np.hypot(err[0], err[1])),
+            "errZ": float(abs(err[2])),
+            "extrapolated": field.extrapolated/max(field.queries, 1)}
+
+#_______________________________________________________________________________
+
+#Replays all combinations of parameter values against a trace field
+
+#Parameters: trace field, fixed alignment parameters, dictionary of parameter
+#name to list of values to combine, keyword arguments for replayFlow()
+
+#Returns list of result dictionaries (with the parameter values of each
+#variant)
+
+def sweep(field, params, variants, **replayArgs):
+
+    names = list(variants)
+    results = []
+
+    for values in itertools.product(*(variants[name] for name in names)):
+
+        variant = dict(zip(names, values))
+        result = replayFlow(field, dict(params, **variant), **replayArgs)
+        results.append(dict(variant, **result))
+
+    return results
+
+#_______________________________________________________________________________
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay alignment against a "
+                                     "recorded trace")
+    parser.add_argument("trace", help="trace file written by tracelog.TraceLog")
+    parser.add_argument("--stepC", type=float, nargs="+", default=[50.0])
+    parser.add_argument("--stepLim", type=int, nargs="+", default=[100])
+    parser.add_argument("--opt", type=int, nargs="+", default=[30])
+    parser.add_argument("--threshFact", type=float, nargs="+", default=[0.9])
+    parser.add_argument("--sigFact", type=float, nargs="+", default=[2.0])
+    parser.add_argument("--noise", type=float, default=0.0,
+                        help="relative photocurrent noise added to the field")
+    parser.add_argument("--darkNoise", type=float, default=0.0,
+                        help="dark current noise added to the field")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="file to write per-variant results to")
+    args = parser.parse_args()
+
+    field = TraceField(tracelog.loadTrace(args.trace))
+
+    variants = {"stepC": args.stepC, "stepLim": args.stepLim, "opt": args.opt,
+                "threshFact": args.threshFact, "sigFact": args.sigFact}
+
+    results = sweep(field, {"pipeline": None}, variants, noise=args.noise,
+                    darkNoise=args.darkNoise, seed=args.seed)
+
+    keys = list(variants) + ["success", "reads", "time", "errXY", "errZ",
+                             "extrapolated"]
+
+    print("".join(format(key, ">14") for key in keys))
+
+    for r in results:
+        print("".join(format(float(r[key]), ">14.4g") for key in keys))
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
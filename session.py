@@ -0,0 +1,295 @@
+#Persistent hardware session: a local service that opens the stages and meter
+#once, keeps the connections and the known stage positions for the whole shift,
+#and runs headless alignment jobs (headless.py) sent over a local socket
+
+import argparse
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+import numpy as np
+
+import headless
+import processes
+import simulation
+
+#Default address of the session service (local connections only)
+HOST = "127.0.0.1"
+PORT = 47820
+
+#Session open in this process (the alignment processes keep stages, meter and
+#settings in module state, so a process holds one session at a time and
+#stations.py runs each station in a process of its own)
+active = None
+
+#_______________________________________________________________________________
+
+#Open hardware session running one alignment job at a time
+
+#Parameters: serial numbers of x, y, z stages, simulated rig to use instead of
+#the stages (None for hardware)
+
+class Session:
+
+    def __init__(self, serials=("", "", ""), rig=None):
+
+        global active
+
+        if active is not None:
+            raise RuntimeError("a session is already open in this process")
+
+        self.rig = rig
+        self.lock = threading.Lock()
+
+        tOpen = time.monotonic()
+
+        #Stages connected once for the session (the simulated rig replaces
+        #stages and meter when given)
+        if rig is not None:
+            rig.install(processes)
+            self.stages = rig.stages
+
+        else:
+
+            if headless.Thorlabs is None:
+                raise RuntimeError("pylablib is required to connect stages")
+
+            self.stages = [headless.Thorlabs.KinesisMotor(serial) for serial in serials]
+            processes.s[:] = self.stages
+
+        #Source meters opened by the jobs, kept open by VISA resource
+        self.meters = {}
+
+        #Per-job state of the alignment processes after opening, restored
+        #before each job
+        self.defaults = {name: getattr(processes, name) for name in headless.jobState}
+
+        #Known stage positions, read from the stages once and afterwards kept
+        #from the jobs [encoder counts]
+        self.positions = [float(stage.get_position()) for stage in self.stages]
+
+        for stage, pos in zip(self.stages, self.positions):
+            stage.posCur = pos
+
+        self.openTime = time.monotonic() - tOpen
+        self.started = time.time()
+        self.jobs = 0
+        self.results = {"aligned": 0, "failed": 0, "error": 0}
+
+        active = self
+
+    #Runs an alignment job on the open stages
+    #Parameters: dictionary of parameters (overrides of the headless defaults),
+    #profile name, beam centre offset from the stage centre for the simulated
+    #rig [micrometres] (None to keep the current beam)
+    #Returns result dictionary of headless.runAlignment()
+    def align(self, params=None, profile=None, beam=None):
+
+        config = headless.loadConfig(None, profile, params)
+
+        with self.lock:
+
+            #Simulated DUT re-seated with the beam at the given offset
+            if beam is not None and self.rig is not None:
+                self.rig.beam.centre = (config["centPos"]
+                                        + np.asarray(beam, dtype=float)*simulation.cntsPerUm)
+
+            #Stages and meters of the session are reused, and stages start from
+            #their known positions
+            for stage, pos in zip(self.stages, self.positions):
+                stage.posCur = pos
+
+            for name, value in self.defaults.items():
+                setattr(processes, name, value)
+
+            result = headless.runAlignment(config, self.stages, self.meters)
+
+            #Positions after the job (from the stages if the job ended without
+            #a known position)
+            self.positions = (result["position"] if result["position"] is not None
+                              else [float(stage.get_position()) for stage in self.stages])
+
+            self.jobs += 1
+            self.results[result["status"]] += 1
+
+        return result
+
+    #State of the session (without querying the stages)
+    #Returns dictionary of known positions, job counters and session times
+    def status(self):
+
+        return {"positions": self.positions,
+                "positionsUm": [p/simulation.cntsPerUm for p in self.positions],
+                "jobs": self.jobs, "results": dict(self.results),
+                "busy": self.lock.locked(), "simulated": self.rig is not None,
+                "openTime": self.openTime, "uptime": time.time() - self.started}
+
+    #Closes the stage and meter connections, releasing the process for another
+    #session
+    def close(self):
+
+        global active
+
+        with self.lock:
+
+            for stage in self.stages:
+                stage.close()
+
+            for meter in self.meters.values():
+                meter.close()
+
+            if active is self:
+                active = None
+
+#_______________________________________________________________________________
+
+#Request handler: one JSON request per line, answered by one JSON line
+#(requests: {"cmd": "align", "params": {...}, "profile": ..., "beam": [...]},
+#{"cmd": "status"}, {"cmd": "shutdown"})
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+
+        for line in self.rfile:
+
+            try:
+                request = json.loads(line)
+                reply = self.server.dispatch(request)
+
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {"status": "error", "error": type(e).__name__ + ": " + str(e)}
+
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+#Session service: threaded, so status requests are answered while a job runs
+#(jobs themselves are serialized by the session)
+
+#Parameters: open session, host and port to listen on
+
+class SessionServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, session, host=HOST, port=PORT):
+
+        super().__init__((host, port), Handler)
+        self.session = session
+
+    #Carries out a request
+    #Parameters: request dictionary
+    #Returns reply dictionary
+    def dispatch(self, request):
+
+        cmd = request["cmd"]
+
+        if cmd == "align":
+            return self.session.align(request.get("params"), request.get("profile"),
+                                      request.get("beam"))
+
+        if cmd == "status":
+            return self.session.status()
+
+        if cmd == "shutdown":
+
+            #Shutdown waits for the serving loop, so it runs on its own thread
+            threading.Thread(target=self.shutdown).start()
+            return {"status": "shutdown"}
+
+        raise ValueError("unknown command '" + str(cmd) + "'")
+
+#_______________________________________________________________________________
+
+#Sends a request to the session service and waits for the reply
+
+#Parameters: request dictionary, host and port of the service, timeout [s]
+#(None to wait for the job indefinitely)
+
+#Returns reply dictionary
+
+def request(req, host=HOST, port=PORT, timeout=None):
+
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+
+        conn.sendall((json.dumps(req) + "\n").encode())
+
+        with conn.makefile("rb") as f:
+            return json.loads(f.readline())
+
+#_______________________________________________________________________________
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Persistent hardware session "
+                                     "serving alignment jobs over a local socket")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    commands = parser.add_subparsers(dest="cmd", required=True)
+
+    serve = commands.add_parser("serve", help="open the stages and serve jobs")
+    serve.add_argument("--stages", nargs=3, default=["", "", ""],
+                       metavar=("X", "Y", "Z"), help="stage serial numbers")
+    serve.add_argument("--simulate", type=float, nargs=3, metavar=("X", "Y", "Z"),
+                       help="serve a simulated rig with the beam offset from the "
+                       "stage centre [um]")
+    serve.add_argument("--seed", type=int, help="seed of the simulated rig")
+
+    align = commands.add_parser("align", help="run an alignment job")
+    align.add_argument("config", nargs="?", help="JSON config file")
+    align.add_argument("--profile")
+    align.add_argument("--dut", help="DUT or fixture ID (overrides the config)")
+    align.add_argument("--beam", type=float, nargs=3, metavar=("X", "Y", "Z"),
+                       help="re-seat the simulated beam at this offset [um]")
+
+    commands.add_parser("status", help="print the session state")
+    commands.add_parser("shutdown", help="close the session")
+
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+
+        rig = None
+
+        if args.simulate is not None:
+            centre = (headless.parameters["centPos"][1]
+                      + np.asarray(args.simulate)*simulation.cntsPerUm)
+            rig = simulation.Rig(simulation.Beam(centre), seed=args.seed)
+
+        session = Session(args.stages, rig)
+
+        with SessionServer(session, args.host, args.port) as server:
+
+            print("Session open (" + format(session.openTime, ".2f") + " s) - serving on "
+                  + args.host + ":" + str(args.port), file=sys.stderr)
+            server.serve_forever()
+
+        session.close()
+
+    elif args.cmd == "align":
+
+        #Config (with profiles of the config file) resolved here, so errors are
+        #reported before the job is sent
+        try:
+            params = headless.loadConfig(args.config, args.profile,
+                                         {"dutID": args.dut} if args.dut else None)
+
+        except (OSError, ValueError) as e:
+            reply = {"status": "error", "error": type(e).__name__ + ": " + str(e)}
+
+        else:
+            reply = request({"cmd": "align", "params": params, "beam": args.beam},
+                            args.host, args.port)
+
+        json.dump(reply, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+        sys.exit({"aligned": headless.EXIT_ALIGNED,
+                  "failed": headless.EXIT_FAILED}.get(reply.get("status"),
+                                                      headless.EXIT_ERROR))
+
+    else:
+        json.dump(request({"cmd": args.cmd}, args.host, args.port), sys.stdout, indent=2)
+        sys.stdout.write("\n")
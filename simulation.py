@@ -0,0 +1,420 @@
+#Simulated stages and photocurrent source for running alignment processes
+#without hardware (drop-in replacements for Thorlabs.KinesisMotor and read_dmm)
+
+import collections
+import math
+import numpy as np
+
+#Encoder limits of a stage [encoder counts]
+posMin = 0
+posMax = 857600
+
+#Encoder counts per micrometre of stage travel
+cntsPerUm = 34.304
+
+#Velocity parameters of a stage (as returned by pylablib) [encoder counts/s,
+#encoder counts/s^2]
+TVelocityParams = collections.namedtuple("TVelocityParams",
+                                         ["min_velocity", "acceleration", "max_velocity"])
+
+#_______________________________________________________________________________
+
+#Simulated time shared by all devices of a rig [seconds]
+
+class Clock:
+
+    def __init__(self):
+
+        #Current simulated time
+        self.t = 0.0
+
+    #Advances simulated time to a given instant (time never runs backwards)
+    #Parameters: instant to advance to
+    #No return
+    def advance(self, t):
+
+        if t > self.t:
+            self.t = t
+
+#_______________________________________________________________________________
+
+#Simulated Thorlabs KinesisMotor stage with trapezoidal move profile, command
+#latency, settling time and encoder limits
+
+#Parameters: serial number (unused), shared clock, starting position [encoder
+#counts], maximum velocity [mm/s], acceleration [mm/s^2], settling time after a
+#move [s], command latency [s]
+
+class KinesisMotor:
+
+    def __init__(self, conn, clock=None, position=428800, velocity=2.3,
+                 accel=1.5, settle=0.05, latency=0.02):
+
+        self.conn = conn
+        self.clock = clock if clock is not None else Clock()
+
+        #Motion parameters converted to encoder counts
+        self.velocity = velocity*1000*cntsPerUm
+        self.accel = accel*1000*cntsPerUm
+        self.settle = settle
+        self.latency = latency
+
+        #Current motion segment (start time, start/end position and duration)
+        self.tStart = 0.0
+        self.pStart = self.pEnd = position
+        self.duration = 0.0
+
+        #Counters for number of moves issued and total distance travelled
+        #[encoder counts]
+        self.moves = 0
+        self.travel = 0.0
+
+    #Computes duration of a move of a given length [encoder counts]
+    def _profile(self, dist):
+
+        #Distance required to reach and leave maximum velocity
+        if dist >= self.velocity**2/self.accel:
+            return dist/self.velocity + self.velocity/self.accel
+
+        #Triangular profile (maximum velocity never reached)
+        return 2*math.sqrt(dist/self.accel)
+
+    #Computes stage position at a given simulated time [encoder counts]
+    def positionAt(self, t):
+
+        tau = t - self.tStart
+
+        if tau <= 0:
+            return self.pStart
+
+        if tau >= self.duration:
+            return self.pEnd
+
+        dist = abs(self.pEnd - self.pStart)
+        sign = 1 if self.pEnd >= self.pStart else -1
+        tAcc = min(self.velocity/self.accel, self.duration/2)
+
+        #Accelerating, cruising or decelerating part of the profile
+        if tau < tAcc:
+            x = 0.5*self.accel*tau**2
+        elif tau < self.duration - tAcc:
+            x = 0.5*self.accel*tAcc**2 + self.velocity*(tau - tAcc)
+        else:
+            x = dist - 0.5*self.accel*(self.duration - tau)**2
+
+        return self.pStart + sign*x
+
+    #Computes stage speed at a given simulated time [encoder counts/s]
+    def speedAt(self, t):
+
+        tau = t - self.tStart
+
+        if tau <= 0 or tau >= self.duration:
+            return 0.0
+
+        tAcc = min(self.velocity/self.accel, self.duration/2)
+
+        return self.accel*min(tau, tAcc, self.duration - tau)
+
+    #Time at which the stage has come to rest after the current move [s]
+    def doneAt(self):
+
+        if self.duration == 0:
+            return self.tStart
+
+        return self.tStart + self.duration + self.settle
+
+    #Starts absolute move (returns immediately, as in pylablib)
+    #Parameters: target position [encoder counts]
+    #No return
+    def _move_to(self, position):
+
+        #Stage stops at its limit switches
+        position = int(round(min(max(position, posMin), posMax)))
+
+        #Move starts once command reaches controller
+        tStart = self.clock.t + self.latency
+        pStart = self.positionAt(tStart)
+
+        self.tStart = tStart
+        self.pStart = pStart
+        self.pEnd = position
+        self.duration = self._profile(abs(position - pStart))
+
+        self.moves += 1
+        self.travel += abs(position - pStart)
+
+    #Starts relative move (returns immediately, as in pylablib)
+    #Parameters: distance to move [encoder counts]
+    #No return
+    def _move_by(self, distance=1):
+
+        self._move_to(self.pEnd + distance)
+
+    #Blocks (in simulated time) until the current move has settled
+    def wait_move(self, timeout=None):
+
+        self.clock.advance(self.doneAt())
+
+    def is_moving(self):
+
+        return self.clock.t < self.tStart + self.duration
+
+    def get_position(self):
+
+        return int(round(self.positionAt(self.clock.t)))
+
+    #Stops stage (decelerating unless immediate)
+    def stop(self, immediate=False):
+
+        tStop = self.clock.t + self.latency
+        pos = self.positionAt(tStop)
+
+        if not immediate:
+            dist = self.speedAt(tStop)**2/(2*self.accel)
+            pos += math.copysign(dist, self.pEnd - self.pStart)
+
+        self._move_to(pos)
+
+        #Stopping is not a commanded move
+        self.moves -= 1
+
+    def get_velocity_parameters(self, channel=None, scale=True):
+
+        return TVelocityParams(0.0, self.accel, self.velocity)
+
+    def setup_velocity(self, min_velocity=None, acceleration=None,
+                       max_velocity=None, channel=None, scale=True):
+
+        if acceleration is not None:
+            self.accel = acceleration
+
+        if max_velocity is not None:
+            self.velocity = max_velocity
+
+        return self.get_velocity_parameters()
+
+    def close(self):
+
+        pass
+
+#_______________________________________________________________________________
+
+#Synthetic Gaussian beam incident on DUT, with defocus along z, dark current
+#and drift
+
+#Parameters: beam centre (x, y, z) [encoder counts], peak photocurrent, dark
+#current, 1/e^2 spot radius at focus [micrometres], Rayleigh range
+#[micrometres], beam centre drift (x, y, z) [micrometres/s], relative dark
+#current drift [1/s]
+
+class Beam:
+
+    def __init__(self, centre, peak=1e-7, dark=1e-10, width=60.0, rayleigh=1500.0,
+                 drift=(0.0, 0.0, 0.0), darkDrift=0.0):
+
+        self.centre = np.asarray(centre, dtype=float)
+        self.peak = peak
+        self.dark = dark
+        self.width = width
+        self.rayleigh = rayleigh
+        self.drift = np.asarray(drift, dtype=float)*cntsPerUm
+        self.darkDrift = darkDrift
+
+    #Beam centre at a given simulated time [encoder counts]
+    def centreAt(self, t):
+
+        return self.centre + self.drift*t
+
+    #Dark current at a given simulated time
+    def darkAt(self, t):
+
+        return self.dark*(1 + self.darkDrift*t)
+
+    #Noiseless photocurrent (without dark current) for stage positions, which
+    #may be scalars or arrays [encoder counts]
+    def signal(self, x, y, z, t=0.0):
+
+        cx, cy, cz = self.centreAt(t)
+
+        #Spot radius at given defocus [micrometres]
+        w = self.width*np.sqrt(1 + ((z - cz)/cntsPerUm/self.rayleigh)**2)
+
+        r2 = ((x - cx)**2 + (y - cy)**2)/cntsPerUm**2
+
+        #Total beam power conserved on a small detector as spot grows
+        return self.peak*(self.width/w)**2*np.exp(-2*r2/w**2)
+
+#_______________________________________________________________________________
+
+#Simulated rig of three stages, beam and meter sharing one clock
+
+#Parameters: beam incident on DUT, starting positions of stages (x, y, z)
+#[encoder counts], meter integration time [s], meter transfer time of a
+#reading [s], relative photocurrent noise, dark current noise relative to dark
+#current, seed for noise generator, keyword arguments for simulated stages
+
+class Rig:
+
+    def __init__(self, beam, start=(428800, 428800, 428800), readTime=0.1,
+                 readLatency=0.03, noise=0.01, darkNoise=0.05, seed=None,
+                 **stageArgs):
+
+        self.clock = Clock()
+        self.beam = beam
+        self.readTime = readTime
+        self.readLatency = readLatency
+        self.noise = noise
+        self.darkNoise = darkNoise
+        self.rng = np.random.default_rng(seed)
+
+        #Stages in x, y, z order
+        self.stages = [KinesisMotor("sim" + name, self.clock, pos, **stageArgs)
+                       for name, pos in zip("xyz", start)]
+
+        #Shutter state (True if DUT is illuminated)
+        self.shutter = True
+
+        #Counter for number of meter reads
+        self.reads = 0
+
+        #Triggered readings not yet fetched, and time at which the meter has
+        #transferred the last of them
+        self.triggered = []
+        self.fetchDone = 0.0
+
+        #Samples of a buffered acquisition not yet fetched
+        self.buffer = []
+
+    #Simulated meter reading (drop-in replacement for read_dmm)
+    #No parameters
+    #Returns photocurrent averaged over integration time
+    def read_dmm(self):
+
+        self.trigger()
+        self.clock.advance(self.fetchDone)
+
+        return self.fetch()
+
+    #Triggers a reading and returns once integration is complete (transfer of
+    #the reading continues in the background)
+    #No parameters
+    #No return
+    def trigger(self):
+
+        #Meter must finish transferring the previous reading
+        self.clock.advance(self.fetchDone)
+
+        self.triggered.append(self.sample())
+        self.fetchDone = self.clock.t + self.readLatency
+
+    #Returns oldest triggered reading
+    def fetch(self):
+
+        return self.triggered.pop(0)
+
+    #Arms a buffered acquisition: takes a number of samples at the current
+    #positions, with a given interval between them, for read back by
+    #fetch_block() in one transfer
+    #Parameters: number of samples, interval between samples [s]
+    #No return
+    def arm(self, count, interval=0.0):
+
+        #Meter must finish transferring the previous reading
+        self.clock.advance(self.fetchDone)
+
+        for index in range(count):
+
+            if index:
+                self.clock.advance(self.clock.t + interval)
+
+            self.buffer.append(self.sample())
+
+        self.fetchDone = self.clock.t + self.readLatency
+
+    #Returns all armed samples (array), once transferred
+    def fetch_block(self):
+
+        self.clock.advance(self.fetchDone)
+
+        vals = np.array(self.buffer, dtype=float)
+        self.buffer = []
+
+        return vals
+
+    #Simulated bulk read (drop-in replacement for a buffered meter's readBlock)
+    #Parameters: number of samples, interval between samples [s]
+    #Returns array of samples
+    def read_block(self, count, interval=0.0):
+
+        self.arm(count, interval)
+
+        return self.fetch_block()
+
+    #Integrates photocurrent over integration time
+    #No parameters
+    #Returns photocurrent averaged over integration time
+    def sample(self):
+
+        t = self.clock.t
+        self.clock.advance(t + self.readTime)
+        self.reads += 1
+
+        #Positions sampled at middle of integration window
+        tMid = t + self.readTime/2
+        x, y, z = (stage.positionAt(tMid) for stage in self.stages)
+
+        dark = self.beam.darkAt(tMid)
+        sig = self.beam.signal(x, y, z, tMid) if self.shutter else 0.0
+
+        return (sig*(1 + self.noise*self.rng.standard_normal())
+                + dark*(1 + self.darkNoise*self.rng.standard_normal()))
+
+    #Replaces hardware stages and meter of an alignment module with the
+    #simulated ones
+    #Parameters: module exposing stage list s and read_dmm (processes)
+    #No return
+    def install(self, module):
+
+        module.s[:] = self.stages
+        module.read_dmm = self.read_dmm
+        module.trigger_dmm = self.trigger
+        module.fetch_dmm = self.fetch
+        module.clock = self.time
+        module.shutter = self.setShutter
+        module.read_block = self.read_block
+        module.sleep = self.sleep
+
+    #Opens or closes the simulated shutter (drop-in replacement for a shutter
+    #driver)
+    def setShutter(self, opened):
+
+        self.shutter = opened
+
+    #Current simulated time (drop-in replacement for time.monotonic) [s]
+    def time(self):
+
+        return self.clock.t
+
+    #Waits in simulated time (drop-in replacement for time.sleep)
+    def sleep(self, t):
+
+        self.clock.advance(self.clock.t + t)
+
+    #Total number of moves issued to all stages
+    def moves(self):
+
+        return sum(stage.moves for stage in self.stages)
+
+    #Total distance travelled by all stages [micrometres]
+    def travel(self):
+
+        return sum(stage.travel for stage in self.stages)/cntsPerUm
+
+    #Distance of stages from beam centre at current time (x, y, z)
+    #[micrometres]
+    def error(self):
+
+        pos = np.array([stage.get_position() for stage in self.stages])
+
+        return (pos - self.beam.centreAt(self.clock.t))/cntsPerUm
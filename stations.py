@@ -0,0 +1,283 @@
+#Multi-station orchestrator: several alignment rigs on one controller PC, each
+#driven by its own worker process (which holds that station's stages, meter and
+#alignment state), pulling DUT jobs from a shared queue
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import numpy as np
+
+import headless
+import session
+import simulation
+
+#_______________________________________________________________________________
+
+#Alignment station: one rig with its stages, parameters and log. The alignment
+#processes keep their state in module globals (processes.py), so every station
+#runs in a worker process of its own, which gives it a private copy of that
+#state
+
+#Parameters: station name, serial numbers of x, y, z stages, dictionary of
+#parameter overrides (headless.py) for all jobs of the station, profile name,
+#beam centre offset of a simulated rig [micrometres] (None for hardware), seed
+#of the simulated rig
+
+class Station:
+
+    def __init__(self, name, stages=("", "", ""), params=None, profile=None,
+                 simulate=None, seed=None):
+
+        self.name = name
+        self.stages = list(stages)
+        self.params = dict(params or {})
+        self.profile = profile
+        self.simulate = simulate
+        self.seed = seed
+
+    #Path of a station's own copy of a file (station name added before the
+    #extension), so stations do not write to the same file
+    #Parameters: path of file
+    #Returns path of station file
+    def path(self, path):
+
+        root, ext = os.path.splitext(path)
+
+        return root + "-" + self.name + ext
+
+    #Opens the station (stages, or simulated rig)
+    #Returns open session.Session
+    def open(self):
+
+        rig = None
+
+        if self.simulate is not None:
+            centre = (headless.parameters["centPos"][1]
+                      + np.asarray(self.simulate, dtype=float)*simulation.cntsPerUm)
+            rig = simulation.Rig(simulation.Beam(centre), seed=self.seed)
+
+        return session.Session(self.stages, rig)
+
+    #Parameters of a job on this station: station parameters overridden by job
+    #parameters, with recipe, trace, profile, summary, dark calibration and
+    #checkpoint files of the station (recipes and checkpoints hold positions of
+    #this station's stages, and dark calibrations depend on the station's meter)
+    #Parameters: dictionary of job parameters
+    #Returns dictionary of parameters
+    def jobParams(self, params):
+
+        merged = dict(self.params, **params)
+        merged.setdefault("recipeFile", headless.parameters["recipeFile"][1])
+        merged.setdefault("summaryFile", headless.parameters["summaryFile"][1])
+
+        for name in ("recipeFile", "summaryFile", "traceFile", "profileFile", "darkFile",
+                     "checkpointFile"):
+            if merged.get(name):
+                merged[name] = self.path(merged[name])
+
+        return merged
+
+#_______________________________________________________________________________
+
+#Worker process of a station: opens the station once and runs jobs from the
+#shared queue until it gets None, writing progress messages to the station log
+
+#Parameters: station, shared job queue, result queue, directory of station logs
+#No return
+
+def runStation(station, jobs, results, logDir):
+
+    with open(os.path.join(logDir, station.name + ".log"), "a") as log, \
+         contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+
+        try:
+            rig = station.open()
+
+        except Exception as e:
+
+            results.put({"station": station.name, "job": None, "status": "error",
+                         "error": "station did not open: " + type(e).__name__ + ": "
+                         + str(e)})
+            return
+
+        print("Station " + station.name + " open", flush=True)
+
+        try:
+
+            while True:
+
+                job = jobs.get()
+
+                if job is None:
+                    break
+
+                index, params, beam = job
+                print("Job " + str(index) + " (DUT " + str(params.get("dutID")) + ")",
+                      flush=True)
+
+                try:
+                    result = rig.align(station.jobParams(params), station.profile, beam)
+
+                except ValueError as e:
+                    result = {"status": "error", "error": "ValueError: " + str(e)}
+
+                log.flush()
+                results.put(dict(result, station=station.name, job=index))
+
+        finally:
+            rig.close()
+            print("Station " + station.name + " closed", flush=True)
+
+#_______________________________________________________________________________
+
+#Orchestrator running jobs on all stations in parallel (each job goes to the
+#next free station)
+
+#Parameters: list of stations, directory of station logs
+
+class Orchestrator:
+
+    def __init__(self, stations, logDir="."):
+
+        names = [station.name for station in stations]
+
+        if len(set(names)) != len(names):
+            raise ValueError("station names must be unique")
+
+        os.makedirs(logDir, exist_ok=True)
+
+        self.stations = stations
+        self.jobs = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.submitted = 0
+        self.received = 0
+
+        self.workers = [multiprocessing.Process(target=runStation, name=station.name,
+                                                args=(station, self.jobs, self.results,
+                                                      logDir))
+                        for station in stations]
+
+        for worker in self.workers:
+            worker.start()
+
+    #Queues a job
+    #Parameters: dictionary of job parameters (e.g. dutID), beam centre offset
+    #for simulated stations [micrometres] (None to keep the current beam)
+    #Returns index of the job
+    def submit(self, params, beam=None):
+
+        self.jobs.put((self.submitted, dict(params), beam))
+        self.submitted += 1
+
+        return self.submitted - 1
+
+    #Waits for the next finished job
+    #Parameters: timeout [s] (None to wait indefinitely)
+    #Returns result dictionary (with station name and job index), or None on
+    #timeout
+    def next(self, timeout=None):
+
+        try:
+            result = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        if result["job"] is not None:
+            self.received += 1
+
+        return result
+
+    #Results of all submitted jobs, in order of completion (waits while any
+    #station is still running)
+    def collect(self):
+
+        while self.received < self.submitted:
+
+            result = self.next(1.0)
+
+            if result is not None:
+                yield result
+
+            elif not any(worker.is_alive() for worker in self.workers):
+                break
+
+    #Stops the stations once all queued jobs are taken
+    def close(self):
+
+        for worker in self.workers:
+            self.jobs.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+#_______________________________________________________________________________
+
+#Loads stations from a JSON file ({"stations": [{"name": ..., "stages": [...],
+#"params": {...}, "profile": ..., "simulate": [x, y, z], "seed": ...}, ...]})
+
+#Parameters: path of stations file
+
+#Returns list of stations
+
+def loadStations(path):
+
+    with open(path) as f:
+        data = json.load(f)
+
+    return [Station(**entry) for entry in data["stations"]]
+
+#_______________________________________________________________________________
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run alignment jobs on several "
+                                     "stations in parallel")
+    parser.add_argument("stations", help="JSON file of stations")
+    parser.add_argument("jobs", help="JSON file of jobs (list of {\"params\": {...}, "
+                        "\"beam\": [x, y, z]} or of parameter dictionaries)")
+    parser.add_argument("--logs", default="logs", help="directory of station logs")
+    parser.add_argument("--results", help="file to write results to (JSON lines; "
+                        "default: stdout)")
+    args = parser.parse_args()
+
+    with open(args.jobs) as f:
+        jobList = json.load(f)
+
+    orchestrator = Orchestrator(loadStations(args.stations), args.logs)
+
+    for job in jobList:
+        if "params" in job:
+            orchestrator.submit(job["params"], job.get("beam"))
+        else:
+            orchestrator.submit(job)
+
+    out = open(args.results, "w") if args.results else sys.stdout
+    counts = {"aligned": 0, "failed": 0, "error": 0}
+
+    try:
+
+        for result in orchestrator.collect():
+
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            counts[result["status"]] += 1
+
+            print("Job " + str(result["job"]) + " on " + result["station"] + ": "
+                  + result["status"], file=sys.stderr)
+
+    finally:
+
+        orchestrator.close()
+
+        if out is not sys.stdout:
+            out.close()
+
+    print(str(counts["aligned"]) + " aligned, " + str(counts["failed"]) + " failed, "
+          + str(counts["error"]) + " errors", file=sys.stderr)
+
+    sys.exit(headless.EXIT_ALIGNED if counts["aligned"] == len(jobList)
+             else headless.EXIT_FAILED)
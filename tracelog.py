@@ -0,0 +1,149 @@
+#Streaming trace log of stage moves and meter readings, recorded to a
+#preallocated binary file (NumPy memmap) in chunks, and loader of such traces
+
+import json
+import os
+import numpy as np
+
+#Kinds of trace events (absolute move, relative move, meter reading)
+MOVETO = 0
+MOVEBY = 1
+READ = 2
+
+#Record of a trace event: time [s], kind, index of moved stage (-1 for
+#readings), commanded position or distance [encoder counts] (NaN for readings),
+#current positions of stages (x, y, z) [encoder counts], reading (NaN for
+#moves), phase code
+recordType = np.dtype([("t", "<f8"), ("kind", "i1"), ("axis", "i1"),
+                       ("commanded", "<f8"), ("pos", "<f8", (3,)),
+                       ("reading", "<f8"), ("phase", "<u2")])
+
+#_______________________________________________________________________________
+
+#Trace recorder: events are written into an in-memory chunk, which is copied
+#to the memmapped file (grown by its capacity when full) once it fills up. A
+#JSON header next to the file (path + ".json") holds the number of records and
+#the phase names
+
+#Parameters: path of trace file, initial capacity of file [records], number of
+#records per chunk
+
+class TraceLog:
+
+    def __init__(self, path, capacity=1 << 20, chunk=4096):
+
+        self.path = path
+        self.capacity = capacity
+        self.chunk = np.zeros(chunk, dtype=recordType)
+
+        #Number of records in chunk and in file
+        self.fill = 0
+        self.count = 0
+
+        #Phase codes by name, and names in order of code
+        self.codes = {}
+        self.phases = []
+
+        with open(path, "wb") as f:
+            f.truncate(capacity*recordType.itemsize)
+
+        self.file = np.memmap(path, dtype=recordType, mode="r+", shape=(capacity,))
+        self._writeHeader()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+    #Records an event
+    #Parameters: time [s], kind, index of stage, commanded position or
+    #distance, current positions of stages, reading, phase name
+    #No return
+    def record(self, t, kind, axis, commanded, pos, reading, phase):
+
+        code = self.codes.get(phase)
+
+        if code is None:
+            code = self.codes[phase] = len(self.phases)
+            self.phases.append(phase)
+
+        self.chunk[self.fill] = (t, kind, axis, commanded, pos, reading, code)
+        self.fill += 1
+
+        if self.fill == len(self.chunk):
+            self.flush()
+
+    #Copies recorded chunk to file
+    def flush(self):
+
+        if self.fill == 0:
+            return
+
+        #File grows by its initial capacity when full
+        if self.count + self.fill > len(self.file):
+
+            size = len(self.file) + max(self.capacity, self.fill)
+            self.file.flush()
+            del self.file
+
+            with open(self.path, "r+b") as f:
+                f.truncate(size*recordType.itemsize)
+
+            self.file = np.memmap(self.path, dtype=recordType, mode="r+", shape=(size,))
+
+        self.file[self.count:self.count + self.fill] = self.chunk[:self.fill]
+        self.file.flush()
+
+        self.count += self.fill
+        self.fill = 0
+        self._writeHeader()
+
+    #Flushes remaining records and trims file to them
+    def close(self):
+
+        self.flush()
+        del self.file
+
+        with open(self.path, "r+b") as f:
+            f.truncate(self.count*recordType.itemsize)
+
+    #Writes header with number of records and phase names
+    def _writeHeader(self):
+
+        tmp = self.path + ".json.tmp"
+
+        with open(tmp, "w") as f:
+            json.dump({"count": self.count, "phases": self.phases,
+                       "dtype": recordType.descr}, f)
+
+        os.replace(tmp, self.path + ".json")
+
+#_______________________________________________________________________________
+
+#Loads a trace written by TraceLog
+
+#Parameters: path of trace file
+
+#Returns dictionary of record fields as NumPy arrays (t, kind, axis,
+#commanded, pos, reading, phase) and list of phase names (indexed by phase
+#code)
+
+def loadTrace(path):
+
+    with open(path + ".json") as f:
+        header = json.load(f)
+
+    #Record type as written (traces of older versions may differ)
+    dtype = np.dtype([(field[0], field[1]) if len(field) == 2
+                      else (field[0], field[1], tuple(field[2]))
+                      for field in header["dtype"]])
+
+    records = np.fromfile(path, dtype=dtype, count=header["count"])
+
+    trace = {name: records[name].copy() for name in dtype.names}
+    trace["phases"] = header["phases"]
+
+    return trace
@@ -0,0 +1,211 @@
+#Closed-loop drift tracking after alignment: small dither moves on x, y and z
+#around the aligned position give the local slope and curvature of the
+#photocurrent (lock-in style demodulation of a few readings), and small
+#corrective moves keep the stages on the peak while the DUT is characterized
+
+import contextlib
+import math
+import threading
+import numpy as np
+
+import processes
+
+#Encoder counts per micrometre of stage travel
+cntsPerUm = 34.304
+
+#_______________________________________________________________________________
+
+#Drift tracker run between (or alongside) measurements on the aligned DUT.
+#Each cycle reads the centre and both dither points of every axis, estimates
+#the offset of the peak from a parabola through the three readings (clipped to
+#the dither amplitude), and moves a fraction of that offset. Cycles repeat at a
+#fixed period, so the stages are idle for the rest of it; the peak is lost when
+#the centre reading falls below a fraction of the reading at the start
+
+#Parameters: dither amplitude of x, y, z [micrometres], number of readings
+#averaged per dither point, fraction of the estimated offset corrected per
+#cycle, cycle period [s], fraction of the starting signal (above dark current)
+#below which the peak is lost, dark current for DUT
+
+class DriftTracker:
+
+    def __init__(self, amplitude=(0.5, 0.5, 5.0), reads=1, gain=0.5, period=10.0,
+                 lossFact=0.5, darkCur=0.0):
+
+        self.amplitude = [a*cntsPerUm for a in amplitude]
+        self.reads = reads
+        self.gain = gain
+        self.period = period
+        self.lossFact = lossFact
+        self.darkCur = darkCur
+
+        #Centre reading that losses are judged against (set by first cycle)
+        self.reference = None
+        self.lost = False
+
+        #Tracked positions and centre readings, one row per cycle (time [s],
+        #x, y, z [encoder counts], reading)
+        self.history = []
+
+        #Time spent dithering, time tracking started, number of re-alignments
+        self.busy = 0.0
+        self.tStart = None
+        self.realigns = 0
+
+        #Lock held during a cycle (hold() pauses tracking with it), and thread
+        #and stop request of background tracking
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    #Mean of fresh readings at the current position
+    def _read(self):
+
+        return sum(processes.measure(True) for count in range(self.reads))/self.reads
+
+    #Runs one dither cycle on all axes
+    #No parameters
+    #Returns True if the peak is still tracked and False if it was lost
+    def cycle(self):
+
+        with self.lock:
+
+            t = processes.clock()
+            centre = self._read()
+
+            if self.reference is None:
+                self.reference = centre
+
+            self.history.append([t] + [processes.s[ID].posCur for ID in range(3)]
+                                + [centre])
+
+            if centre - self.darkCur < self.lossFact*(self.reference - self.darkCur):
+
+                self.lost = True
+                self.busy += processes.clock() - t
+
+                return False
+
+            for ID in range(3):
+
+                a = self.amplitude[ID]
+                pos = processes.s[ID].posCur
+
+                #Known position follows every dither move, so a reading or
+                #move that fails partway leaves it where the stage is
+                processes.moveTo(ID, pos + a)
+                processes.s[ID].posCur = pos + a
+                plus = self._read()
+
+                processes.moveTo(ID, pos - a)
+                processes.s[ID].posCur = pos - a
+                minus = self._read()
+
+                #Slope and curvature of readings over the dither (first and
+                #second harmonic of the dither demodulated)
+                slope = (plus - minus)/(2*a)
+                curve = (plus + minus - 2*centre)/a**2
+
+                #Vertex of the parabola when curved downwards, otherwise a
+                #full amplitude step uphill
+                if curve < 0:
+                    offset = max(-a, min(a, -slope/curve))
+                else:
+                    offset = math.copysign(a, slope)
+
+                step = self.gain*offset
+                processes.moveTo(ID, pos + step)
+                processes.s[ID].posCur = pos + step
+
+                #Reading expected at the corrected position is the centre of the
+                #next axis
+                centre += slope*step + curve*step**2/2
+
+            self.busy += processes.clock() - t
+
+        return True
+
+    #Tracks the peak for a given time (in the calling thread), re-aligning when
+    #the peak is lost
+    #Parameters: tracking time [s] (infinite until stop()), function called
+    #when the peak is lost, returning True once re-aligned (None to stop
+    #tracking instead)
+    #Returns True if the peak was tracked for the whole time and False otherwise
+    def run(self, duration=math.inf, onLost=None):
+
+        processes.setPhase("track")
+
+        if self.tStart is None:
+            self.tStart = processes.clock()
+
+        tEnd = processes.clock() + duration
+
+        while processes.clock() < tEnd and not self.stopping.is_set():
+
+            tNext = processes.clock() + self.period
+
+            if not self.cycle():
+
+                print("Peak lost while tracking: re-alignment required")
+
+                if onLost is None or not onLost():
+                    return False
+
+                #Tracking resumes from the re-aligned peak
+                self.realigns += 1
+                self.reference = None
+                self.lost = False
+                processes.setPhase("track")
+
+            processes.sleep(max(0.0, min(tNext, tEnd) - processes.clock()))
+
+        return True
+
+    #Starts tracking in a background thread
+    #Parameters: as run()
+    #No return
+    def start(self, duration=math.inf, onLost=None):
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, args=(duration, onLost),
+                                       daemon=True)
+        self.thread.start()
+
+    #Stops background tracking after the current cycle
+    def stop(self):
+
+        self.stopping.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    #Pauses tracking while a measurement needs the stages still (and the meter
+    #free): use as "with tracker.hold(): ..."
+    @contextlib.contextmanager
+    def hold(self):
+
+        with self.lock:
+            yield
+
+    #Summary of tracking: duration, number of cycles and re-alignments, duty
+    #cycle (share of time spent dithering), drift of tracked position from the
+    #first cycle [micrometres] and mean drift rate [micrometres/min]
+    #Returns dictionary of summary values, with drift history (time [s], x, y,
+    #z [micrometres], reading per cycle)
+    def report(self):
+
+        hist = np.array(self.history, dtype=float).reshape(-1, 5)
+        elapsed = processes.clock() - self.tStart if self.tStart is not None else 0.0
+
+        drift = ((hist[-1, 1:4] - hist[0, 1:4])/cntsPerUm if len(hist)
+                 else np.zeros(3))
+        span = hist[-1, 0] - hist[0, 0] if len(hist) else 0.0
+
+        return {"duration": elapsed, "cycles": len(hist), "realigns": self.realigns,
+                "lost": self.lost,
+                "dutyCycle": self.busy/elapsed if elapsed else 0.0,
+                "drift": drift.tolist(),
+                "driftRate": (60*drift/span).tolist() if span else [0.0]*3,
+                "history": np.column_stack((hist[:, 0], hist[:, 1:4]/cntsPerUm,
+                                            hist[:, 4])).tolist()}